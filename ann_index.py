@@ -0,0 +1,70 @@
+# Approximate nearest neighbour indexes for RAGRetriever.
+#
+# RAGRetriever always keeps an exact flat index, which it updates file by file.
+# For large corpora a serving index of another type is built from it:
+#
+#   flat    exact search (the default)
+#   ivf     vectors bucketed by k-means cell; tune recall with nprobe
+#   hnsw    graph search; tune recall with ef_search
+#   ivfpq   ivf with product-quantized vectors: one byte per 8 dimensions,
+#           32x smaller than float32 (PQ48 at dim 384)
+#   sq8     8-bit scalar quantization, 4x smaller
+#
+# Any other value is passed to faiss.index_factory as is, e.g. "IVF4096,PQ32".
+import math
+import faiss
+import numpy as np
+
+INDEX_TYPES = ["flat", "ivf", "hnsw", "ivfpq", "sq8"]
+# k-means wants about this many training points per centroid
+POINTS_PER_CENTROID = 39
+ADD_BATCH = 65536
+
+def factory_string(index_type, ntotal, dim):
+    nlist = max(1, min(int(4 * math.sqrt(ntotal)), ntotal // POINTS_PER_CENTROID))
+    if index_type == "flat" or ntotal == 0:
+        return "Flat"
+    if index_type == "ivf":
+        return f"IVF{nlist},Flat"
+    if index_type == "hnsw":
+        return "HNSW32"
+    if index_type == "ivfpq":
+        # Product quantization trains 256 centroids per sub-vector
+        if ntotal < 256 * POINTS_PER_CENTROID:
+            print(f"Warning: {ntotal} vectors are too few to train ivfpq; using ivf")
+            return f"IVF{nlist},Flat"
+        m = max(d for d in range(1, dim // 8 + 1) if dim % d == 0)
+        return f"IVF{nlist},PQ{m}"
+    if index_type == "sq8":
+        return "SQ8"
+    return index_type
+
+def build_index(source, index_type, train_size=100000, seed=0):
+    # Build a serving index from the vectors of an existing index. Vector ids
+    # keep their positions, so the source's id -> document mapping still holds.
+    # Returns the index and the factory string it was built from.
+    ntotal, dim = source.ntotal, source.d
+    spec = factory_string(index_type, ntotal, dim)
+    index = faiss.index_factory(dim, spec, source.metric_type)
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(ntotal, size=min(train_size, ntotal), replace=False)).astype("int64")
+        index.train(source.reconstruct_batch(sample))
+    for start in range(0, ntotal, ADD_BATCH):
+        index.add(source.reconstruct_n(start, min(ADD_BATCH, ntotal - start)))
+    return index, spec
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    # Parameters that don't apply to the index type are ignored
+    if nprobe is not None and faiss.try_extract_index_ivf(index) is not None:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+def read_index(path, mmap=False):
+    # A memory-mapped index is read-only and its pages are shared by every
+    # process that maps the same file
+    if not mmap:
+        return faiss.read_index(path)
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
@@ -1,157 +1,129 @@
 import streamlit as st
-import pyttsx3
-from fpdf import FPDF
 import random
 import os
+import re
+import threading
 import time
-from ollama_client import OllamaClient
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from exports import narrate_story, render_pdf, export_audio, export_gallery_pdf, export_gallery_zip, story_version, warm_imports
+from jobs import JobExecutor, QUEUED, RUNNING, DONE, FAILED, CANCELLED
+from metrics import metrics, start_metrics_server
+from model_manager import ModelManager, same_model
+from ollama_client import OllamaError
+from ollama_pool import parse_backends
+from story_parser import StoryStreamParser
+from story_pipeline import section_count, stream_story_pipeline
+from story_store import StoryStore
+from storyteller import TWIST_STYLES, RAG_QUERIES, MODEL, KEEP_ALIVE, OLLAMA_BACKENDS, OLLAMA_HOST, OLLAMA_PORT, add_chapter, continuation_request, get_generation_cache, get_ollama_pool, get_scheduler, get_story_prefetcher, random_settings, retrieve_context, sampling_options, schedule_prompt, stream_story
 
 # Constants
-MODEL = "llama2"
-GENRES = ["Fantasy", "Sci-Fi", "Mystery", "Romance", "Horror", "Adventure", "Comedy", "Drama"]
-TWIST_STYLES = ["Betrayal", "Identity Reveal", "Time Loop", "Supernatural Element", "Redemption", "Tragedy", "Victory"]
 VOICE_STYLES = ["Narrator", "Horror", "Child", "Epic"]
-TONES = ["Dark", "Whimsical", "Poetic", "Satirical"]
-
-# Prompt template
-PROMPT_TEMPLATE = """
-You are an imaginative author who crafts unforgettable stories.
-Your task is to generate a story experience based on the following inputs:
-- Genre: {genre}
-- Characters: {num_characters} unique characters
-- Twist Style: {twist_style}
-- Story Length: about {story_length} words
-- Tone: {tone}
-{retrieved_context}
-Instructions:
-- Characters: Create {num_characters} characters with distinct names, traits, backstories, and personal conflicts. Each character should have a secret or hidden agenda that can fuel the twist.
-- World-building: Describe the setting with vivid sensory details. Add cultural, historical, or fantastical elements appropriate to {genre}.
-- Plot Development: Build tension as the characters' goals clash. Include dialogue that reveals personality and foreshadows the twist.
-- Plot Twist: Introduce a {twist_style} twist near the end that dramatically changes how the reader understands the story. Ensure the twist feels surprising but logical in hindsight.
-- Style: Use rich, cinematic prose. Balance action, description, and dialogue. Keep it engaging and immersive.
-Output Format (follow exactly):
-Characters:
-- Character 1 bio
-- Character 2 bio
-Setting:
-Setting description paragraph
-Story:
-Story narrative with twist
-Twist:
-Twist explanation
-"""
-
-# Function to generate story
-def generate_story(genre, num_characters, twist_style, story_length, tone, retrieved_context=""):
-    prompt = PROMPT_TEMPLATE.format(
-        genre=genre,
-        num_characters=num_characters,
-        twist_style=twist_style,
-        story_length=story_length,
-        tone=tone,
-        retrieved_context=retrieved_context
-    )
-    client = OllamaClient(model=MODEL)
-    return client.generate(prompt)
-
-# Function to parse story
-def parse_story(text):
-    lines = text.split('\n')
-    characters = []
-    setting = []
-    story = []
-    twist = []
-    current_section = None
-    for line in lines:
-        stripped = line.strip()
-        if stripped == 'Characters:':
-            current_section = 'characters'
-            continue
-        elif stripped == 'Setting:':
-            current_section = 'setting'
-            continue
-        elif stripped == 'Story:':
-            current_section = 'story'
-            continue
-        elif stripped == 'Twist:':
-            current_section = 'twist'
-            continue
-        if current_section == 'characters':
-            if stripped.startswith('-'):
-                characters.append(stripped[1:].strip())
-            elif stripped and not stripped.startswith(('Setting:', 'Story:', 'Twist:')):
-                characters.append(stripped)
-        elif current_section == 'setting':
-            if stripped and not stripped.startswith(('Story:', 'Twist:')):
-                setting.append(stripped)
-        elif current_section == 'story':
-            if stripped and not stripped.startswith('Twist:'):
-                story.append(stripped)
-        elif current_section == 'twist':
-            if stripped:
-                twist.append(stripped)
-    return characters, ' '.join(setting), ' '.join(story), ' '.join(twist)
-
-# TTS function
-def narrate_story(text, voice_style):
-    engine = pyttsx3.init()
-    voices = engine.getProperty('voices')
-    if voice_style == "Narrator":
-        if voices:
-            engine.setProperty('voice', voices[0].id)
-    elif voice_style == "Horror":
-        if voices:
-            engine.setProperty('voice', voices[0].id)
-        engine.setProperty('rate', 150)
-    elif voice_style == "Child":
-        if len(voices) > 1:
-            engine.setProperty('voice', voices[1].id)
-        engine.setProperty('rate', 200)
-    elif voice_style == "Epic":
-        if voices:
-            engine.setProperty('voice', voices[0].id)
-        engine.setProperty('rate', 120)
-    engine.say(text)
-    engine.runAndWait()
-
-# Export to PDF
-def export_pdf(characters, setting, story, twist, filename):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-    pdf.cell(200, 10, txt="AI Storyteller", ln=True, align='C')
-    pdf.cell(200, 10, txt="Characters:", ln=True)
-    for char in characters:
-        pdf.multi_cell(0, 10, "- " + char)
-    pdf.cell(200, 10, txt="Setting:", ln=True)
-    pdf.multi_cell(0, 10, setting)
-    pdf.cell(200, 10, txt="Story:", ln=True)
-    pdf.multi_cell(0, 10, story)
-    pdf.cell(200, 10, txt="The Twist Explained:", ln=True)
-    pdf.multi_cell(0, 10, twist)
-    pdf.output(filename)
-
-# Export audio
-def export_audio(text, voice_style, filename):
-    engine = pyttsx3.init()
-    voices = engine.getProperty('voices')
-    if voice_style == "Narrator":
-        if voices:
-            engine.setProperty('voice', voices[0].id)
-    elif voice_style == "Horror":
-        if voices:
-            engine.setProperty('voice', voices[0].id)
-        engine.setProperty('rate', 150)
-    elif voice_style == "Child":
-        if len(voices) > 1:
-            engine.setProperty('voice', voices[1].id)
-        engine.setProperty('rate', 200)
-    elif voice_style == "Epic":
-        if voices:
-            engine.setProperty('voice', voices[0].id)
-        engine.setProperty('rate', 120)
-    engine.save_to_file(text, filename)
-    engine.runAndWait()
+# Directory of PDFs to index for RAG; falls back to story.pdf when unset
+RAG_CORPUS_DIR = os.environ.get("RAG_CORPUS_DIR")
+# Serving index for RAG (see ann_index.py) and whether to memory-map it
+RAG_INDEX_TYPE = os.environ.get("RAG_INDEX_TYPE", "flat")
+RAG_NPROBE = int(os.environ.get("RAG_NPROBE", "16"))
+RAG_EF_SEARCH = int(os.environ.get("RAG_EF_SEARCH", "64"))
+RAG_MMAP = os.environ.get("RAG_MMAP", "") == "1"
+# Build the RAG index in the background after the first page has rendered,
+# even before anyone enables RAG; set to 0 to build it only on first use
+RAG_WARMUP = os.environ.get("RAG_WARMUP", "1") == "1"
+# Exports are written here by background jobs, then handed to the browser
+EXPORT_DIR = os.path.join(".cache", "exports")
+JOB_WORKERS = int(os.environ.get("STORYTELLER_JOB_WORKERS", "2"))
+JOB_LABELS = {"narrate": "🎤 Narration", "pdf": "📄 PDF export", "audio": "🎵 Audio export",
+              "gallery_pdf": "📚 Gallery PDF export", "gallery_zip": "📦 Gallery ZIP export"}
+DOWNLOADS = {"pdf": ("Download PDF", "story.pdf"), "audio": ("Download Audio", "story.wav"),
+             "gallery_pdf": ("Download Gallery PDF", "stories.pdf"), "gallery_zip": ("Download Gallery ZIP", "stories.zip")}
+# Stories per page in the sidebar gallery
+GALLERY_PAGE_SIZE = 20
+# Port for the Prometheus /metrics endpoint; disabled when unset
+METRICS_PORT = os.environ.get("STORYTELLER_METRICS_PORT")
+# The typewriter effect takes at most this long, in at most this many frames
+# per second, however long the story
+TYPEWRITER_SECONDS = float(os.environ.get("STORYTELLER_TYPEWRITER_SECONDS", "1.5"))
+TYPEWRITER_FPS = 20
+MODEL_STATUS = {
+    "warm": "🟢 Model loaded",
+    "loading": "🟡 Loading model...",
+    "cold": "⚪ Model not loaded; the next story will load it",
+    "error": "🔴 Could not load model",
+}
+
+# Markdown preview of the sections parsed so far
+def live_preview(characters, setting, story, twist):
+    parts = []
+    if characters:
+        parts.append("**👥 Characters**\n\n" + "\n".join(f"- **{char}**" for char in characters))
+    if setting:
+        parts.append("**🌍 Setting**\n\n" + setting)
+    if story:
+        parts.append(f'**✨ The Story**\n\n<span class="typewriter">{story}</span>')
+    if twist:
+        parts.append("**😱 The Twist**\n\n" + twist)
+    return "\n\n".join(parts)
+
+# Reveal text word by word on a fixed frame budget: each frame shows the words
+# due by then, so a long story reveals more per frame instead of taking longer
+def typewriter(placeholder, text, duration=TYPEWRITER_SECONDS, fps=TYPEWRITER_FPS):
+    ends = [match.end() for match in re.finditer(r"\S+", text)]
+    # Short texts at no more than 50 words a second
+    duration = min(duration, len(ends) / 50)
+    start = time.perf_counter()
+    elapsed = 0.0
+    while ends and elapsed < duration:
+        shown = ends[min(int(len(ends) * elapsed / duration), len(ends) - 1)]
+        placeholder.markdown(f'<span class="typewriter">{text[:shown]}</span>', unsafe_allow_html=True)
+        time.sleep(max(0.0, 1 / fps - (time.perf_counter() - start - elapsed)))
+        elapsed = time.perf_counter() - start
+    placeholder.markdown(text)
+
+# Stories already on screen in this session (streamed live, or animated
+# once) are shown without the typewriter effect
+def mark_shown(story):
+    st.session_state.shown_stories.add(story_version(story['characters'], story['setting'], story['story'], story['twist']))
+
+def already_shown(story):
+    return story_version(story['characters'], story['setting'], story['story'], story['twist']) in st.session_state.shown_stories
+
+# Show a scheduled generation's place in the queue until it starts
+def wait_for_turn(fragments, placeholder):
+    if not hasattr(fragments, "position"):
+        return
+    position = fragments.position()
+    while position > 0:
+        placeholder.info(f"⏳ Waiting for a free slot: {position} in the queue")
+        time.sleep(0.5)
+        position = fragments.position()
+    placeholder.markdown('<div class="typing-dots">🧠 AI is crafting your story</div>', unsafe_allow_html=True)
+
+# Render fragments into a placeholder as they arrive, filling in each section
+# as soon as the streaming parser can place it. Returns the raw text and the
+# parsed sections.
+def render_stream(fragments, placeholder, min_interval=0.05):
+    parser = StoryStreamParser()
+    raw_parts = []
+    last_render = 0.0
+    parse_time = render_time = 0.0
+    for fragment in fragments:
+        raw_parts.append(fragment)
+        start = time.perf_counter()
+        parser.feed(fragment)
+        parse_time += time.perf_counter() - start
+        now = time.monotonic()
+        if now - last_render >= min_interval:
+            start = time.perf_counter()
+            preview = live_preview(*parser.result()) or "".join(raw_parts)
+            placeholder.markdown(preview, unsafe_allow_html=True)
+            render_time += time.perf_counter() - start
+            last_render = now
+    start = time.perf_counter()
+    parser.close()
+    metrics.observe("parse_story", parse_time + time.perf_counter() - start)
+    metrics.observe("render_stream", render_time)
+    placeholder.empty()
+    return "".join(raw_parts), parser.result()
 
 # Custom CSS for Dark Fantasy Theme
 st.markdown("""
@@ -375,15 +347,171 @@ st.markdown("""
 st.markdown('<h1 class="main-header">📖 AI Storyteller</h1>', unsafe_allow_html=True)
 st.markdown("Create unique, AI-generated stories with custom parameters!")
 
-if 'stories' not in st.session_state:
-    st.session_state.stories = []
+# Main-area slot where stories are shown live while they are generated
+stream_placeholder = st.empty()
+
+if 'session_id' not in st.session_state:
+    # Identifies this session to the generation scheduler's fair queueing
+    st.session_state.session_id = uuid.uuid4().hex
 if 'current_story' not in st.session_state:
     st.session_state.current_story = None
+if 'shown_stories' not in st.session_state:
+    st.session_state.shown_stories = set()
 if 'use_rag' not in st.session_state:
     st.session_state.use_rag = False
+if 'jobs' not in st.session_state:
+    # Latest job id per kind ("narrate", "pdf", "audio") for this session
+    st.session_state.jobs = {}
+if 'downloads' not in st.session_state:
+    st.session_state.downloads = {}
+
+def build_retriever():
+    # Importing rag_retriever's dependencies (langchain, torch, faiss) is most
+    # of the cost, so it happens here rather than at the top of the app
+    from rag_retriever import RAGRetriever
+    with metrics.span("retriever_init"):
+        return RAGRetriever(corpus_dir=RAG_CORPUS_DIR, precompute_queries=RAG_QUERIES, index_type=RAG_INDEX_TYPE,
+                            nprobe=RAG_NPROBE, ef_search=RAG_EF_SEARCH, mmap=RAG_MMAP)
+
+# One retriever per process, shared by every session and rerun. It is built on
+# a background thread so the page never waits for it unless RAG is in use.
+@st.cache_resource
+def get_retriever_future():
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-init").submit(build_retriever)
+
+def get_retriever():
+    future = get_retriever_future()
+    with st.spinner("Loading RAG index..."):
+        try:
+            return future.result()
+        except Exception:
+            # Let the next rerun try again
+            get_retriever_future.clear()
+            raise
+
+@st.cache_resource
+def get_metrics_server():
+    if METRICS_PORT:
+        return start_metrics_server(int(METRICS_PORT))
+
+get_metrics_server()
+
+# Starts loading the default model in the background as soon as the app is up
+@st.cache_resource
+def get_model_manager():
+    # Every server in OLLAMA_BACKENDS, so none of them starts cold
+    servers = [(host, port) for host, port, _ in parse_backends(OLLAMA_BACKENDS)] if OLLAMA_BACKENDS else None
+    manager = ModelManager(OLLAMA_HOST, OLLAMA_PORT, KEEP_ALIVE, servers=servers)
+    manager.preload(MODEL)
+    return manager
+
+model_manager = get_model_manager()
+
+# Narration and exports run on a process-wide worker pool instead of the
+# script thread
+@st.cache_resource
+def get_job_executor():
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    return JobExecutor(max_workers=JOB_WORKERS)
+
+job_executor = get_job_executor()
+
+# Every session's stories, on disk; a session only keeps the story it has open
+@st.cache_resource
+def get_story_store():
+    return StoryStore()
+
+story_store = get_story_store()
+
+# "Find similar stories" embeds stories with the RAG retriever's model
+@st.cache_resource
+def get_similar_stories(_retriever):
+    from story_search import SimilarStories
+    return SimilarStories(story_store, _retriever.embeddings, _retriever.embedding_model)
+
+def index_stories(similar):
+    # One background embedding job at a time; it picks up every story saved
+    # before it runs
+    status = job_executor.status(similar.index_job) if similar.index_job else None
+    if status is None or status["status"] not in (QUEUED, RUNNING):
+        similar.index_job = job_executor.submit("index_stories", similar.update)
+
+def update_similar_stories():
+    # Embed new and continued stories in the background, but only once the
+    # retriever is up; stories saved before then are embedded on first use
+    future = get_retriever_future()
+    if future.done() and future.exception() is None:
+        similar = get_similar_stories(future.result())
+        index_stories(similar)
+        return similar
+
+def similar_stories():
+    # Stories saved before the retriever was up are embedded the first time
+    # similar stories are asked for
+    similar = get_similar_stories(get_retriever())
+    if similar.index_job is None:
+        index_stories(similar)
+    return similar
+
+def submit_job(kind, fn, *args):
+    previous = st.session_state.jobs.get(kind)
+    if previous:
+        job_executor.cancel(previous)
+    st.session_state.jobs[kind] = job_executor.submit(kind, fn, *args)
+
+def export_path(suffix):
+    return os.path.join(EXPORT_DIR, f"{time.time_ns()}-{random.getrandbits(32):08x}{suffix}")
+
+def job_panel():
+    for kind, job_id in list(st.session_state.jobs.items()):
+        status = job_executor.status(job_id)
+        if status is None:
+            del st.session_state.jobs[kind]
+            continue
+        label = JOB_LABELS[kind]
+        if status["status"] in (QUEUED, RUNNING):
+            progress_col, cancel_col = st.columns([4, 1])
+            progress_col.progress(status["progress"], text=f"{label}: {status['status']}")
+            if cancel_col.button("✖ Cancel", key=f"cancel_{job_id}"):
+                job_executor.cancel(job_id)
+            # Narration can start playing as soon as its first chunk is ready
+            if kind == "narrate" and status["partial"]:
+                try:
+                    with open(status["partial"][0], "rb") as f:
+                        st.audio(f.read(), format="audio/wav")
+                except FileNotFoundError:
+                    # Pruned from the TTS cache as the narration finished;
+                    # the joined narration follows on the next rerun
+                    pass
+        elif status["status"] == DONE:
+            # Read the result into the session once. PDFs arrive as bytes;
+            # exports written to per-job files are removed, narrations belong
+            # to the TTS cache and stay.
+            if job_id not in st.session_state.downloads:
+                data = job_executor.result(job_id)
+                if not isinstance(data, bytes):
+                    path = data
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    if kind in DOWNLOADS:
+                        os.remove(path)
+                current = set(st.session_state.jobs.values())
+                st.session_state.downloads = {jid: d for jid, d in st.session_state.downloads.items() if jid in current}
+                st.session_state.downloads[job_id] = data
+            if kind in DOWNLOADS:
+                button_label, filename = DOWNLOADS[kind]
+                st.download_button(button_label, st.session_state.downloads[job_id], filename, key=f"download_{job_id}")
+            else:
+                st.audio(st.session_state.downloads[job_id], format="audio/wav")
+        elif status["status"] == FAILED:
+            st.error(f"{label} failed: {status['error']}")
+        elif status["status"] == CANCELLED:
+            st.info(f"{label} cancelled.")
 
-from rag_retriever import RAGRetriever
-retriever = RAGRetriever()
+# Where Streamlit supports fragments the panel refreshes itself every second
+# without rerunning the whole page
+if hasattr(st, "fragment"):
+    job_panel = st.fragment(run_every=1)(job_panel)
 
 # Layout redesign: two-column layout with collapsible sidebar
 
@@ -430,59 +558,120 @@ with st.sidebar.expander("🎛️ Story Controls", expanded=True):
 
     voice_style = st.selectbox("Voice Style", VOICE_STYLES, help="Narration voice style")
 
+    model_options = model_manager.available_models() or [MODEL]
+    default_model = next((i for i, name in enumerate(model_options) if same_model(name, MODEL)), 0)
+    model = st.selectbox("Model", model_options, index=default_model, help="Ollama model used for new stories")
+    # Load a newly selected model right away instead of on the first story
+    if st.session_state.get("preloaded_model") != model:
+        model_manager.preload(model)
+        st.session_state.preloaded_model = model
+    model_manager.mark_active(model)
+    model_status = model_manager.status(model)
+    if len(model_manager.servers) > 1:
+        st.caption(f"{MODEL_STATUS[model_status]} ({model_manager.warm_servers(model)}/{len(model_manager.servers)} servers)")
+    else:
+        st.caption(MODEL_STATUS[model_status])
+    if model_status == "error":
+        st.caption(model_manager.last_error(model))
+
+    seed = st.number_input("Seed (0 = random)", min_value=0, value=0, step=1, help="A fixed seed makes the same settings produce the same story")
+    seed = int(seed) or None
+    reuse_stories = st.checkbox("Reuse earlier stories", value=False,
+                                help="Without a seed, show a cached story written earlier for the same settings instead of a new one")
+    parallel_sections = st.checkbox("Write long stories in parallel sections", value=False,
+                                    help="Plan an outline first, then write the sections at the same time on free Ollama slots")
+
     use_rag = st.checkbox("Enable RAG (Retrieval-Augmented Generation)", value=st.session_state.use_rag)
     st.session_state.use_rag = use_rag
-
-    surprise_me = st.button("🎲 Surprise Me!", help="Randomize all settings")
+    if use_rag:
+        retriever = get_retriever()
+        if retriever.build_time is not None:
+            st.caption(f"RAG index updated in {retriever.build_time * 1000:.0f} ms")
+        elif retriever.load_time is not None:
+            st.caption(f"RAG {retriever.index_spec} index loaded from disk in {retriever.load_time * 1000:.0f} ms")
+
+    surprise_me = st.button("🎲 Surprise Me!", help="Randomize all settings and write a story")
+    # Pooled stories are generated with the default model, no seed and no RAG
+    # context, so only requests like that are answered from the pool, and the
+    # pool is only started by a Surprise Me that it could have answered
+    poolable = not use_rag and seed is None and same_model(model, MODEL)
+    prefetcher = get_story_prefetcher(create=surprise_me and poolable)
+    use_prefetched = prefetcher is not None and poolable
+    prefetched = None
     if surprise_me:
-        genre = random.choice(GENRES)
-        twist_style = random.choice(TWIST_STYLES)
-        num_characters = random.randint(2, 5)
-        story_length = random.randint(500, 2000)
-        tone = random.choice(TONES)
+        prefetched = prefetcher.take() if use_prefetched else None
+        settings = prefetched['settings'] if prefetched else random_settings()
+        genre, twist_style, tone = settings['genre'], settings['twist_style'], settings['tone']
+        num_characters, story_length = settings['num_characters'], settings['story_length']
         st.success(f"✨ Randomized settings applied!")
 
     generate = st.button("🚀 Generate Story", help="Create a new story")
-    if generate:
-        # Typing dots animation in spinner
-        spinner_placeholder = st.empty()
-        progress_bar = st.progress(0)
-
-        for i in range(100):
-            dots = "." * ((i // 10) % 4)
-            spinner_placeholder.markdown(f'<div class="typing-dots">🧠 AI is crafting your story{dots}</div>', unsafe_allow_html=True)
-            progress_bar.progress(i + 1)
-            time.sleep(0.05)  # Simulate processing time
-
-        spinner_placeholder.empty()
-        progress_bar.empty()
-
+    cache_stats = get_generation_cache().stats()
+    st.caption(f"Story cache: {cache_stats['memory_hits'] + cache_stats['disk_hits']} hits, {cache_stats['misses']} misses, {cache_stats['disk_entries']} stored")
+    queue_stats = get_scheduler().stats()
+    st.caption(f"Generation queue: {queue_stats['running']} writing, {queue_stats['queued']} waiting")
+    if prefetcher is not None:
+        prefetch_stats = prefetcher.stats()
+        st.caption(f"Surprise stories ready: {prefetch_stats['pooled']}/{prefetch_stats['target']}")
+    if generate and use_prefetched:
+        # Matched on genre, twist style and tone only: a pooled story with the
+        # same character count and exact word count as well is too rare
+        prefetched = prefetcher.take(genre=genre, twist_style=twist_style, tone=tone)
+    if generate or surprise_me:
         retrieved_context = ""
+        compaction = {}
         if st.session_state.use_rag:
-            query = f"Genre: {genre}, Twist Style: {twist_style}, Tone: {tone}"
-            retrieved_docs = retriever.retrieve(query)
-            if retrieved_docs:
-                retrieved_context = "\nContext from documents:\n" + "\n".join(retrieved_docs)
+            retrieved_context = retrieve_context(get_retriever(), genre, twist_style, tone, report=compaction)
+
+        stream_placeholder.markdown('<div class="typing-dots">🧠 AI is crafting your story</div>', unsafe_allow_html=True)
+        try:
+            generation_stats = {}
+            if prefetched:
+                fragments, from_cache = iter([prefetched['raw']]), False
+                generation_stats.update(prefetched['stats'])
             else:
-                retrieved_context = "\nNo relevant context found in documents."
-
-        raw_story = generate_story(genre, num_characters, twist_style, story_length, tone, retrieved_context)
-
-        if raw_story.startswith("Error"):
-            st.error(f"❌ {raw_story}")
+                stream = stream_story_pipeline if parallel_sections and section_count(story_length) > 1 else stream_story
+                fragments, from_cache = stream(genre, num_characters, twist_style, story_length, tone, retrieved_context,
+                                               seed=seed, use_cache=True if reuse_stories else None, stats=generation_stats,
+                                               model=model, session=st.session_state.session_id)
+                wait_for_turn(fragments, stream_placeholder)
+            raw_story, sections = render_stream(fragments, stream_placeholder)
+        except OllamaError as e:
+            stream_placeholder.empty()
+            st.error(f"❌ {e}")
         else:
-            characters, setting, story, twist = parse_story(raw_story)
+            if prefetched and generate:
+                pooled = prefetched['settings']
+                st.info(f"⚡ Written ahead of time while the server was idle, so there was no wait. Pooled stories "
+                        f"match genre, twist style and tone; this one has {pooled['num_characters']} characters "
+                        f"and about {pooled['story_length']} words.")
+            elif prefetched:
+                st.info("⚡ Written ahead of time while the server was idle, so there was no wait.")
+            elif from_cache and seed is not None:
+                st.info(f"⚡ Served from cache: identical to a fresh generation with seed {seed}.")
+            elif from_cache:
+                st.info("⚡ Served from cache: an earlier story for the same settings. Untick 'Reuse earlier stories' for a new one.")
+            if compaction:
+                saved = f" (~{compaction['prompt_eval_saved_s']:.1f} s of prompt evaluation saved)" if compaction['prompt_eval_saved_s'] else ""
+                st.caption(f"📎 Context compacted: {compaction['context_tokens_before']} → {compaction['context_tokens_after']} tokens{saved}")
+            characters, setting, story, twist = sections
             current_story = {
                 'genre': genre,
                 'twist_style': twist_style,
+                'tone': tone,
+                'model': model,
                 'characters': characters,
                 'setting': setting,
                 'story': story,
                 'twist': twist,
-                'raw': raw_story
             }
+            add_chapter(current_story, raw_story, generation_stats)
+            if not (from_cache or prefetched):
+                # Already read as it streamed in
+                mark_shown(current_story)
+            current_story['id'] = story_store.create(current_story)
+            update_similar_stories()
             st.session_state.current_story = current_story
-            st.session_state.stories.append(current_story)
             st.success("🎉 Story generated successfully!")
 
             # Enhanced confetti animation
@@ -515,6 +704,7 @@ with st.sidebar.expander("🎛️ Story Controls", expanded=True):
 # Display current story in scrollable card
 if st.session_state.current_story:
     cs = st.session_state.current_story
+    render_start = time.perf_counter()
     st.markdown("---")
     st.markdown(f'<h2 class="neon-blue">📚 Your {cs["genre"]} Story with a {cs["twist_style"]} Twist</h2>', unsafe_allow_html=True)
 
@@ -539,16 +729,11 @@ if st.session_state.current_story:
 
     # Story section with emoji header and typewriter effect simulation
     st.markdown('<h3 class="neon-purple">✨ The Story</h3>', unsafe_allow_html=True)
-    if cs['story']:
-        # Simulate typewriter effect by displaying text progressively
-        story_placeholder = st.empty()
-        story_text = cs['story']
-        displayed_text = ""
-        for char in story_text:
-            displayed_text += char
-            story_placeholder.markdown(f'<span class="typewriter">{displayed_text}</span>', unsafe_allow_html=True)
-            time.sleep(0.01)  # Adjust speed as needed
-        story_placeholder.markdown(story_text)  # Final display without animation
+    if cs['story'] and not already_shown(cs):
+        typewriter(st.empty(), cs['story'])
+        mark_shown(cs)
+    elif cs['story']:
+        st.markdown(cs['story'])
     else:
         st.write("No story generated.")
 
@@ -559,6 +744,7 @@ if st.session_state.current_story:
     st.write(cs['twist'] or "No twist explanation generated.")
 
     st.markdown('</div>', unsafe_allow_html=True)
+    metrics.observe("render", time.perf_counter() - render_start)
 
     # Action buttons with modern styling (remove duplicate buttons)
     st.markdown('<h3 class="neon-blue">🎬 Actions</h3>', unsafe_allow_html=True)
@@ -566,53 +752,152 @@ if st.session_state.current_story:
     with col1:
         # Play button with waveform animation
         if st.button("▶️ Narrate Story", key="narrate", help="Listen to the story"):
-            with st.spinner("Narrating..."):
-                narrate_story(cs['story'], voice_style)
-            st.success("🎤 Narration completed!")
+            submit_job("narrate", narrate_story, cs['story'], voice_style)
     with col2:
         # Icon button for PDF export
         if st.button("📄 Export PDF", key="pdf", help="Download as PDF"):
-            export_pdf(cs['characters'], cs['setting'], cs['story'], cs['twist'], "story.pdf")
-            st.success("📥 PDF exported!")
-            with open("story.pdf", "rb") as f:
-                st.download_button("Download PDF", f, "story.pdf")
+            submit_job("pdf", render_pdf, cs['characters'], cs['setting'], cs['story'], cs['twist'])
     with col3:
         # Icon button for audio export
-        if st.button("🎵 Export Audio", key="audio", help="Download as MP3"):
-            export_audio(cs['story'], voice_style, "story.mp3")
-            st.success("📥 Audio exported!")
-            with open("story.mp3", "rb") as f:
-                st.download_button("Download MP3", f, "story.mp3")
+        if st.button("🎵 Export Audio", key="audio", help="Download as WAV"):
+            submit_job("audio", export_audio, cs['story'], voice_style, export_path(".wav"))
     with col4:
         # Continue Story button
         if st.button("📝 Continue Story", key="continue_story", help="Continue the story with a new chapter"):
             with st.spinner("Continuing story..."):
-                continue_prompt = f"Continue the following story with a new chapter of similar length, keeping the same characters, but updating the setting and twist if necessary. Output in the exact same format as the original story.\n\nOriginal story:\n\n{cs['raw']}\n\nContinued story:"
-                client = OllamaClient(model=MODEL)
-                new_full = client.generate(continue_prompt)
-                if new_full.startswith("Error"):
-                    st.error(new_full)
+                continuation_stats = {}
+                try:
+                    continue_prompt, context = continuation_request(cs, st.session_state.session_id)
+                    fragments = schedule_prompt(continue_prompt, sampling_options(), context=context, stats=continuation_stats,
+                                                model=cs.get('model'), session=st.session_state.session_id)
+                    wait_for_turn(fragments, stream_placeholder)
+                    new_full, new_sections = render_stream(fragments, stream_placeholder)
+                except OllamaError as e:
+                    stream_placeholder.empty()
+                    st.error(str(e))
                 else:
-                    new_characters, new_setting, new_story, new_twist = parse_story(new_full)
+                    new_characters, new_setting, new_story, new_twist = new_sections
                     cs['characters'] = new_characters
                     cs['setting'] = new_setting
                     cs['story'] = new_story
                     cs['twist'] = new_twist
-                    cs['raw'] = new_full
+                    add_chapter(cs, new_full, continuation_stats)
+                    mark_shown(cs)
+                    story_store.append_chapter(cs)
+                    update_similar_stories()
                     st.success("✨ Story continued!")
                     st.experimental_rerun()
 
-
+    job_panel()
+    if st.session_state.jobs and not hasattr(st, "fragment"):
+        st.button("🔄 Refresh", key="refresh_jobs", help="Update job progress")
+
+
+
+# Diagnostics: recent per-stage latencies and sizes
+with st.sidebar.expander("📈 Diagnostics", expanded=False):
+    summary = metrics.summary()
+    if summary:
+        rows = []
+        for name, stat in summary.items():
+            scale, unit = (1000, "ms") if stat["kind"] == "seconds" else (1, "")
+            rows.append({
+                "metric": f"{name} ({unit})" if unit else name,
+                "count": stat["count"],
+                "p50": round(stat["p50"] * scale, 1),
+                "p90": round(stat["p90"] * scale, 1),
+                "p99": round(stat["p99"] * scale, 1),
+            })
+        st.table(rows)
+    else:
+        st.write("No measurements yet.")
+    pool = get_ollama_pool()
+    if pool is not None:
+        st.write("Ollama backends")
+        st.table([{
+            "backend": b["backend"],
+            "status": "🟢" if b["healthy"] else "🔴",
+            "in flight": f"{b['in_flight']}/{b['capacity']}",
+            "requests": b["requests"],
+            "failures": b["failures"],
+            "p50 (s)": round(b["latency_p50_s"], 2) if b["latency_p50_s"] is not None else "-",
+        } for b in pool.status()])
 
 # Gallery
 st.sidebar.header("Story Gallery")
-if st.session_state.stories:
-    story_options = [f"Story {i+1}: {s['genre']} - {s['twist_style']}" for i, s in enumerate(st.session_state.stories)]
+story_count = story_store.count()
+if story_count:
+    query = st.sidebar.text_input("Search stories", help="Words from the characters, setting, story or twist")
+    by_meaning = st.sidebar.checkbox("Search by meaning", help="Find stories like the description, not just its words")
+    facet_counts = story_store.facet_counts()
+    facets = {}
+    for name, label in (("genre", "Genre"), ("tone", "Tone"), ("twist_style", "Twist")):
+        counts = facet_counts[name]
+        choice = st.sidebar.selectbox(f"{label} filter", ["Any"] + list(counts),
+                                      format_func=lambda v, c=counts: v if v == "Any" else f"{v} ({c[v]})",
+                                      key=f"facet_{name}")
+        if choice != "Any":
+            facets[name] = choice
+    if query and by_meaning:
+        try:
+            listed = [s for s in similar_stories().search(query, GALLERY_PAGE_SIZE)
+                      if all(s[name] == value for name, value in facets.items())]
+        except Exception as e:
+            st.sidebar.error(f"❌ {e}")
+            listed = []
+    elif query or facets:
+        listed = story_store.search(query, GALLERY_PAGE_SIZE, **facets)
+    else:
+        pages = (story_count + GALLERY_PAGE_SIZE - 1) // GALLERY_PAGE_SIZE
+        page = st.sidebar.number_input("Page", min_value=1, max_value=pages, value=1) if pages > 1 else 1
+        # Only this page's metadata is read; a story's text is read when it is loaded
+        listed = story_store.list((page - 1) * GALLERY_PAGE_SIZE, GALLERY_PAGE_SIZE)
+    if not listed:
+        st.sidebar.write("No matching stories.")
+    story_options = [f"#{s['id']}: {s['genre']} - {s['twist_style']} ({s['chapters']} ch.)" for s in listed]
     selected = st.sidebar.selectbox("Select Story", story_options)
     if selected:
-        idx = story_options.index(selected)
-        s = st.session_state.stories[idx]
+        s = listed[story_options.index(selected)]
         st.sidebar.write(f"Genre: {s['genre']}, Twist: {s['twist_style']}")
+        if s['preview']:
+            st.sidebar.caption(s['preview'] + "...")
         if st.sidebar.button("Load Story"):
-            st.session_state.current_story = s
+            # Stories from the library are shown at once, without animation
+            st.session_state.current_story = story_store.load(s['id'])
+            mark_shown(st.session_state.current_story)
             st.experimental_rerun()
+    if st.session_state.current_story and st.session_state.current_story.get('id'):
+        if st.sidebar.button("🔍 Find similar stories", help="Stories closest in meaning to the one shown"):
+            cs = st.session_state.current_story
+            try:
+                similar = similar_stories()
+                if cs['id'] not in similar:
+                    similar.add_story(cs)
+                st.session_state.similar = (cs['id'], similar.similar_to(cs['id']))
+            except Exception as e:
+                st.sidebar.error(f"❌ {e}")
+        similar_to, matches = st.session_state.get('similar', (None, []))
+        if similar_to == st.session_state.current_story['id']:
+            for s in matches:
+                if st.sidebar.button(f"#{s['id']}: {s['genre']} - {s['twist_style']} ({s['score']:.2f})", key=f"similar_{s['id']}"):
+                    st.session_state.current_story = story_store.load(s['id'])
+                    mark_shown(st.session_state.current_story)
+                    st.experimental_rerun()
+    gallery_format = st.sidebar.radio("Export gallery as", ["PDF", "ZIP"], horizontal=True,
+                                      help="One PDF with every story, or a ZIP with a PDF per story")
+    if st.sidebar.button("📦 Export Gallery"):
+        # Stories are read from the store one at a time as the job reaches them
+        if gallery_format == "PDF":
+            submit_job("gallery_pdf", export_gallery_pdf, story_store.iter_stories(), export_path(".pdf"), story_count)
+        else:
+            submit_job("gallery_zip", export_gallery_zip, story_store.iter_stories(), export_path(".zip"), story_count)
+
+# The whole page has been sent by now; load what later interactions need in the
+# background, once per process
+@st.cache_resource
+def start_background_warmup():
+    threading.Thread(target=warm_imports, daemon=True).start()
+    if RAG_WARMUP:
+        get_retriever_future()
+
+start_background_warmup()
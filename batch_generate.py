@@ -0,0 +1,165 @@
+# Headless batch generation over a grid of story parameters.
+#
+#   python batch_generate.py --output catalog.jsonl --concurrency 4 --lengths 500 1000
+#   python batch_generate.py --output catalog.jsonl --sample 50 --rag
+#
+# Results are appended to the output file as they finish, one JSON object per
+# line. Rerunning with the same output file skips jobs that already succeeded,
+# so an interrupted run can simply be restarted.
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from metrics import metrics, percentile
+from story_parser import parse_story
+from storyteller import GENRES, TWIST_STYLES, TONES, RAG_QUERIES, generate_story, retrieve_context
+
+def job_id(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def build_jobs(genres, twist_styles, tones, lengths, num_characters, use_rag, seed, sample=None, sample_seed=0):
+    grid = [
+        {
+            "genre": genre,
+            "twist_style": twist_style,
+            "tone": tone,
+            "story_length": length,
+            "num_characters": num_characters,
+            "use_rag": use_rag,
+            "seed": seed,
+        }
+        for genre, twist_style, tone, length in itertools.product(genres, twist_styles, tones, lengths)
+    ]
+    # A fixed sample seed picks the same subset on every run, which keeps
+    # resuming meaningful
+    if sample is not None and sample < len(grid):
+        grid = random.Random(sample_seed).sample(grid, sample)
+    return [(job_id(params), params) for params in grid]
+
+def completed_job_ids(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash
+                continue
+            if record.get("status") == "ok":
+                done.add(record["job_id"])
+    return done
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+def run_job(jid, params, retriever=None, use_cache=None):
+    start = time.perf_counter()
+    record = {"job_id": jid, "params": params}
+    try:
+        retrieved_context = ""
+        if params["use_rag"] and retriever is not None:
+            retrieved_context = retrieve_context(retriever, params["genre"], params["twist_style"], params["tone"])
+        raw = generate_story(params["genre"], params["num_characters"], params["twist_style"],
+                             params["story_length"], params["tone"], retrieved_context,
+                             seed=params["seed"], use_cache=use_cache)
+    except Exception as e:
+        # Ollama or retrieval errors fail this job only, not the batch
+        record.update(status="error", error=str(e) or type(e).__name__, latency_s=time.perf_counter() - start)
+        return record
+    with metrics.span("parse_story"):
+        characters, setting, story, twist = parse_story(raw)
+    record.update(status="ok", latency_s=time.perf_counter() - start, characters=characters,
+                  setting=setting, story=story, twist=twist, raw=raw)
+    return record
+
+def summarize(latencies, failures, skipped, elapsed):
+    return {
+        "completed": len(latencies),
+        "failed": failures,
+        "skipped": skipped,
+        "elapsed_s": round(elapsed, 3),
+        "stories_per_hour": round(len(latencies) / elapsed * 3600, 2) if elapsed > 0 else None,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p90_s": percentile(latencies, 90),
+        "latency_p99_s": percentile(latencies, 99),
+        "latency_max_s": max(latencies) if latencies else None,
+    }
+
+def run_batch(jobs, output, concurrency=2, retriever=None, use_cache=None, on_record=None):
+    done = completed_job_ids(output)
+    pending = [(jid, params) for jid, params in jobs if jid not in done]
+    latencies = []
+    failures = 0
+    start = time.perf_counter()
+    with open(output, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # Terminate a line left unfinished by a crash before appending
+        if out.tell() > 0 and not _ends_with_newline(output):
+            out.write("\n")
+        futures = [pool.submit(run_job, jid, params, retriever, use_cache) for jid, params in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            if record["status"] == "ok":
+                latencies.append(record["latency_s"])
+            else:
+                failures += 1
+            if on_record:
+                on_record(record)
+    return summarize(latencies, failures, len(jobs) - len(pending), time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a catalog of stories without the Streamlit UI.")
+    parser.add_argument("--output", default="catalog.jsonl", help="JSONL file to append results to")
+    parser.add_argument("--concurrency", type=int, default=2, help="Maximum generations in flight")
+    parser.add_argument("--genres", nargs="+", default=GENRES, choices=GENRES)
+    parser.add_argument("--twist-styles", nargs="+", default=TWIST_STYLES, choices=TWIST_STYLES)
+    parser.add_argument("--tones", nargs="+", default=TONES, choices=TONES)
+    parser.add_argument("--lengths", nargs="+", type=int, default=[1000], help="Story lengths in words")
+    parser.add_argument("--num-characters", type=int, default=3)
+    parser.add_argument("--sample", type=int, help="Generate a random sample of this many grid points")
+    parser.add_argument("--sample-seed", type=int, default=0)
+    parser.add_argument("--seed", type=int, help="Sampling seed sent to Ollama for reproducible stories")
+    parser.add_argument("--rag", action="store_true", help="Augment prompts with retrieved context")
+    parser.add_argument("--corpus-dir", help="Directory of PDFs for RAG (default: story.pdf)")
+    parser.add_argument("--index-type", default="flat", help="RAG serving index: flat, ivf, hnsw, ivfpq, sq8 or a faiss factory string")
+    parser.add_argument("--nprobe", type=int, default=16, help="IVF cells searched per query")
+    parser.add_argument("--ef-search", type=int, default=64, help="HNSW search breadth")
+    parser.add_argument("--mmap", action="store_true", help="Memory-map the RAG index read-only")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the generation cache, even for seeded jobs")
+    parser.add_argument("--report", help="Also write the summary as JSON to this file")
+    args = parser.parse_args()
+
+    jobs = build_jobs(args.genres, args.twist_styles, args.tones, args.lengths, args.num_characters,
+                      args.rag, args.seed, args.sample, args.sample_seed)
+    retriever = None
+    if args.rag:
+        from rag_retriever import RAGRetriever
+        retriever = RAGRetriever(corpus_dir=args.corpus_dir, precompute_queries=RAG_QUERIES, index_type=args.index_type,
+                                 nprobe=args.nprobe, ef_search=args.ef_search, mmap=args.mmap)
+
+    def on_record(record):
+        params = record["params"]
+        label = f"{params['genre']} / {params['twist_style']} / {params['tone']} / {params['story_length']}w"
+        if record["status"] == "ok":
+            print(f"done  {record['job_id']}  {label}  {record['latency_s']:.1f}s")
+        else:
+            print(f"fail  {record['job_id']}  {label}  {record['error']}")
+
+    print(f"{len(jobs)} jobs, concurrency {args.concurrency}, output {args.output}")
+    summary = run_batch(jobs, args.output, args.concurrency, retriever, False if args.no_cache else None, on_record)
+    print(json.dumps(summary, indent=2))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# Recall vs latency of the RAG serving index types, measured against exact
+# search:
+#
+#   python -m benchmarks.ann_report --vectors 200000 --output ann_report.json
+#   python -m benchmarks.ann_report --index .rag_index/<key>/index.faiss
+#
+# Without --index the vectors are synthetic: clustered, with the dimension of
+# all-MiniLM-L6-v2. Queries are searched one at a time, as RAGRetriever does.
+import argparse
+import json
+import sys
+import time
+import faiss
+import numpy as np
+import ann_index
+from metrics import percentile
+
+# Search parameter sweeps per index type
+SWEEPS = {
+    "flat": [{}],
+    "ivf": [{"nprobe": n} for n in (1, 4, 16, 64)],
+    "hnsw": [{"ef_search": ef} for ef in (16, 32, 64, 128)],
+    "ivfpq": [{"nprobe": n} for n in (4, 16, 64)],
+    "sq8": [{}],
+}
+
+def synthetic_vectors(num, dim, clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype("float32")
+    vectors = centers[rng.integers(clusters, size=num)] + 0.5 * rng.normal(size=(num, dim)).astype("float32")
+    return vectors.astype("float32")
+
+def index_bytes(index):
+    # Serialized size, which is also what a memory-mapped index maps
+    return faiss.serialize_index(index).nbytes
+
+def evaluate(index, queries, truth, k):
+    latencies, hits = [], 0
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids = index.search(queries[i:i + 1], k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(ids[0]) & set(truth[i]))
+    return {
+        "recall": hits / (len(queries) * k),
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+def run(source, queries, k, index_types, train_size, threads):
+    _, truth = source.search(queries, k)
+    build_threads = faiss.omp_get_max_threads()
+    rows = []
+    for index_type in index_types:
+        print(f"building {index_type}...", file=sys.stderr)
+        # Training uses every core; searches use as many as one request would
+        faiss.omp_set_num_threads(build_threads)
+        start = time.perf_counter()
+        index, spec = ann_index.build_index(source, index_type, train_size)
+        build_s = time.perf_counter() - start
+        size = index_bytes(index)
+        faiss.omp_set_num_threads(threads)
+        for params in SWEEPS.get(index_type, [{}]):
+            ann_index.set_search_params(index, **params)
+            row = {"index_type": index_type, "spec": spec, "params": params,
+                   "build_s": build_s, "index_mb": size / 1e6}
+            row.update(evaluate(index, queries, truth, k))
+            rows.append(row)
+    return rows
+
+def print_table(rows, k):
+    print(f"{'index':<8} {'spec':<18} {'params':<16} {'recall@' + str(k):>9} {'p50 ms':>8} {'p99 ms':>8} {'MB':>9} {'build s':>8}")
+    for row in rows:
+        params = ",".join(f"{key}={value}" for key, value in row["params"].items()) or "-"
+        print(f"{row['index_type']:<8} {row['spec']:<18} {params:<16} {row['recall']:>9.3f} "
+              f"{row['latency_p50_ms']:>8.3f} {row['latency_p99_ms']:>8.3f} {row['index_mb']:>9.1f} {row['build_s']:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Report recall vs latency for the RAG index types.")
+    parser.add_argument("--index", help="Use the vectors of a saved flat index instead of synthetic ones")
+    parser.add_argument("--vectors", type=int, default=100000, help="Synthetic vectors to index")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--types", nargs="+", default=ann_index.INDEX_TYPES)
+    parser.add_argument("--train-size", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=1, help="faiss search threads (1 matches one request)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the rows as JSON to this file")
+    args = parser.parse_args()
+
+    if args.index:
+        source = faiss.read_index(args.index)
+        rng = np.random.default_rng(args.seed)
+        # Queries are perturbed copies of indexed vectors
+        ids = rng.choice(source.ntotal, size=min(args.queries, source.ntotal), replace=False).astype("int64")
+        base = source.reconstruct_batch(ids)
+        queries = (base + 0.1 * base.std() * rng.normal(size=base.shape)).astype("float32")
+    else:
+        vectors = synthetic_vectors(args.vectors + args.queries, args.dim, args.clusters, args.seed)
+        source = faiss.IndexFlatL2(args.dim)
+        source.add(vectors[:args.vectors])
+        queries = vectors[args.vectors:]
+
+    rows = run(source, queries, args.k, args.types, args.train_size, args.threads)
+    print_table(rows, args.k)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"vectors": source.ntotal, "queries": len(queries), "k": args.k, "rows": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
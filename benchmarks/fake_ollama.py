@@ -0,0 +1,252 @@
+# Local stand-in for Ollama's /api/generate endpoint, for benchmarks and
+# manual testing without a model:
+#
+#   python -m benchmarks.fake_ollama --port 11434 --token-rate 30 --ttft 0.5
+#
+# Streams NDJSON when the request asks for "stream": true and returns a single
+# JSON object otherwise, with the same fields Ollama uses. Token rate, time to
+# first token, model load time and a random error rate are configurable.
+# /api/tags and /api/ps list the configured and loaded models.
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = ("the ancient lantern flickered while rain hammered old stone roofs and "
+         "somewhere below a door creaked open as footsteps echoed through silent halls").split()
+
+def fake_story(num_words, num_characters=3, rng=None):
+    # Text in the Characters/Setting/Story/Twist format parse_story expects
+    rng = rng or random.Random(0)
+    def sentence(n):
+        return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+    lines = ["Characters:"]
+    lines += [f"- Character {i + 1}: {sentence(12)}" for i in range(num_characters)]
+    lines += ["Setting:", sentence(40), "Story:"]
+    remaining = max(num_words - 60, 10)
+    while remaining > 0:
+        n = min(remaining, 60)
+        lines.append(" ".join(sentence(12) for _ in range(max(n // 12, 1))))
+        remaining -= n
+    lines += ["Twist:", sentence(30)]
+    return "\n".join(lines) + "\n"
+
+def fake_prose(num_words, rng=None):
+    # Paragraphs without section headers, like a story section
+    rng = rng or random.Random(0)
+    paragraphs = []
+    while num_words > 0:
+        n = min(num_words, 60)
+        paragraphs.append(" ".join(" ".join(rng.choice(WORDS) for _ in range(12)).capitalize() + "."
+                                   for _ in range(max(n // 12, 1))))
+        num_words -= n
+    return "\n\n".join(paragraphs)
+
+def fake_outline(beats, num_characters=3, rng=None):
+    # Characters, setting and numbered beats, like a pipeline planning call
+    rng = rng or random.Random(0)
+    head = fake_story(0, num_characters, rng).split("Story:")[0]
+    return head + "Outline:\n" + "".join(f"{i}. {fake_prose(20, rng)}\n" for i in range(1, beats + 1))
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections is routine, not an error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+class FakeOllamaServer:
+    def __init__(self, host="127.0.0.1", port=0, token_rate=200.0, ttft=0.05,
+                 error_rate=0.0, error_status=503, response_text=None, seed=0,
+                 load_time=0.0, models=("llama2:latest",)):
+        self.token_rate = token_rate
+        self.ttft = ttft
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.response_text = response_text
+        # Seconds the first request for each model spends "loading" it
+        self.load_time = load_time
+        self.models = list(models)
+        self.loaded = set()
+        # While set, every request fails with HTTP 503, health checks included
+        self.down = False
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = _QuietHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._httpd.server_address[0]
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _text_for(self, prompt):
+        if self.response_text is not None:
+            return self.response_text
+        match = re.search(r"about (\d+) words", prompt)
+        num_words = int(match.group(1)) if match else 300
+        with self._lock:
+            seed = self._rng.random()
+        # Planning, section and twist prompts of the story pipeline
+        beats = re.search(r"in exactly (\d+) numbered beats", prompt)
+        if beats:
+            return fake_outline(int(beats.group(1)), rng=random.Random(seed))
+        if "Write only" in prompt:
+            return fake_prose(num_words, rng=random.Random(seed))
+        return fake_story(num_words, rng=random.Random(seed))
+
+    def _should_fail(self):
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _write_chunk(self, payload):
+                data = (json.dumps(payload) + "\n").encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if server.down:
+                    self._send_json(503, {"error": "server down"})
+                elif self.path == "/api/tags":
+                    self._send_json(200, {"models": [{"name": name} for name in server.models]})
+                elif self.path == "/api/ps":
+                    with server._lock:
+                        loaded = sorted(server.loaded)
+                    self._send_json(200, {"models": [{"name": name} for name in loaded]})
+                else:
+                    self._send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if server.down:
+                    self._send_json(503, {"error": "server down"})
+                    return
+                if self.path != "/api/generate":
+                    self._send_json(404, {"error": "not found"})
+                    return
+                with server._lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                try:
+                    self._generate(request)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def _generate(self, request):
+                if server._should_fail():
+                    with server._lock:
+                        server.errors += 1
+                    self._send_json(server.error_status, {"error": "injected failure"})
+                    return
+                model = request.get("model", "llama2")
+                model = model if ":" in model else f"{model}:latest"
+                start = time.perf_counter()
+                with server._lock:
+                    cold = model not in server.loaded
+                    server.loaded.add(model)
+                load_time = server.load_time if cold else 0.001
+                time.sleep(load_time)
+                prompt = request.get("prompt", "")
+                if not prompt:
+                    # An empty prompt only loads the model
+                    self._send_json(200, {"model": model, "response": "", "done": True,
+                                          "load_duration": int(load_time * 1e9)})
+                    return
+                tokens = re.findall(r"\S+\s*|\s+", server._text_for(prompt))
+                final = {
+                    "model": model,
+                    "done": True,
+                    "load_duration": int(load_time * 1e9),
+                    # Like Ollama, the context covers earlier context, the prompt and the response
+                    "context": list(request.get("context") or []) + list(range(len(prompt.split()) + len(tokens))),
+                    "prompt_eval_count": len(prompt.split()),
+                    "eval_count": len(tokens),
+                }
+                if not request.get("stream", True):
+                    time.sleep(server.ttft + len(tokens) / server.token_rate)
+                    final["response"] = "".join(tokens)
+                    final["total_duration"] = final["eval_duration"] = int((time.perf_counter() - start) * 1e9)
+                    self._send_json(200, final)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(server.ttft)
+                for token in tokens:
+                    self._write_chunk({"model": final["model"], "response": token, "done": False})
+                    time.sleep(1 / server.token_rate)
+                final["response"] = ""
+                final["total_duration"] = final["eval_duration"] = int((time.perf_counter() - start) * 1e9)
+                self._write_chunk(final)
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--token-rate", type=float, default=30.0, help="Tokens per second")
+    parser.add_argument("--ttft", type=float, default=0.5, help="Seconds before the first token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--load-time", type=float, default=0.0, help="Seconds to load each model on first use")
+    args = parser.parse_args()
+    server = FakeOllamaServer(args.host, args.port, args.token_rate, args.ttft, args.error_rate, args.error_status,
+                              load_time=args.load_time)
+    print(f"Fake Ollama listening on http://{server.host}:{server.port}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+if __name__ == "__main__":
+    main()
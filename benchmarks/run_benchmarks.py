@@ -0,0 +1,376 @@
+# Benchmark suite run against a local fake Ollama server:
+#
+#   python -m benchmarks.run_benchmarks --output bench_results.json
+#   python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json
+#
+# Results are written as JSON. With --baseline every metric is compared to the
+# stored run and the exit status is 1 when one regressed by more than
+# --max-regression. Benchmarks whose dependencies are missing are reported as
+# skipped rather than failing the run.
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.fake_ollama import FakeOllamaServer, fake_story
+from benchmarks.startup import bench_startup
+from generation_cache import GenerationCache
+from generation_scheduler import GenerationScheduler, SchedulerBusy
+from metrics import percentile
+import storyteller
+from ollama_client import OllamaError
+from ollama_pool import OllamaPool
+from story_parser import parse_story, StoryStreamParser
+from story_pipeline import stream_story_pipeline
+
+def timed_stream(fragments):
+    # Consume a fragment iterator, returning (time to first fragment, total)
+    start = time.perf_counter()
+    first = None
+    for _ in fragments:
+        if first is None:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+def drain(fragments):
+    # Read a stream to the end; False if it failed
+    try:
+        for _ in fragments:
+            pass
+    except OllamaError:
+        return False
+    return True
+
+def bench_generation(server, runs, story_length):
+    storyteller.OLLAMA_PORT = server.port
+    args = ("Fantasy", 3, "Betrayal", story_length, "Dark")
+    blocking, ttft, streamed = [], [], []
+    errors = 0
+    for _ in range(runs):
+        # A failed run (e.g. with --error-rate) is counted, not fatal
+        try:
+            start = time.perf_counter()
+            storyteller.generate_story(*args, use_cache=False)
+            blocking.append(time.perf_counter() - start)
+        except OllamaError:
+            errors += 1
+        try:
+            fragments, _ = storyteller.stream_story(*args, use_cache=False)
+            first, total = timed_stream(fragments)
+            ttft.append(first)
+            streamed.append(total)
+        except OllamaError:
+            errors += 1
+    return {
+        "blocking_p50_s": percentile(blocking, 50),
+        "stream_ttft_p50_s": percentile(ttft, 50),
+        "stream_total_p50_s": percentile(streamed, 50),
+        "errors": errors,
+    }
+
+def bench_parse(words, repeats):
+    text = fake_story(words)
+    size_mb = len(text.encode("utf-8")) / 1e6
+    start = time.perf_counter()
+    for _ in range(repeats):
+        parse_story(text)
+    batch = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeats):
+        parser = StoryStreamParser()
+        for i in range(0, len(text), 16):
+            parser.feed(text[i:i + 16])
+        parser.close()
+    streaming = time.perf_counter() - start
+    return {
+        "input_mb": round(size_mb, 3),
+        "parse_story_mb_per_s": size_mb * repeats / batch,
+        "stream_parser_mb_per_s": size_mb * repeats / streaming,
+    }
+
+def bench_retriever(queries):
+    from rag_retriever import RAGRetriever
+    index_dir = tempfile.mkdtemp(prefix="bench_rag_")
+    try:
+        start = time.perf_counter()
+        RAGRetriever(index_dir=index_dir, precompute_queries=storyteller.RAG_QUERIES)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        retriever = RAGRetriever(index_dir=index_dir, precompute_queries=storyteller.RAG_QUERIES)
+        warm = time.perf_counter() - start
+        latencies, free_form = [], []
+        for i in range(queries):
+            start = time.perf_counter()
+            retriever.retrieve(storyteller.RAG_QUERIES[i % len(storyteller.RAG_QUERIES)])
+            latencies.append(time.perf_counter() - start)
+            # Distinct free-form queries miss both the table and the LRU
+            start = time.perf_counter()
+            retriever.retrieve(f"a story about lanterns and rain, number {i}")
+            free_form.append(time.perf_counter() - start)
+        return {
+            "cold_build_s": cold,
+            "warm_load_s": warm,
+            "query_p50_s": percentile(latencies, 50),
+            "query_p99_s": percentile(latencies, 99),
+            "free_form_query_p50_s": percentile(free_form, 50),
+        }
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+def bench_exports(words):
+    import exports
+    characters, setting, story, twist = parse_story(fake_story(words))
+    out_dir = tempfile.mkdtemp(prefix="bench_export_")
+    # Start from an empty TTS cache so the first export synthesizes everything
+    cache_dir, exports.TTS_CACHE_DIR = exports.TTS_CACHE_DIR, os.path.join(out_dir, "tts")
+    try:
+        start = time.perf_counter()
+        exports.export_pdf(characters, setting, story, twist, os.path.join(out_dir, "story.pdf"))
+        results = {"pdf_s": time.perf_counter() - start}
+        try:
+            for label in ("audio_s", "audio_cached_s"):
+                start = time.perf_counter()
+                exports.export_audio(story, "Narrator", os.path.join(out_dir, "story.wav"))
+                results[label] = time.perf_counter() - start
+        except (ImportError, RuntimeError, OSError) as e:
+            results["audio_skipped"] = str(e)
+        return results
+    finally:
+        exports.TTS_CACHE_DIR = cache_dir
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+def bench_sessions(server, sessions, stories_per_session, story_length):
+    storyteller.OLLAMA_PORT = server.port
+    return bench_sessions_with(sessions, stories_per_session, story_length)
+
+def bench_sessions_with(sessions, stories_per_session, story_length, on_story=None):
+    # Concurrent sessions against whatever storyteller is pointed at
+    latencies, ttfts = [], []
+    errors = 0
+    lock = threading.Lock()
+
+    def session():
+        nonlocal errors
+        for _ in range(stories_per_session):
+            try:
+                fragments, _ = storyteller.stream_story("Mystery", 3, "Time Loop", story_length, "Dark", use_cache=False)
+                first, total = timed_stream(fragments)
+            except OllamaError:
+                with lock:
+                    errors += 1
+                continue
+            with lock:
+                ttfts.append(first)
+                latencies.append(total)
+            if on_story is not None:
+                on_story()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        for _ in range(sessions):
+            pool.submit(session)
+    elapsed = time.perf_counter() - start
+    return {
+        "stories_per_s": len(latencies) / elapsed,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p99_s": percentile(latencies, 99),
+        "ttft_p50_s": percentile(ttfts, 50),
+        "errors": errors,
+    }
+
+def bench_pool(backends, sessions, stories_per_session, story_length, token_rate, ttft):
+    # Sessions spread over several fake servers, one of which goes down
+    # halfway through; its requests should fail over to the others
+    servers = [FakeOllamaServer(token_rate=token_rate, ttft=ttft, seed=i).start() for i in range(backends)]
+    pool = OllamaPool([(server.host, server.port, 2) for server in servers], health_interval=0.5)
+    storyteller.set_ollama_pool(pool)
+    # Sized from the pool's capacities
+    storyteller.set_scheduler(None)
+    try:
+        half = sessions * stories_per_session // 2
+        done = 0
+        lock = threading.Lock()
+
+        def count_done():
+            nonlocal done
+            with lock:
+                done += 1
+                if done == half:
+                    servers[0].down = True
+
+        result = bench_sessions_with(sessions, stories_per_session, story_length, count_done)
+        result["requests_per_backend"] = [server.requests for server in servers]
+        return result
+    finally:
+        storyteller.set_ollama_pool(None)
+        storyteller.set_scheduler(None)
+        pool.close()
+        for server in servers:
+            server.stop()
+
+def bench_scheduler(server, sessions, story_length):
+    storyteller.OLLAMA_PORT = server.port
+    scheduler = GenerationScheduler(2, max_queue=sessions // 2, max_wait=storyteller.MAX_WAIT)
+    storyteller.set_scheduler(scheduler)
+    try:
+        # Identical seeded requests from every session share one generation
+        before = server.requests
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            streams = list(pool.map(lambda i: storyteller.stream_story(
+                "Fantasy", 3, "Redemption", story_length, "Poetic", seed=7, use_cache=False, session=i)[0],
+                range(sessions)))
+            failed = list(pool.map(drain, streams)).count(False)
+        results = {"identical_total_s": time.perf_counter() - start,
+                   "identical_ollama_requests": server.requests - before}
+
+        # Distinct requests beyond the queue bound are turned away at once
+        rejections, rejected = [], 0
+        streams = []
+        for i in range(sessions * 2):
+            start = time.perf_counter()
+            try:
+                streams.append(storyteller.stream_story("Mystery", 3, "Time Loop", story_length, "Dark",
+                                                        use_cache=False, session=i)[0])
+            except SchedulerBusy:
+                rejected += 1
+                rejections.append(time.perf_counter() - start)
+        with ThreadPoolExecutor(max_workers=len(streams)) as pool:
+            failed += list(pool.map(drain, streams)).count(False)
+        results["errors"] = failed
+        results["overload_rejected"] = rejected
+        results["reject_p99_s"] = percentile(rejections, 99)
+        return results
+    finally:
+        storyteller.set_scheduler(None)
+
+def bench_pipeline(server, runs, lengths, slots):
+    # Single-shot generation against the outline-then-sections pipeline with
+    # `slots` generations running at once. Each fake stream runs at the full
+    # token rate, as on backends with spare parallel capacity.
+    storyteller.OLLAMA_PORT = server.port
+    storyteller.set_scheduler(GenerationScheduler(slots, storyteller.MAX_QUEUE, storyteller.MAX_WAIT))
+    try:
+        results = {"errors": 0}
+        for length in lengths:
+            args = ("Fantasy", 3, "Betrayal", length, "Dark")
+            for name, stream in (("single", storyteller.stream_story), ("pipeline", stream_story_pipeline)):
+                ttft, total = [], []
+                for _ in range(runs):
+                    try:
+                        fragments, _ = stream(*args, use_cache=False)
+                        first, elapsed = timed_stream(fragments)
+                    except OllamaError:
+                        results["errors"] += 1
+                        continue
+                    ttft.append(first)
+                    total.append(elapsed)
+                results[f"{name}_{length}w_ttft_p50_s"] = percentile(ttft, 50)
+                results[f"{name}_{length}w_total_p50_s"] = percentile(total, 50)
+        return results
+    finally:
+        storyteller.set_scheduler(None)
+
+def run_all(args):
+    results = {}
+
+    def record(name, fn, *fn_args):
+        print(f"running {name}...", file=sys.stderr)
+        try:
+            results[name] = fn(*fn_args)
+        except ImportError as e:
+            results[name] = {"skipped": f"missing dependency: {e}"}
+        except OllamaError as e:
+            # A failure the benchmark itself did not count; the others still run
+            results[name] = {"failed": str(e)}
+
+    # Keep fake stories out of the real generation cache
+    cache_dir = tempfile.mkdtemp(prefix="bench_cache_")
+    storyteller.set_generation_cache(GenerationCache(os.path.join(cache_dir, "generations.sqlite")))
+    with FakeOllamaServer(token_rate=args.token_rate, ttft=args.ttft, error_rate=args.error_rate) as server:
+        for length in args.lengths:
+            record(f"generation_{length}w", bench_generation, server, args.runs, length)
+        for sessions in args.sessions:
+            record(f"sessions_{sessions}", bench_sessions, server, sessions, args.stories_per_session, args.lengths[0])
+        record("scheduler", bench_scheduler, server, args.sessions[-1], args.lengths[0])
+        record("pipeline", bench_pipeline, server, args.runs, args.lengths, args.pipeline_slots)
+    record("pool", bench_pool, args.pool_backends, args.sessions[-1], args.stories_per_session, args.lengths[0],
+           args.token_rate, args.ttft)
+    record("startup", bench_startup, args.startup_repeats)
+    record("parse", bench_parse, args.parse_words, args.parse_repeats)
+    record("retriever", bench_retriever, args.queries)
+    record("exports", bench_exports, args.lengths[-1])
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+# Metrics where a larger number is better; everything else is a duration
+HIGHER_IS_BETTER_SUFFIXES = ("_per_s",)
+
+def compare(results, baseline, max_regression):
+    regressions = []
+    for bench, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(bench, {}).get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            if metric in ("errors", "input_mb", "overload_rejected"):
+                continue
+            change = (value - old) / old
+            if metric.endswith(HIGHER_IS_BETTER_SUFFIXES):
+                change = -change
+            marker = "REGRESSION" if change > max_regression else ""
+            print(f"{bench:>20} {metric:<24} {old:>12.4f} -> {value:>12.4f} {change:+8.1%} {marker}")
+            if marker:
+                regressions.append((bench, metric, change))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the AI Storyteller benchmark suite.")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Compare against this results file")
+    parser.add_argument("--update-baseline", action="store_true", help="Write this run to --baseline")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed slowdown as a fraction")
+    parser.add_argument("--token-rate", type=float, default=400.0, help="Fake server tokens per second")
+    parser.add_argument("--ttft", type=float, default=0.05, help="Fake server time to first token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fake server injected error rate")
+    parser.add_argument("--lengths", nargs="+", type=int, default=[500, 2000])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--sessions", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--stories-per-session", type=int, default=2)
+    parser.add_argument("--pipeline-slots", type=int, default=4, help="Concurrent generations for the pipeline")
+    parser.add_argument("--pool-backends", type=int, default=3, help="Fake servers behind the backend pool")
+    parser.add_argument("--parse-words", type=int, default=200000)
+    parser.add_argument("--parse-repeats", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--startup-repeats", type=int, default=3, help="Fresh interpreters per import timing")
+    args = parser.parse_args()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "update_baseline")},
+        "results": run_all(args),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["results"], indent=2))
+
+    if args.baseline and args.update_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline written to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(report["results"], baseline, args.max_regression)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.max_regression:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
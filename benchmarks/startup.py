@@ -0,0 +1,92 @@
+# Cold import time per module, each measured in a fresh interpreter:
+#
+#   python -m benchmarks.startup
+#   python -m benchmarks.startup --repeats 5 --output startup.json
+#
+# APP_STARTUP_MODULES is everything app.py imports before its first paint (its
+# module-level imports, read from app.py itself so the list cannot go stale), so
+# import_app_startup_s is the part of time-to-first-paint spent importing. It
+# is also part of the benchmark suite, so a heavy import creeping back onto
+# the startup path shows up as a regression.
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+from metrics import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def app_imports(path=os.path.join(ROOT, "app.py")):
+    # Modules imported at the top level of app.py, in order; imports inside
+    # functions happen on first use and are not part of startup
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names = [node.module]
+        else:
+            continue
+        modules += [name for name in names if name not in modules]
+    return modules
+
+APP_STARTUP_MODULES = app_imports()
+# Project modules and the heavy dependencies they load on first use; the
+# standard library is left out of the per-module timings
+MODULES = [name for name in APP_STARTUP_MODULES if name.split(".")[0] not in sys.stdlib_module_names]
+MODULES += [name for name in ["generation_cache", "rag_retriever", "ann_index", "story_search", "faiss",
+                              "langchain_community.vectorstores", "langchain_huggingface",
+                              "sentence_transformers", "torch", "fpdf", "pyttsx3"] if name not in MODULES]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+print(time.perf_counter() - start)
+"""
+
+def import_time(modules, repeats=3):
+    # Median over fresh interpreters; None when a module is not installed
+    times = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", PROBE] + list(modules), cwd=ROOT,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        times.append(float(result.stdout.strip()))
+    return percentile(times, 50)
+
+def bench_startup(repeats=3):
+    results = {}
+    for name in MODULES:
+        seconds = import_time([name], repeats)
+        if seconds is None:
+            results[f"import_{name}_skipped"] = "not installed"
+        else:
+            results[f"import_{name}_s"] = seconds
+    seconds = import_time(APP_STARTUP_MODULES, repeats)
+    if seconds is None:
+        results["import_app_startup_skipped"] = "a startup module is not installed"
+    else:
+        results["import_app_startup_s"] = seconds
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold import time per module.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+    results = bench_startup(args.repeats)
+    for name, value in results.items():
+        print(f"{name:<48} {value:>10.4f}" if isinstance(value, float) else f"{name:<48} {value:>10}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Query latency of the story library's full-text and similar-story search:
+#
+#   python -m benchmarks.story_search
+#   python -m benchmarks.story_search --stories 100000 --output story_search.json
+#
+# The library is filled with fake stories and random unit vectors in a
+# temporary directory. Every story shares one small vocabulary, so common
+# words match every story: the worst case for ranking.
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from benchmarks.fake_ollama import WORDS, fake_story
+from metrics import percentile
+from story_parser import parse_story
+from story_search import SimilarStories
+from story_store import StoryStore
+from storyteller import GENRES, TONES, TWIST_STYLES
+
+# Rare words, each planted in a fraction of the stories
+RARE_WORDS = ["dragon", "castle", "mirror", "robot", "ghost", "orchard", "harbor", "comet"]
+
+def fill(store, stories, dim, seed):
+    rng = random.Random(seed)
+    vectors = np.random.default_rng(seed).normal(size=(stories, dim)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    for i in range(stories):
+        raw = fake_story(300, rng=rng).replace("lantern", rng.choice(RARE_WORDS), 1)
+        characters, setting, story, twist = parse_story(raw)
+        story_id = store.create({"genre": rng.choice(GENRES), "twist_style": rng.choice(TWIST_STYLES),
+                                 "tone": rng.choice(TONES), "model": "fake", "characters": characters,
+                                 "setting": setting, "story": story, "twist": twist, "raw": raw})
+        store.put_vector(story_id, "synthetic", vectors[i])
+
+def latencies(fn, args_list):
+    times = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return {"p50_ms": percentile(times, 50) * 1000, "p99_ms": percentile(times, 99) * 1000}
+
+def bench_story_search(stories, queries, dim=384, seed=0):
+    directory = tempfile.mkdtemp(prefix="bench_stories_")
+    try:
+        store = StoryStore(os.path.join(directory, "stories.sqlite"))
+        start = time.perf_counter()
+        fill(store, stories, dim, seed)
+        results = {"stories": stories, "fill_s": time.perf_counter() - start}
+        rng = random.Random(seed)
+        texts = [" ".join(rng.sample(RARE_WORDS, rng.randint(1, 2))) for _ in range(queries)]
+        common = [" ".join(rng.sample(WORDS, rng.randint(1, 3))) for _ in range(queries)]
+        # A prefix, as while the query is still being typed
+        typing = [rng.choice(RARE_WORDS + WORDS)[:3] for _ in range(queries)]
+        for name, query_texts in (("rare", texts), ("common", common), ("prefix", typing)):
+            for key, value in latencies(store.search, [(text,) for text in query_texts]).items():
+                results[f"search_{name}_{key}"] = value
+        genre_filter = lambda text: store.search(text, genre=GENRES[0])
+        for key, value in latencies(genre_filter, [(text,) for text in texts]).items():
+            results[f"search_genre_{key}"] = value
+        for key, value in latencies(store.facet_counts, [()] * queries).items():
+            results[f"facets_{key}"] = value
+
+        start = time.perf_counter()
+        similar = SimilarStories(store, None, "synthetic")
+        results["similar_open_s"] = time.perf_counter() - start
+        ids = [(rng.randint(1, stories),) for _ in range(queries)]
+        for key, value in latencies(similar.similar_to, ids).items():
+            results[f"similar_{key}"] = value
+        store.close()
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure story library search latency.")
+    parser.add_argument("--stories", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+    print(f"filling {args.stories} stories...", file=sys.stderr)
+    results = bench_story_search(args.stories, args.queries, args.dim, args.seed)
+    for name, value in results.items():
+        print(f"{name:<32} {value:>12.3f}" if isinstance(value, float) else f"{name:<32} {value:>12}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# Retrieved passages cut down to a token budget before they go into a prompt:
+#
+#   text, report = compact_context(query, passages, token_budget=256)
+#
+# 1. Chunks that overlap (the splitter repeats chunk_overlap characters at each
+#    boundary) or contain one another are merged into one passage.
+# 2. Passages and sentences that are near-duplicates of an earlier one are
+#    dropped (word-shingle Jaccard similarity).
+# 3. Sentences are scored by query terms (BM25 over the retrieved sentences),
+#    the retrieval rank of their passage, and how much they share with the
+#    rest of the retrieved text, so stray headers and footers score low.
+# 4. The best sentences are kept, in reading order, until the budget is used.
+#
+# Token counts are estimated (about four characters per token); no tokenizer
+# is loaded.
+import math
+import re
+from collections import Counter
+
+# Shortest suffix/prefix match treated as a chunk overlap
+MIN_OVERLAP = 20
+# Jaccard similarity above which a passage or sentence counts as a duplicate
+DUPLICATE_SIMILARITY = 0.8
+# Weight of a passage's retrieval rank and of centrality next to query terms
+RANK_WEIGHT = 0.5
+CENTRALITY_WEIGHT = 1.0
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i in into is it its of on or she so that the "
+    "their them then there they this to was were which while who will with you your genre style tone twist".split())
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / 4)
+
+def _words(text):
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+def _terms(text):
+    return [word for word in _words(text) if word not in STOPWORDS]
+
+def _shingles(text, size=3):
+    words = _words(text)
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def _similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def _overlap(left, right):
+    # Length of the longest suffix of left that is a prefix of right
+    probe = right[:MIN_OVERLAP]
+    if len(probe) < MIN_OVERLAP:
+        return 0
+    start = left.find(probe)
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(probe, start + 1)
+    return 0
+
+def merge_passages(passages):
+    # Returns the merged passages, each with the best (lowest) retrieval rank
+    # of the chunks it came from, and how many merges happened
+    merged = [(passage.strip(), rank) for rank, passage in enumerate(passages) if passage.strip()]
+    merges = 0
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(len(merged)):
+                if i == j:
+                    continue
+                (a, rank_a), (b, rank_b) = merged[i], merged[j]
+                if b in a:
+                    combined = a
+                else:
+                    size = _overlap(a, b)
+                    if not size:
+                        continue
+                    combined = a + b[size:]
+                merged[i] = (combined, min(rank_a, rank_b))
+                del merged[j]
+                merges += 1
+                changed = True
+                break
+            if changed:
+                break
+    return merged, merges
+
+def split_sentences(text):
+    return [sentence for sentence in re.split(r"(?<=[.!?])\s+|\n{2,}", text) if sentence.strip()]
+
+def compact_context(query, passages, token_budget=256):
+    # Returns the compacted text and a report of what was removed
+    raw = "\n".join(passages)
+    merged, merges = merge_passages(passages)
+
+    # Near-duplicate passages, keeping the better-ranked copy
+    kept, seen = [], []
+    for passage, rank in sorted(merged, key=lambda item: item[1]):
+        shingles = _shingles(passage)
+        if any(_similarity(shingles, other) >= DUPLICATE_SIMILARITY for other in seen):
+            continue
+        seen.append(shingles)
+        kept.append((passage, rank))
+    duplicate_passages = len(merged) - len(kept)
+
+    # Sentences in reading order: passage by passage, best-ranked first
+    sentences, seen = [], []
+    for passage, rank in kept:
+        for sentence in split_sentences(passage):
+            shingles = _shingles(sentence)
+            if any(_similarity(shingles, other) >= DUPLICATE_SIMILARITY for other in seen):
+                continue
+            seen.append(shingles)
+            sentences.append((sentence.strip(), rank))
+    duplicate_sentences = sum(len(split_sentences(p)) for p, _ in kept) - len(sentences)
+
+    terms = [_terms(sentence) for sentence, _ in sentences]
+    scores = _scores(_terms(query), terms, [rank for _, rank in sentences])
+    chosen, used = set(), 0
+    for i in sorted(range(len(sentences)), key=lambda i: -scores[i]):
+        cost = estimate_tokens(sentences[i][0]) + 1
+        if used + cost > token_budget:
+            continue
+        chosen.add(i)
+        used += cost
+    text = " ".join(sentences[i][0] for i in sorted(chosen))
+    report = {
+        "context_tokens_before": estimate_tokens(raw),
+        "context_tokens_after": estimate_tokens(text),
+        "merged_chunks": merges,
+        "duplicate_passages": duplicate_passages,
+        "duplicate_sentences": duplicate_sentences,
+        "sentences_kept": len(chosen),
+        "sentences_dropped": len(sentences) - len(chosen),
+    }
+    return text, report
+
+def _scores(query_terms, sentence_terms, ranks):
+    if not sentence_terms:
+        return []
+    # BM25 with the retrieved sentences as the collection
+    count = len(sentence_terms)
+    average = sum(len(terms) for terms in sentence_terms) / count or 1.0
+    frequency = Counter(term for terms in sentence_terms for term in set(terms))
+    idf = {term: math.log(1 + (count - n + 0.5) / (n + 0.5)) for term, n in frequency.items()}
+    # Centrality: the share of a sentence's terms found in other sentences
+    totals = Counter(term for terms in sentence_terms for term in terms)
+    scores = []
+    for terms, rank in zip(sentence_terms, ranks):
+        counts = Counter(terms)
+        bm25 = sum(idf.get(term, 0.0) * counts[term] * 2.2 / (counts[term] + 1.2 * (0.25 + 0.75 * len(terms) / average))
+                   for term in set(query_terms))
+        centrality = sum(1 for term in terms if totals[term] > counts[term]) / len(terms) if terms else 0.0
+        scores.append(bm25 + RANK_WEIGHT / (1 + rank) + CENTRALITY_WEIGHT * centrality)
+    return scores
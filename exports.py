@@ -0,0 +1,365 @@
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+import wave
+import zipfile
+from metrics import metrics
+
+# pyttsx3 and fpdf are imported on first use so they stay off the app's startup
+# path; warm_imports() loads them ahead of time from a background thread
+HEAVY_MODULES = ("fpdf", "pyttsx3")
+
+def warm_imports():
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            # Reported when the feature is actually used
+            pass
+
+# Speaking rate per voice style; None keeps the driver's default
+VOICE_RATES = {"Narrator": None, "Horror": 150, "Child": 200, "Epic": 120}
+# Synthesized chunks and whole narrations, keyed by text, voice style and rate
+TTS_CACHE_DIR = os.environ.get("STORYTELLER_TTS_CACHE", os.path.join(".cache", "tts"))
+TTS_CACHE_MAX_BYTES = int(os.environ.get("STORYTELLER_TTS_CACHE_MB", "500")) * 1024 * 1024
+TTS_WORKERS = int(os.environ.get("STORYTELLER_TTS_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Chunks are built from whole sentences up to about this many characters
+TTS_CHUNK_CHARS = 800
+
+def _apply_voice(engine, voice_style, default_rate=None):
+    voices = engine.getProperty('voices')
+    if voice_style == "Child":
+        if len(voices) > 1:
+            engine.setProperty('voice', voices[1].id)
+    elif voices:
+        engine.setProperty('voice', voices[0].id)
+    rate = VOICE_RATES.get(voice_style)
+    if rate is None:
+        rate = default_rate
+    if rate is not None:
+        engine.setProperty('rate', rate)
+
+def split_text(text, max_chars=TTS_CHUNK_CHARS):
+    # Chunks never cross a paragraph, so a chapter keeps the same chunks (and
+    # cache entries) when a story is continued
+    chunks = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        current = ""
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph.strip()):
+            if not sentence:
+                continue
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                chunks.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            chunks.append(current)
+    return chunks
+
+def _cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+# One engine per TTS worker process, and the rate it started with
+_worker_engine = None
+_worker_default_rate = None
+
+def _synthesize_chunk(text, voice_style, path):
+    global _worker_engine, _worker_default_rate
+    import pyttsx3
+    if _worker_engine is None:
+        _worker_engine = pyttsx3.Engine()
+        _worker_default_rate = _worker_engine.getProperty('rate')
+    engine = _worker_engine
+    # Drivers such as espeak keep voice and rate process-wide, so they are set
+    # again for every chunk
+    _apply_voice(engine, voice_style, _worker_default_rate)
+    # Written under a temporary name so a half-written chunk is never cached
+    tmp = f"{path[:-4]}.{os.getpid()}.tmp.wav"
+    engine.save_to_file(text, tmp)
+    engine.runAndWait()
+    os.replace(tmp, path)
+    return path
+
+_tts_pool = None
+_tts_pool_lock = threading.Lock()
+
+def _get_tts_pool():
+    # Worker processes synthesize chunks in parallel. They are spawned rather
+    # than forked because the app process runs threads.
+    global _tts_pool
+    with _tts_pool_lock:
+        if _tts_pool is None:
+            _tts_pool = ProcessPoolExecutor(max_workers=TTS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _tts_pool
+
+def _concat_wav(paths, filename):
+    tmp = f"{filename}.tmp"
+    try:
+        with wave.open(tmp, "wb") as out:
+            for i, path in enumerate(paths):
+                with wave.open(path, "rb") as chunk:
+                    if i == 0:
+                        out.setparams(chunk.getparams())
+                    out.writeframes(chunk.readframes(chunk.getnframes()))
+    except Exception:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, filename)
+
+# Cache files a running narration still needs, with how many narrations need
+# them; pruning skips them
+_tts_in_use = Counter()
+_tts_in_use_lock = threading.Lock()
+
+def _hold_tts_files(paths):
+    with _tts_in_use_lock:
+        _tts_in_use.update(os.path.abspath(path) for path in paths)
+
+def _release_tts_files(paths):
+    with _tts_in_use_lock:
+        _tts_in_use.subtract(os.path.abspath(path) for path in paths)
+        for path in [path for path, count in _tts_in_use.items() if count <= 0]:
+            del _tts_in_use[path]
+
+def _prune_tts_cache():
+    # Drop the least recently written files once the cache outgrows its budget,
+    # except files a running narration still needs. Files another process
+    # removed meanwhile are skipped.
+    with _tts_in_use_lock:
+        keep = set(_tts_in_use)
+    entries = []
+    for entry in os.scandir(TTS_CACHE_DIR):
+        if not entry.name.endswith(".wav") or ".tmp" in entry.name:
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= TTS_CACHE_MAX_BYTES:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+# Synthesize a story as a WAV file and return its path. The text is split into
+# chunks that are synthesized in parallel and cached, so only chunks never
+# heard before cost anything. With a job, job.partial lists the chunk files
+# ready so far, in order, so playback can start with the first one.
+@metrics.timed("narrate_story")
+def narrate_story(text, voice_style, job=None):
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    rate = VOICE_RATES.get(voice_style)
+    chunks = split_text(text)
+    if not chunks:
+        raise ValueError("There is no text to narrate.")
+    paths = [os.path.join(TTS_CACHE_DIR, _cache_key(chunk, voice_style, rate) + ".wav") for chunk in chunks]
+    story_path = os.path.join(TTS_CACHE_DIR, "story-" + _cache_key(paths) + ".wav")
+    if os.path.exists(story_path):
+        metrics.record("tts_chunks_synthesized", 0)
+        return story_path
+
+    # While this narration runs, pruning by other narrations leaves its files
+    # alone
+    held = paths + [story_path]
+    _hold_tts_files(held)
+    try:
+        ready = [os.path.exists(path) for path in paths]
+        metrics.record("tts_chunks_synthesized", ready.count(False))
+        futures = {}
+        pool = _get_tts_pool()
+        for i, (chunk, path) in enumerate(zip(chunks, paths)):
+            if not ready[i] and path not in futures.values():
+                futures[pool.submit(_synthesize_chunk, chunk, voice_style, path)] = path
+        if job is not None:
+            job.on_cancel(lambda: [future.cancel() for future in futures])
+
+        def publish():
+            if job is not None:
+                prefix = next((i for i, done in enumerate(ready) if not done), len(ready))
+                job.partial = paths[:prefix]
+                job.set_progress(ready.count(True) / len(ready), f"{ready.count(True)}/{len(ready)} chunks")
+
+        publish()
+        try:
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                path = future.result()
+                for i, p in enumerate(paths):
+                    if p == path:
+                        ready[i] = True
+                publish()
+        finally:
+            # After a failure, don't leave the other chunks queued
+            for future in futures:
+                future.cancel()
+        if job is not None:
+            job.check_cancelled()
+
+        try:
+            _concat_wav(paths, story_path)
+        except (wave.Error, EOFError):
+            # Drivers that don't write WAV (macOS writes AIFF) can't be joined
+            if len(paths) > 1:
+                raise RuntimeError("This TTS driver does not write WAV files, so chunks cannot be joined.")
+            shutil.copyfile(paths[0], story_path)
+        _prune_tts_cache()
+    finally:
+        _release_tts_files(held)
+    return story_path
+
+def _add_story_pages(pdf, characters, setting, story, twist, title="AI Storyteller"):
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+    pdf.cell(200, 10, txt=title, ln=True, align='C')
+    pdf.cell(200, 10, txt="Characters:", ln=True)
+    for char in characters:
+        pdf.multi_cell(0, 10, "- " + char)
+    pdf.cell(200, 10, txt="Setting:", ln=True)
+    pdf.multi_cell(0, 10, setting)
+    pdf.cell(200, 10, txt="Story:", ln=True)
+    pdf.multi_cell(0, 10, story)
+    pdf.cell(200, 10, txt="The Twist Explained:", ln=True)
+    pdf.multi_cell(0, 10, twist)
+
+def _pdf_bytes(pdf):
+    # fpdf returns a latin-1 str, fpdf2 a bytearray
+    data = pdf.output(dest="S")
+    return data.encode("latin-1") if isinstance(data, str) else bytes(data)
+
+def story_version(characters, setting, story, twist):
+    return hashlib.sha256(json.dumps([characters, setting, story, twist]).encode("utf-8")).hexdigest()
+
+class PDFCache:
+    # Rendered PDFs by story version, least recently used first out once the
+    # total size passes max_bytes
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+pdf_cache = PDFCache()
+
+# Render a story as PDF bytes, cached per story version
+@metrics.timed("render_pdf")
+def render_pdf(characters, setting, story, twist, job=None):
+    key = story_version(characters, setting, story, twist)
+    data = pdf_cache.get(key)
+    if data is None:
+        from fpdf import FPDF
+        pdf = FPDF()
+        _add_story_pages(pdf, characters, setting, story, twist)
+        if job is not None:
+            job.check_cancelled()
+        data = _pdf_bytes(pdf)
+        pdf_cache.put(key, data)
+    return data
+
+# Export to PDF
+@metrics.timed("export_pdf")
+def export_pdf(characters, setting, story, twist, filename, job=None):
+    with open(filename, "wb") as f:
+        f.write(render_pdf(characters, setting, story, twist, job))
+    return filename
+
+def _gallery_title(number, story):
+    return f"Story {number}: {story['genre']} - {story['twist_style']}"
+
+def _gallery_progress(job, number, total):
+    if job is not None:
+        job.check_cancelled()
+        if total:
+            job.set_progress(number / total, f"{number}/{total} stories")
+
+# Gallery exports take any iterable of story dicts, so a caller can load each
+# story only when it is reached
+@metrics.timed("export_gallery_pdf")
+def export_gallery_pdf(stories, filename, total=None, job=None):
+    # One document with every story; only the document's pages accumulate
+    from fpdf import FPDF
+    pdf = FPDF()
+    for number, story in enumerate(stories, 1):
+        _add_story_pages(pdf, story['characters'], story['setting'], story['story'], story['twist'],
+                         title=_gallery_title(number, story))
+        _gallery_progress(job, number, total)
+    with open(filename, "wb") as f:
+        f.write(_pdf_bytes(pdf))
+    return filename
+
+class _StreamBuffer(io.RawIOBase):
+    # Unseekable sink that hands back whatever has been written since the
+    # last drain(); zipfile writes to it as a stream
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_gallery_zip(stories, total=None, job=None):
+    # Yields a ZIP with one PDF per story, piece by piece; each PDF is
+    # rendered, compressed and released before the next story is read
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for number, story in enumerate(stories, 1):
+            name = re.sub(r"[^a-z0-9]+", "-", f"{story['genre']} {story['twist_style']}".lower()).strip("-")
+            archive.writestr(f"story-{number:03d}-{name}.pdf",
+                             render_pdf(story['characters'], story['setting'], story['story'], story['twist']))
+            _gallery_progress(job, number, total)
+            yield buffer.drain()
+    yield buffer.drain()
+
+@metrics.timed("export_gallery_zip")
+def export_gallery_zip(stories, filename, total=None, job=None):
+    with open(filename, "wb") as f:
+        for data in stream_gallery_zip(stories, total, job):
+            f.write(data)
+    return filename
+
+# Export audio
+@metrics.timed("export_audio")
+def export_audio(text, voice_style, filename, job=None):
+    shutil.copyfile(narrate_story(text, voice_style, job), filename)
+    return filename
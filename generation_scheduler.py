@@ -0,0 +1,281 @@
+# Process-wide queue in front of Ollama for streamed generations:
+#
+#   stream = scheduler.submit(key, produce, session=session_id, stats=stats)
+#   stream.position()        # 0 once generating, else place in the queue
+#   for fragment in stream:  # blocks until the generation starts
+#       ...
+#
+# At most max_concurrency generations run at once; the rest wait in per-session
+# queues served round-robin, so one session queueing several requests cannot
+# hold everyone else back. A request whose key matches one already queued or
+# running joins it instead of generating again. When the queue is full, or the
+# estimated wait exceeds max_wait, submit() raises SchedulerBusy straight away
+# rather than letting the request run into the read timeout.
+#
+# Background generations (submit(..., background=True), e.g. prefetching) only
+# start when no interactive request is waiting, and a running one is stopped
+# when an interactive request needs its slot; its stream then raises
+# Preempted.
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from metrics import metrics
+from ollama_client import OllamaError
+
+QUEUED, RUNNING, DONE = "queued", "running", "done"
+
+class SchedulerBusy(OllamaError):
+    def __init__(self, message):
+        super().__init__(message, retryable=True)
+
+class Preempted(OllamaError):
+    def __init__(self):
+        super().__init__("Stopped to make room for an interactive request.", retryable=True)
+
+class _Generation:
+    # One generation and the fragments it has produced so far, read by every
+    # stream subscribed to it
+    def __init__(self, key, produce, session, background=False):
+        self.key = key
+        self.produce = produce
+        self.session = session
+        self.background = background
+        self.preempted = False
+        self.status = QUEUED
+        self.fragments = []
+        self.stats = {}
+        self.error = None
+        self.subscribers = 0
+        self.submitted_at = time.monotonic()
+        self.cond = threading.Condition()
+
+class ScheduledStream:
+    def __init__(self, scheduler, generation, stats=None):
+        self._scheduler = scheduler
+        self._generation = generation
+        self._stats = stats
+        self._closed = False
+
+    def position(self):
+        return self._scheduler.position(self._generation)
+
+    def __iter__(self):
+        generation = self._generation
+        index = 0
+        try:
+            while True:
+                with generation.cond:
+                    while index >= len(generation.fragments) and generation.status != DONE:
+                        generation.cond.wait()
+                    fragments = generation.fragments[index:]
+                    finished = generation.status == DONE
+                for fragment in fragments:
+                    yield fragment
+                index += len(fragments)
+                if finished and index >= len(generation.fragments):
+                    break
+            if generation.error is not None:
+                raise generation.error
+            if self._stats is not None:
+                self._stats.update(generation.stats)
+        finally:
+            self.close()
+
+    def __del__(self):
+        # A stream dropped without being read, e.g. by a rerun
+        self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._scheduler._unsubscribe(self._generation)
+
+class GenerationScheduler:
+    def __init__(self, max_concurrency=2, max_queue=32, max_wait=120.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        # session -> queued generations, in round-robin order
+        self._queues = OrderedDict()
+        self._background = deque()
+        self._in_flight = {}
+        self._running = 0
+        self._running_background = []
+        self._durations = deque(maxlen=50)
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="generate")
+        self.merged = 0
+        self.rejected = 0
+        self.preempted = 0
+
+    def submit(self, key, produce, session=None, stats=None, background=False):
+        # produce(stats) returns the fragment iterator; it runs on a worker
+        # thread and fills stats with Ollama's final metadata. key=None never
+        # merges.
+        if background:
+            with self._lock:
+                generation = _Generation(None, produce, session, background=True)
+                generation.subscribers = 1
+                self._background.append(generation)
+                self._dispatch()
+                return ScheduledStream(self, generation, stats)
+        with self._lock:
+            generation = self._in_flight.get(key) if key is not None else None
+            if generation is not None:
+                generation.subscribers += 1
+                self.merged += 1
+                metrics.record("scheduler_merged", 1)
+                return ScheduledStream(self, generation, stats)
+            queued = self._queued()
+            if queued >= self.max_queue:
+                self._reject("The story queue is full")
+            wait = self._estimated_wait(queued + 1)
+            if wait is not None and wait > self.max_wait:
+                self._reject(f"Stories are taking about {wait:.0f} s to start")
+            generation = _Generation(key, produce, session)
+            generation.subscribers = 1
+            self._queues.setdefault(session, deque()).append(generation)
+            if key is not None:
+                self._in_flight[key] = generation
+            self._preempt()
+            self._dispatch()
+            metrics.record("scheduler_queued", self._queued())
+            return ScheduledStream(self, generation, stats)
+
+    def _reject(self, reason):
+        self.rejected += 1
+        metrics.record("scheduler_rejected", 1)
+        raise SchedulerBusy(f"{reason}; please try again in a minute.")
+
+    def _queued(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _preempt(self):
+        # Stop background generations holding slots that queued interactive
+        # requests need; each frees its slot at its next fragment
+        needed = self._queued() - (self.max_concurrency - self._running)
+        for generation in self._running_background:
+            if needed <= 0:
+                break
+            if not generation.preempted:
+                generation.preempted = True
+                self.preempted += 1
+                metrics.record("scheduler_preempted", 1)
+            needed -= 1
+
+    def _estimated_wait(self, position):
+        # Seconds until the position-th queued request starts, from the
+        # running and queued interactive work ahead of it and the average of
+        # recent generation times; None while there is nothing to average.
+        # Background generations give way, so their slots count as free.
+        ahead = self._running - len(self._running_background) + position - 1
+        if ahead < self.max_concurrency:
+            return 0.0
+        if not self._durations:
+            return None
+        average = sum(self._durations) / len(self._durations)
+        return ((ahead - self.max_concurrency) // self.max_concurrency + 1) * average
+
+    def _dispatch(self):
+        # Start queued generations while there are free slots, one session at
+        # a time, then background generations if nobody is waiting
+        while self._running < self.max_concurrency and (self._queues or self._background):
+            if self._queues:
+                session, queue = next(iter(self._queues.items()))
+                generation = queue.popleft()
+                if queue:
+                    self._queues.move_to_end(session)
+                else:
+                    del self._queues[session]
+                metrics.observe("scheduler_queue_wait", time.monotonic() - generation.submitted_at)
+            else:
+                generation = self._background.popleft()
+                self._running_background.append(generation)
+            generation.status = RUNNING
+            self._running += 1
+            self._pool.submit(self._run, generation)
+
+    def _run(self, generation):
+        start = time.monotonic()
+        fragments = None
+        completed = False
+        try:
+            fragments = generation.produce(generation.stats)
+            for fragment in fragments:
+                with generation.cond:
+                    if generation.subscribers == 0:
+                        break
+                    if generation.preempted:
+                        generation.error = Preempted()
+                        break
+                    generation.fragments.append(fragment)
+                    generation.cond.notify_all()
+            else:
+                completed = True
+        except Exception as e:
+            generation.error = e if isinstance(e, OllamaError) else OllamaError(str(e))
+        finally:
+            if fragments is not None and hasattr(fragments, "close"):
+                fragments.close()
+            with self._lock:
+                self._running -= 1
+                if generation.background:
+                    self._running_background.remove(generation)
+                if self._in_flight.get(generation.key) is generation:
+                    del self._in_flight[generation.key]
+                if completed:
+                    self._durations.append(time.monotonic() - start)
+                self._dispatch()
+            with generation.cond:
+                generation.status = DONE
+                generation.cond.notify_all()
+
+    def _unsubscribe(self, generation):
+        with self._lock, generation.cond:
+            generation.subscribers -= 1
+            if generation.subscribers > 0:
+                return
+            # Nobody is reading it any more, so nobody may join it either. A
+            # running generation stops at its next fragment; a queued one
+            # never starts.
+            if self._in_flight.get(generation.key) is generation:
+                del self._in_flight[generation.key]
+            if generation.status == QUEUED:
+                if generation.background:
+                    self._background.remove(generation)
+                else:
+                    queue = self._queues[generation.session]
+                    queue.remove(generation)
+                    if not queue:
+                        del self._queues[generation.session]
+                generation.status = DONE
+                generation.cond.notify_all()
+
+    def position(self, generation):
+        # 0 once started; otherwise 1 + the queued generations that will start
+        # before it under round-robin order
+        with self._lock:
+            if generation.status != QUEUED:
+                return 0
+            queues = [list(queue) for queue in self._queues.values()]
+        for own, queue in enumerate(queues):
+            if generation in queue:
+                rounds = queue.index(generation)
+                break
+        else:
+            return 0
+        # Sessions served before this one in each round get one more turn
+        return 1 + sum(min(len(queue), rounds + (i < own)) for i, queue in enumerate(queues))
+
+    def idle(self):
+        # True while a new generation would start at once without keeping
+        # anyone waiting
+        with self._lock:
+            return self._running < self.max_concurrency and not self._queues and not self._background
+
+    def stats(self):
+        with self._lock:
+            return {"running": self._running, "queued": self._queued(), "merged": self.merged,
+                    "rejected": self.rejected, "background": len(self._running_background) + len(self._background),
+                    "preempted": self.preempted}
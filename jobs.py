@@ -0,0 +1,170 @@
+# Background jobs for slow work (narration, exports) so the Streamlit script
+# thread never blocks on it:
+#
+#   job_id = executor.submit("export_pdf", export_pdf, characters, ...)
+#   executor.status(job_id)   # {"status": "running", "progress": 0.4, ...}
+#   executor.cancel(job_id)
+#   executor.result(job_id)
+#
+# Job functions receive the Job as their `job` keyword argument, report
+# progress through job.set_progress() and stop early when job.check_cancelled()
+# raises.
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+import threading
+import time
+import uuid
+from metrics import metrics
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        # Optional partial result a job publishes while it runs
+        self.partial = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._cancel_hooks = []
+        self._lock = threading.Lock()
+        self._future = None
+
+    def set_progress(self, fraction, message=None):
+        self.progress = max(0.0, min(1.0, fraction))
+        if message is not None:
+            self.message = message
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def on_cancel(self, hook):
+        # Called from cancel(), e.g. to interrupt a TTS engine mid-sentence
+        with self._lock:
+            self._cancel_hooks.append(hook)
+            cancelled = self._cancel.is_set()
+        if cancelled:
+            hook()
+
+    def snapshot(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "partial": self.partial,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class JobExecutor:
+    def __init__(self, max_workers=2, max_finished=200):
+        self.max_finished = max_finished
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, fn, *args, **kwargs):
+        job = Job(name)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        job._future = self._pool.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancel_requested:
+            job.finished_at = time.time()
+            job.status = CANCELLED
+            return
+        job.started_at = time.time()
+        job.status = RUNNING
+        metrics.observe("job_queue_wait", job.started_at - job.created_at)
+        # finished_at is set before the final status, so _prune() never sees a
+        # finished job without it
+        status = FAILED
+        try:
+            job.result = fn(*args, job=job, **kwargs)
+        except JobCancelled:
+            status = CANCELLED
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+        else:
+            # A job that ignores cancellation still finishes normally
+            job.progress = 1.0
+            status = DONE
+        finally:
+            job.finished_at = time.time()
+            job.status = status
+            metrics.observe(f"job_{job.name}", job.finished_at - job.started_at)
+
+    def _prune(self):
+        # Forget the oldest finished jobs beyond max_finished
+        finished = [job for job in self._jobs.values() if job.status in FINISHED]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        job = self.get(job_id)
+        return job.snapshot() if job else None
+
+    def jobs(self):
+        with self._lock:
+            return [job.snapshot() for job in self._jobs.values()]
+
+    def cancel(self, job_id):
+        # Queued jobs never start; running jobs are asked to stop and end up
+        # cancelled once they next check. Returns False for finished jobs.
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED:
+            return False
+        with job._lock:
+            job._cancel.set()
+            hooks = list(job._cancel_hooks)
+        for hook in hooks:
+            hook()
+        if job._future is not None and job._future.cancel():
+            job.finished_at = time.time()
+            job.status = CANCELLED
+        return True
+
+    def result(self, job_id, timeout=None):
+        # Waits for the job; raises JobCancelled or RuntimeError if it did not
+        # complete
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        try:
+            job._future.result(timeout)
+        except CancelledError:
+            pass
+        if job.status == CANCELLED:
+            raise JobCancelled()
+        if job.status == FAILED:
+            raise RuntimeError(job.error)
+        return job.result
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
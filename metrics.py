@@ -0,0 +1,136 @@
+# Per-stage latency and size metrics, shared by the app and headless tools.
+#
+#   with metrics.span("retrieve"):
+#       ...
+#   metrics.record("prompt_chars", len(prompt))
+#
+# Recent observations are kept per name for percentiles. They can be served in
+# Prometheus text format (start_metrics_server) and appended to a JSONL file
+# when STORYTELLER_METRICS_LOG is set.
+from collections import deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+class MetricsRegistry:
+    def __init__(self, window=1000, log_path=None):
+        self.window = window
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        # name -> {"kind": "seconds" | "value", "recent": deque, "count": int, "sum": float}
+        self._series = {}
+
+    def _observe(self, name, value, kind):
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                series = self._series[name] = {"kind": kind, "recent": deque(maxlen=self.window), "count": 0, "sum": 0.0}
+            series["recent"].append(value)
+            series["count"] += 1
+            series["sum"] += value
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"ts": time.time(), "name": name, "kind": kind, "value": value}) + "\n")
+
+    def observe(self, stage, seconds):
+        self._observe(stage, seconds, "seconds")
+
+    def record(self, name, value):
+        self._observe(name, value, "value")
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage):
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        with self._lock:
+            snapshot = {name: (s["kind"], list(s["recent"]), s["count"], s["sum"]) for name, s in self._series.items()}
+        result = {}
+        for name, (kind, recent, count, total) in sorted(snapshot.items()):
+            result[name] = {
+                "kind": kind,
+                "count": count,
+                "sum": total,
+                "p50": percentile(recent, 50),
+                "p90": percentile(recent, 90),
+                "p99": percentile(recent, 99),
+            }
+        return result
+
+    def prometheus_text(self):
+        summary = self.summary()
+        lines = []
+        # Each metric family has to be emitted as one contiguous group
+        for kind, metric, label in (("seconds", "storyteller_stage_seconds", "stage"),
+                                    ("value", "storyteller_value", "name")):
+            lines.append(f"# TYPE {metric} summary")
+            for name, s in summary.items():
+                if s["kind"] != kind:
+                    continue
+                for key, quantile in (("p50", "0.5"), ("p90", "0.9"), ("p99", "0.99")):
+                    lines.append(f'{metric}{{{label}="{name}",quantile="{quantile}"}} {s[key]}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {s["count"]}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {s["sum"]}')
+        return "\n".join(lines) + "\n"
+
+def percentile(values, pct):
+    # Nearest-rank percentile; None without values
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(pct / 100 * len(ordered))) - 1]
+
+metrics = MetricsRegistry(log_path=os.environ.get("STORYTELLER_METRICS_LOG"))
+
+def record_ollama_stats(stats):
+    # Token counts and durations from Ollama's final response (nanoseconds)
+    for field in ("prompt_eval_count", "eval_count"):
+        if field in stats:
+            metrics.record(field, stats[field])
+    for field in ("load_duration", "prompt_eval_duration", "eval_duration", "total_duration"):
+        if field in stats:
+            metrics.observe(f"ollama_{field}", stats[field] / 1e9)
+    if stats.get("eval_count") and stats.get("eval_duration"):
+        metrics.record("eval_tokens_per_s", stats["eval_count"] / (stats["eval_duration"] / 1e9))
+
+def start_metrics_server(port, host="0.0.0.0", registry=None):
+    # Serves GET /metrics in Prometheus text format from a daemon thread
+    registry = registry or metrics
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
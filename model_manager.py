@@ -0,0 +1,154 @@
+import threading
+import time
+import requests
+from metrics import metrics
+from ollama_client import OllamaError, get_client
+from storyteller import COLD_LOAD_THRESHOLD
+
+class ModelManager:
+    # Keeps Ollama models loaded so stories don't pay the model-load time.
+    # preload() loads a model in a background thread; while sessions report
+    # activity through mark_active(), a heartbeat thread re-sends keep_alive so
+    # Ollama does not unload the model between generations. With several
+    # servers (servers=[(host, port), ...]) every step runs on each of them,
+    # and a model is only "warm" once it is loaded on all of them.
+    #
+    # The same thread polls /api/ps every refresh_interval seconds and
+    # /api/tags every models_interval seconds; available_models(),
+    # warm_servers() and status() only read what it found, so the app's
+    # script thread never waits on a slow or unreachable server.
+    def __init__(self, host="localhost", port=11434, keep_alive="30m",
+                 heartbeat_interval=60, idle_timeout=900, servers=None, refresh_interval=5.0,
+                 models_interval=30.0):
+        self.servers = list(servers) if servers else [(host, port)]
+        self.keep_alive = keep_alive
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.refresh_interval = refresh_interval
+        self.models_interval = models_interval
+        self._lock = threading.Lock()
+        self._loading = set()
+        self._errors = {}
+        self._last_active = {}
+        # (host, port) -> models in memory there
+        self._loaded = {}
+        self._models = []
+        self._models_checked_at = None
+        self._session = requests.Session()
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat.start()
+
+    def _models_on(self, server, endpoint):
+        # Model names from /api/tags or /api/ps on one server; None if it
+        # cannot be reached
+        host, port = server
+        try:
+            response = self._session.get(f"http://{host}:{port}/api/{endpoint}", timeout=5)
+            response.raise_for_status()
+            return {m["name"] for m in response.json().get("models", [])}
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+    def available_models(self):
+        # Models installed on every reachable server, as of the last refresh
+        with self._lock:
+            return list(self._models)
+
+    def refresh(self, models=True):
+        # /api/ps lists the models currently held in memory, /api/tags the
+        # installed ones
+        loaded = {server: {_normalize(name) for name in self._models_on(server, "ps") or ()}
+                  for server in self.servers}
+        with self._lock:
+            self._loaded = loaded
+        if models:
+            found = [models for models in (self._models_on(server, "tags") for server in self.servers)
+                     if models is not None]
+            with self._lock:
+                self._models = sorted(set.intersection(*found)) if found else []
+                self._models_checked_at = time.monotonic()
+
+    def warm_servers(self, model):
+        # How many servers have the model in memory
+        with self._lock:
+            return sum(1 for server in self.servers if _normalize(model) in self._loaded.get(server, ()))
+
+    def status(self, model):
+        # "loading", "warm", "cold" or "error"
+        with self._lock:
+            if model in self._loading:
+                return "loading"
+            if model in self._errors:
+                return "error"
+        return "warm" if self.warm_servers(model) == len(self.servers) else "cold"
+
+    def last_error(self, model):
+        with self._lock:
+            return self._errors.get(model)
+
+    def preload(self, model):
+        with self._lock:
+            if model in self._loading:
+                return
+            self._loading.add(model)
+            self._errors.pop(model, None)
+        threading.Thread(target=self._load, args=(model,), daemon=True).start()
+
+    def _load(self, model):
+        # Every server at once
+        threads = [threading.Thread(target=self._load_on, args=(server, model), daemon=True)
+                   for server in self.servers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with self._lock:
+            self._loading.discard(model)
+
+    def _load_on(self, server, model):
+        # An empty prompt makes Ollama load the model without generating
+        host, port = server
+        stats = {}
+        start = time.perf_counter()
+        try:
+            get_client(host, port, model, self.keep_alive).generate("", stats=stats)
+        except OllamaError as e:
+            with self._lock:
+                self._errors[model] = str(e) if len(self.servers) == 1 else f"{host}:{port}: {e}"
+        else:
+            load_seconds = stats.get("load_duration", 0) / 1e9
+            # Heartbeats against a loaded model are not load measurements
+            if load_seconds >= COLD_LOAD_THRESHOLD:
+                metrics.observe("model_load", load_seconds)
+                metrics.observe("model_preload", time.perf_counter() - start)
+            with self._lock:
+                self._loaded.setdefault(server, set()).add(_normalize(model))
+
+    def mark_active(self, model):
+        with self._lock:
+            self._last_active[model] = time.monotonic()
+
+    def _heartbeat_loop(self):
+        last_heartbeat = time.monotonic()
+        self.refresh()
+        while not self._stop.wait(self.refresh_interval):
+            now = time.monotonic()
+            self.refresh(models=now - self._models_checked_at >= self.models_interval)
+            if now - last_heartbeat < self.heartbeat_interval:
+                continue
+            last_heartbeat = now
+            with self._lock:
+                active = [m for m, t in self._last_active.items() if now - t <= self.idle_timeout]
+            for model in active:
+                self.preload(model)
+
+    def stop(self):
+        self._stop.set()
+
+def same_model(a, b):
+    return _normalize(a) == _normalize(b)
+
+def _normalize(name):
+    # Ollama reports "llama2" as "llama2:latest"
+    return name if ":" in name else f"{name}:latest"
@@ -1,21 +1,249 @@
+import asyncio
+import json
+import random
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 
-class OllamaClient:
-    def __init__(self, host="localhost", port=11434, model="llama2"):
+# HTTP statuses worth retrying: Ollama is overloaded or a proxy hiccuped
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+class OllamaError(Exception):
+    def __init__(self, message, status_code=None, retryable=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+
+class OllamaTimeoutError(OllamaError):
+    pass
+
+class _BaseOllamaClient:
+    def __init__(self, host="localhost", port=11434, model="llama2",
+                 connect_timeout=5, read_timeout=300, max_retries=3,
+                 backoff_base=0.5, backoff_max=8.0, pool_size=10, session=None,
+                 keep_alive=None):
         self.base_url = f"http://{host}:{port}/api/generate"
         self.model = model
+        # How long Ollama keeps the model loaded after a request, e.g. "30m"
+        self.keep_alive = keep_alive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.session = session
 
-    def generate(self, prompt, timeout=300):
+    def _payload(self, prompt, stream, options=None, context=None):
         data = {
             "model": self.model,
             "prompt": prompt,
-            "stream": False
+            "stream": stream
         }
+        # Sampling options such as "seed" and "temperature"
+        if options:
+            data["options"] = options
+        # Token context returned by an earlier call; Ollama resumes from it
+        # instead of re-evaluating the text it stands for
+        if context:
+            data["context"] = context
+        if self.keep_alive is not None:
+            data["keep_alive"] = self.keep_alive
+        return data
+
+    def _backoff(self, attempt):
+        # Full jitter keeps many clients from retrying in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+class OllamaClient(_BaseOllamaClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.session is None:
+            # Keep-alive connections are reused across calls and threads
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+
+    def _post(self, prompt, stream, timeout, options=None, context=None):
+        read_timeout = timeout or self.read_timeout
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(self.base_url, json=self._payload(prompt, stream, options, context),
+                                             timeout=(self.connect_timeout, read_timeout), stream=stream)
+                if response.status_code >= 400:
+                    error = _error_from_response(response.status_code, response.text)
+                    response.close()
+                    raise error
+                return response
+            except requests.exceptions.Timeout as e:
+                error = OllamaTimeoutError(
+                    f"Request timed out after {read_timeout} seconds. The story generation may take longer; try reducing the story length or waiting.",
+                    retryable=isinstance(e, requests.exceptions.ConnectTimeout))
+            except requests.exceptions.ConnectionError as e:
+                error = OllamaError(f"Error connecting to Ollama: {e}", retryable=True)
+            except requests.exceptions.RequestException as e:
+                error = OllamaError(f"Error connecting to Ollama: {e}")
+            except OllamaError as e:
+                error = e
+            if not error.retryable or attempt >= self.max_retries:
+                raise error
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def generate(self, prompt, timeout=None, options=None, stats=None, context=None):
+        # stats, if given, receives the metadata of Ollama's final response
+        # (token counts, durations, context)
+        response = self._post(prompt, False, timeout, options, context)
+        try:
+            data = response.json()
+            _collect_stats(data, stats)
+            return data.get("response", "")
+        except ValueError as e:
+            raise OllamaError(f"Invalid response from Ollama: {e}") from e
+        finally:
+            response.close()
+
+    def generate_stream(self, prompt, timeout=None, options=None, stats=None, context=None):
+        # Yields response fragments as Ollama produces them. The read timeout
+        # applies to the gap between chunks, not the whole generation. Retries
+        # only happen before the first fragment, so output is never repeated.
+        response = self._post(prompt, True, timeout, options, context)
         try:
-            response = requests.post(self.base_url, json=data, timeout=timeout)
-            response.raise_for_status()
-            return response.json().get("response", "")
+            for line in response.iter_lines(chunk_size=None):
+                if not line:
+                    continue
+                chunk = _parse_chunk(line)
+                if chunk.get("error"):
+                    raise OllamaError(f"Error from Ollama: {chunk['error']}")
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    _collect_stats(chunk, stats)
+                    return
         except requests.exceptions.Timeout:
-            return f"Error: Request timed out after {timeout} seconds. The story generation may take longer; try reducing the story length or waiting."
+            raise OllamaTimeoutError(f"No response from Ollama for {timeout or self.read_timeout} seconds.")
         except requests.exceptions.RequestException as e:
-            return f"Error connecting to Ollama: {str(e)}"
+            raise OllamaError(f"Connection to Ollama lost: {e}")
+        finally:
+            response.close()
+
+    def close(self):
+        self.session.close()
+
+class AsyncOllamaClient(_BaseOllamaClient):
+    # asyncio counterpart of OllamaClient with the same constructor and
+    # methods, for keeping many generations in flight in one process
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _get_session(self):
+        # aiohttp sessions must be created inside a running event loop
+        if self.session is None:
+            import aiohttp
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+        return self.session
+
+    async def _post(self, prompt, stream, timeout, options=None, context=None):
+        import aiohttp
+        read_timeout = timeout or self.read_timeout
+        client_timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=read_timeout)
+        attempt = 0
+        while True:
+            try:
+                response = await self._get_session().post(self.base_url, json=self._payload(prompt, stream, options, context),
+                                                          timeout=client_timeout)
+                if response.status >= 400:
+                    text = await response.text()
+                    response.release()
+                    raise _error_from_response(response.status, text)
+                return response
+            except asyncio.TimeoutError as e:
+                error = OllamaTimeoutError(
+                    f"Request timed out after {read_timeout} seconds. The story generation may take longer; try reducing the story length or waiting.",
+                    retryable=isinstance(e, getattr(aiohttp, "ConnectionTimeoutError", ())))
+            except aiohttp.ClientConnectionError as e:
+                error = OllamaError(f"Error connecting to Ollama: {e}", retryable=True)
+            except aiohttp.ClientError as e:
+                error = OllamaError(f"Error connecting to Ollama: {e}")
+            except OllamaError as e:
+                error = e
+            if not error.retryable or attempt >= self.max_retries:
+                raise error
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def generate(self, prompt, timeout=None, options=None, stats=None, context=None):
+        response = await self._post(prompt, False, timeout, options, context)
+        try:
+            data = await response.json(content_type=None)
+            _collect_stats(data, stats)
+            return data.get("response", "")
+        except ValueError as e:
+            raise OllamaError(f"Invalid response from Ollama: {e}") from e
+        finally:
+            response.release()
+
+    async def generate_stream(self, prompt, timeout=None, options=None, stats=None, context=None):
+        import aiohttp
+        response = await self._post(prompt, True, timeout, options, context)
+        try:
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                chunk = _parse_chunk(line)
+                if chunk.get("error"):
+                    raise OllamaError(f"Error from Ollama: {chunk['error']}")
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    _collect_stats(chunk, stats)
+                    return
+        except asyncio.TimeoutError:
+            raise OllamaTimeoutError(f"No response from Ollama for {timeout or self.read_timeout} seconds.")
+        except aiohttp.ClientError as e:
+            raise OllamaError(f"Connection to Ollama lost: {e}")
+        finally:
+            response.release()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+def _parse_chunk(line):
+    # One NDJSON line of a streamed response
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        raise OllamaError(f"Invalid response from Ollama: {e}") from e
+
+def _collect_stats(data, stats):
+    if stats is not None:
+        stats.update((key, value) for key, value in data.items() if key != "response")
+
+def _error_from_response(status_code, text):
+    try:
+        message = json.loads(text).get("error") or text
+    except ValueError:
+        message = text
+    return OllamaError(f"Ollama returned HTTP {status_code}: {message}", status_code=status_code,
+                       retryable=status_code in RETRYABLE_STATUS)
+
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+def get_client(host="localhost", port=11434, model="llama2", keep_alive=None):
+    # Process-wide client per endpoint and model, so every caller shares one
+    # connection pool instead of opening a new connection per request
+    key = (host, port, model, keep_alive)
+    with _shared_clients_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            client = _shared_clients[key] = OllamaClient(host=host, port=port, model=model, keep_alive=keep_alive)
+        return client
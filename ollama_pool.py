@@ -0,0 +1,210 @@
+# Several Ollama servers behind one client interface:
+#
+#   pool = OllamaPool(parse_backends("gpu1:11434=4,gpu2:11434=2"))
+#   client = pool.client("llama2", keep_alive="30m")
+#   client.generate(prompt)          # same methods as OllamaClient
+#   pool.status()                    # per-backend health, load and latency
+#
+# Each request goes to the healthy backend with the fewest in-flight requests
+# relative to its capacity, waiting for a free slot when every backend is
+# full. A request that fails with a retryable error (connection refused,
+# 429/5xx) is retried on a backend it has not tried yet, and the failing
+# backend is taken out of rotation until a health check (GET /api/tags)
+# succeeds again.
+import random
+import threading
+import time
+import requests
+from metrics import metrics
+from ollama_client import OllamaClient, OllamaError
+
+def parse_backends(spec, default_capacity=1):
+    # "host:port=capacity,host:port" -> [(host, port, capacity)]
+    backends = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        address, _, capacity = item.partition("=")
+        host, _, port = address.rpartition(":") if ":" in address else (address, "", "11434")
+        backends.append((host, int(port), int(capacity or default_capacity)))
+    return backends
+
+class Backend:
+    def __init__(self, host, port, capacity=1):
+        self.host = host
+        self.port = port
+        self.name = f"{host}:{port}"
+        self.capacity = capacity
+        self.healthy = True
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+        self._clients = {}
+        self._session = requests.Session()
+
+    def client(self, model, keep_alive, **kwargs):
+        # One client per model on a shared session; the pool does the
+        # retrying, across backends
+        key = (model, keep_alive)
+        if key not in self._clients:
+            self._clients[key] = OllamaClient(host=self.host, port=self.port, model=model, keep_alive=keep_alive,
+                                              max_retries=0, session=self._session, **kwargs)
+        return self._clients[key]
+
+    @property
+    def load(self):
+        return self.in_flight / self.capacity
+
+    @property
+    def metric(self):
+        return f"ollama_backend_{self.name}"
+
+    def snapshot(self, summary):
+        latency = summary.get(self.metric, {})
+        return {
+            "backend": self.name,
+            "healthy": self.healthy,
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_p50_s": latency.get("p50"),
+            "latency_p99_s": latency.get("p99"),
+            "last_error": self.last_error,
+        }
+
+class OllamaPool:
+    def __init__(self, backends, health_interval=10.0, health_timeout=2.0, acquire_timeout=300.0,
+                 **client_kwargs):
+        if not backends:
+            raise ValueError("An Ollama pool needs at least one backend.")
+        self.backends = [Backend(host, port, capacity) for host, port, capacity in backends]
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.acquire_timeout = acquire_timeout
+        self.client_kwargs = client_kwargs
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._health = threading.Thread(target=self._health_loop, daemon=True, name="ollama-health")
+        self._health.start()
+
+    def client(self, model, keep_alive=None):
+        return PoolClient(self, model, keep_alive)
+
+    def status(self):
+        # Latencies are the recent per-backend request times in `metrics`
+        summary = metrics.summary()
+        with self._cond:
+            return [backend.snapshot(summary) for backend in self.backends]
+
+    def _acquire(self, tried):
+        # Least-loaded healthy backend not tried yet; waits while all of them
+        # are at capacity
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                candidates = [b for b in self.backends if b.healthy and b not in tried]
+                if not candidates:
+                    raise OllamaError("No healthy Ollama backend is available." if not tried else
+                                      f"All Ollama backends failed; last error: {tried[-1].last_error}")
+                free = [b for b in candidates if b.in_flight < b.capacity]
+                if free:
+                    lowest = min(b.load for b in free)
+                    backend = random.choice([b for b in free if b.load == lowest])
+                    backend.in_flight += 1
+                    backend.requests += 1
+                    return backend
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise OllamaError("Timed out waiting for a free Ollama backend.", retryable=True)
+                self._cond.wait(remaining)
+
+    def _release(self, backend, seconds=None, error=None):
+        with self._cond:
+            backend.in_flight -= 1
+            if error is not None:
+                backend.failures += 1
+                backend.last_error = str(error)
+                # An overloaded backend (429) is only skipped for this request
+                if error.retryable and error.status_code != 429:
+                    backend.healthy = False
+            self._cond.notify_all()
+        if seconds is not None:
+            metrics.observe(backend.metric, seconds)
+
+    def check_health(self):
+        for backend in self.backends:
+            try:
+                response = backend._session.get(f"http://{backend.name}/api/tags", timeout=self.health_timeout)
+                healthy = response.status_code == 200
+                response.close()
+                error = None if healthy else f"health check returned HTTP {response.status_code}"
+            except requests.exceptions.RequestException as e:
+                healthy, error = False, f"health check failed: {e}"
+            with self._cond:
+                backend.healthy = healthy
+                if error:
+                    backend.last_error = error
+                self._cond.notify_all()
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def close(self):
+        self._stop.set()
+        for backend in self.backends:
+            backend._session.close()
+
+class PoolClient:
+    # OllamaClient's interface over an OllamaPool, for one model
+    def __init__(self, pool, model, keep_alive=None):
+        self.pool = pool
+        self.model = model
+        self.keep_alive = keep_alive
+
+    def _client(self, backend):
+        return backend.client(self.model, self.keep_alive, **self.pool.client_kwargs)
+
+    def generate(self, prompt, timeout=None, options=None, stats=None, context=None):
+        tried = []
+        while True:
+            backend = self.pool._acquire(tried)
+            tried.append(backend)
+            start = time.perf_counter()
+            try:
+                result = self._client(backend).generate(prompt, timeout, options, stats, context)
+            except OllamaError as e:
+                self.pool._release(backend, error=e)
+                if not e.retryable:
+                    raise
+                continue
+            self.pool._release(backend, time.perf_counter() - start)
+            return result
+
+    def generate_stream(self, prompt, timeout=None, options=None, stats=None, context=None):
+        # Fails over only before the first fragment, so output is never
+        # repeated
+        tried = []
+        while True:
+            backend = self.pool._acquire(tried)
+            tried.append(backend)
+            start = time.perf_counter()
+            started = False
+            try:
+                for fragment in self._client(backend).generate_stream(prompt, timeout, options, stats, context):
+                    started = True
+                    yield fragment
+            except OllamaError as e:
+                self.pool._release(backend, error=e)
+                if started or not e.retryable:
+                    raise
+                continue
+            except BaseException:
+                # The caller stopped reading (GeneratorExit) or was interrupted
+                self.pool._release(backend)
+                raise
+            self.pool._release(backend, time.perf_counter() - start)
+            return
@@ -1,37 +1,353 @@
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+# langchain, sentence-transformers, torch and faiss take seconds to import, so
+# they are imported where they are first needed rather than here
+from array import array
+from collections import OrderedDict
+import hashlib
+import json
 import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _sha256_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class ChunkEmbeddingCache:
+    # Embedding vectors keyed by (embedding model, chunk content hash), so an
+    # unchanged chunk is never embedded twice, whichever file it came from
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, chunk_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, chunk_hash))"
+        )
+        self.conn.commit()
+
+    def get_many(self, model, chunk_hashes):
+        found = {}
+        unique = list(dict.fromkeys(chunk_hashes))
+        # Stay below SQLite's bound-parameter limit
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT chunk_hash, vector FROM embeddings WHERE model = ? AND chunk_hash IN ({placeholders})",
+                [model] + batch,
+            )
+            for chunk_hash, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[chunk_hash] = vector.tolist()
+        return found
+
+    def put_many(self, model, items):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, chunk_hash, vector) VALUES (?, ?, ?)",
+            [(model, chunk_hash, array("f", vector).tobytes()) for chunk_hash, vector in items],
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
 
 class RAGRetriever:
-    def __init__(self, pdf_path="story.pdf", embedding_model="all-MiniLM-L6-v2"):
+    def __init__(self, pdf_path="story.pdf", embedding_model="all-MiniLM-L6-v2",
+                 chunk_size=1000, chunk_overlap=200, index_dir=".rag_index",
+                 corpus_dir=None, batch_size=64, precompute_queries=None, precompute_k=3,
+                 query_cache_size=256, index_type="flat", nprobe=16, ef_search=64,
+                 train_size=100000, mmap=False):
         self.pdf_path = pdf_path
+        self.corpus_dir = corpus_dir
         self.embedding_model = embedding_model
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.index_dir = index_dir
+        self.batch_size = batch_size
+        # Serving index: see ann_index for the types. With mmap the index file
+        # is mapped read-only, so worker processes share one copy of it.
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.train_size = train_size
+        self.mmap = mmap
+        self.index_spec = None
+        self.ann_build_time = None
         self.vectorstore = None
+        self.index_key = None
+        self.manifest = {"files": {}}
+        # Seconds spent loading the saved index and bringing it up to date
+        self.build_time = None
+        self.load_time = None
+        self.last_update = {}
+        # Results for a known, finite set of queries are computed once per
+        # index version; anything else goes through a small LRU
+        self.precompute_queries = list(precompute_queries or [])
+        self.precompute_k = precompute_k
+        self.query_cache_size = query_cache_size
+        self._table = {}
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.table_time = None
+        self.table_hits = 0
+        self.lru_hits = 0
+        self.misses = 0
         self._load_and_index()
+        if self.vectorstore is not None and self.precompute_queries:
+            self._prepare_table(os.path.join(self.index_dir, self.index_key))
+
+    def _sources(self):
+        if self.corpus_dir:
+            if not os.path.isdir(self.corpus_dir):
+                return []
+            paths = []
+            for root, _, files in os.walk(self.corpus_dir):
+                paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(".pdf"))
+            return sorted(paths)
+        return [self.pdf_path] if os.path.exists(self.pdf_path) else []
+
+    def _compute_index_key(self):
+        # Changing the splitter settings or embedding model invalidates every
+        # chunk, so those select the index directory; per-file hashes live in
+        # the manifest and drive incremental updates
+        settings = {
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "embedding_model": self.embedding_model,
+        }
+        return _sha256_text(json.dumps(settings, sort_keys=True))[:16]
 
     def _load_and_index(self):
-        if not os.path.exists(self.pdf_path):
-            print(f"Warning: {self.pdf_path} not found. RAG will not work.")
+        # Create embeddings; also used without a corpus, e.g. by "Find similar
+        # stories"
+        from langchain_huggingface import HuggingFaceEmbeddings
+        self.embeddings = HuggingFaceEmbeddings(model_name=self.embedding_model)
+
+        sources = self._sources()
+        if not sources:
+            print(f"Warning: {self.corpus_dir or self.pdf_path} has no PDFs. RAG will not work.")
+            return
+
+        self.index_key = self._compute_index_key()
+        index_path = os.path.join(self.index_dir, self.index_key)
+        manifest_path = os.path.join(index_path, "manifest.json")
+
+        # Only the manifest is read up front; the index itself is loaded when it
+        # has to be updated or once it is ready to serve
+        flat_path = os.path.join(index_path, "index.faiss")
+        if os.path.exists(flat_path) and os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+        start = time.perf_counter()
+        current = {path: _sha256_file(path) for path in sources}
+        indexed = self.manifest["files"]
+        removed = [path for path in indexed if current.get(path) != indexed[path]["sha256"]]
+        added = [path for path in current if path not in indexed or path in removed]
+
+        if removed or added:
+            if os.path.exists(flat_path):
+                self.vectorstore = self._read_store(index_path, "index.faiss")
+            cache = ChunkEmbeddingCache(os.path.join(self.index_dir, "embeddings.sqlite"))
+            try:
+                self.last_update = {"removed_files": len(removed), "added_files": len(added),
+                                    "embedded_chunks": 0, "cached_chunks": 0}
+                self._remove_files(removed)
+                for path in added:
+                    self._add_file(path, current[path], cache)
+            finally:
+                cache.close()
+            if self.vectorstore is not None:
+                self._save_index(index_path)
+            self.build_time = time.perf_counter() - start
+            print(f"RAG index {self.index_key} updated in {self.build_time * 1000:.1f} ms: {self.last_update}")
+
+        if not os.path.exists(flat_path):
             return
+        start = time.perf_counter()
+        self._open_serving_index(index_path)
+        self.load_time = time.perf_counter() - start
+        print(f"RAG index {self.index_key} ({self.index_spec}) ready in {self.load_time * 1000:.1f} ms")
+
+    def _read_store(self, index_path, index_file, mmap=False):
+        # Same files as FAISS.save_local writes, but the index is read through
+        # ann_index so it can be memory-mapped
+        from langchain_community.vectorstores import FAISS
+        import ann_index
+        index = ann_index.read_index(os.path.join(index_path, index_file), mmap)
+        with open(os.path.join(index_path, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        return FAISS(self.embeddings, index, docstore, index_to_docstore_id)
+
+    def _open_serving_index(self, index_path):
+        import ann_index
+        if self.index_type == "flat":
+            self.index_spec = "Flat"
+            if self.mmap or self.vectorstore is None:
+                self.vectorstore = self._read_store(index_path, "index.faiss", self.mmap)
+        else:
+            self.vectorstore = self._read_store(index_path, self._ann_file(index_path), self.mmap)
+        ann_index.set_search_params(self.vectorstore.index, self.nprobe, self.ef_search)
+
+    def _ann_file(self, index_path):
+        # The serving index is rebuilt whenever the flat index or its settings
+        # change; ann.json records what the current file was built from
+        info_path = os.path.join(index_path, "ann.json")
+        settings = {"index_type": self.index_type, "train_size": self.train_size,
+                    "manifest": _sha256_text(json.dumps(self.manifest, sort_keys=True))}
+        if os.path.exists(info_path):
+            with open(info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            if info["settings"] == settings and os.path.exists(os.path.join(index_path, info["file"])):
+                self.index_spec = info["spec"]
+                return info["file"]
+
+        import faiss
+        import ann_index
+        start = time.perf_counter()
+        source = self.vectorstore.index if self.vectorstore is not None else \
+            ann_index.read_index(os.path.join(index_path, "index.faiss"), mmap=True)
+        index, self.index_spec = ann_index.build_index(source, self.index_type, self.train_size)
+        name = f"ann-{_sha256_text(json.dumps(settings, sort_keys=True))[:12]}.faiss"
+        for old in os.listdir(index_path):
+            if old.startswith("ann-") and old.endswith(".faiss"):
+                os.remove(os.path.join(index_path, old))
+        faiss.write_index(index, os.path.join(index_path, name))
+        with open(info_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "spec": self.index_spec, "file": name}, f)
+        self.ann_build_time = time.perf_counter() - start
+        print(f"RAG {self.index_spec} index built in {self.ann_build_time * 1000:.1f} ms")
+        return name
+
+    def _remove_files(self, paths):
+        ids = []
+        for path in paths:
+            ids.extend(self.manifest["files"].pop(path)["ids"])
+        if ids and self.vectorstore is not None:
+            self.vectorstore.delete(ids)
+
+    def _add_file(self, path, file_hash, cache):
+        from langchain_community.document_loaders import PyPDFLoader
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        from langchain_community.vectorstores import FAISS
 
         # Load PDF
-        loader = PyPDFLoader(self.pdf_path)
+        loader = PyPDFLoader(path)
         documents = loader.load()
 
         # Split into chunks
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
         docs = text_splitter.split_documents(documents)
+        if not docs:
+            self.manifest["files"][path] = {"sha256": file_hash, "ids": []}
+            return
 
-        # Create embeddings
-        embeddings = HuggingFaceEmbeddings(model_name=self.embedding_model)
+        # Reuse cached vectors and embed only the chunks never seen before
+        hashes = [_sha256_text(doc.page_content) for doc in docs]
+        vectors = cache.get_many(self.embedding_model, hashes)
+        self.last_update["cached_chunks"] += sum(1 for h in hashes if h in vectors)
+        missing = list(dict.fromkeys((h, doc.page_content) for h, doc in zip(hashes, docs) if h not in vectors))
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i + self.batch_size]
+            embedded = self.embeddings.embed_documents([text for _, text in batch])
+            new_items = [(h, vector) for (h, _), vector in zip(batch, embedded)]
+            cache.put_many(self.embedding_model, new_items)
+            vectors.update(new_items)
+            self.last_update["embedded_chunks"] += len(batch)
 
-        # Build FAISS index
-        self.vectorstore = FAISS.from_documents(docs, embeddings)
+        # Vector ids are derived from the file path and chunk position so that
+        # identical chunks in different files stay separate entries
+        path_key = _sha256_text(path)[:12]
+        ids = [f"{path_key}-{file_hash[:12]}-{i}" for i in range(len(docs))]
+        text_embeddings = [(doc.page_content, vectors[h]) for doc, h in zip(docs, hashes)]
+        metadatas = [doc.metadata for doc in docs]
+        if self.vectorstore is None:
+            self.vectorstore = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas, ids=ids)
+        else:
+            self.vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        self.manifest["files"][path] = {"sha256": file_hash, "ids": ids}
 
-    def retrieve(self, query, k=3):
+    def _save_index(self, index_path):
+        # Only the current key is kept; indexes for old settings are removed
+        if os.path.isdir(self.index_dir):
+            for name in os.listdir(self.index_dir):
+                full = os.path.join(self.index_dir, name)
+                if name != self.index_key and os.path.isdir(full):
+                    shutil.rmtree(full, ignore_errors=True)
+        self.vectorstore.save_local(index_path)
+        with open(os.path.join(index_path, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+
+    def _index_version(self):
+        # The manifest lists every indexed file by content hash, so it changes
+        # whenever the index does; the serving index settings change results too
+        return _sha256_text(json.dumps({"manifest": self.manifest, "spec": self.index_spec,
+                                        "nprobe": self.nprobe, "ef_search": self.ef_search}, sort_keys=True))
+
+    def _prepare_table(self, index_path):
+        table_path = os.path.join(index_path, "retrievals.json")
+        version = self._index_version()
+        start = time.perf_counter()
+        table = {}
+        if os.path.exists(table_path):
+            with open(table_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("version") == version and saved.get("k") == self.precompute_k:
+                table = saved["results"]
+        missing = [q for q in dict.fromkeys(self.precompute_queries) if q not in table]
+        if missing:
+            table.update(zip(missing, self._search(missing, self.precompute_k)))
+            with open(table_path, "w", encoding="utf-8") as f:
+                json.dump({"version": version, "k": self.precompute_k, "results": table}, f)
+        self._table = table
+        self.table_time = time.perf_counter() - start
+        print(f"RAG retrieval table ready in {self.table_time * 1000:.1f} ms: "
+              f"{len(table)} queries, {len(missing)} computed")
+
+    def _search(self, queries, k):
+        # One batched embedding pass, then a vector search per query
+        vectors = self.embeddings.embed_documents(queries)
+        return [[doc.page_content for doc in self.vectorstore.similarity_search_by_vector(vector, k=k)]
+                for vector in vectors]
+
+    def retrieve_many(self, queries, k=3):
         if self.vectorstore is None:
-            return []
-        docs = self.vectorstore.similarity_search(query, k=k)
-        return [doc.page_content for doc in docs]
+            return [[] for _ in queries]
+        results = [None] * len(queries)
+        missing = {}
+        with self._lock:
+            for i, query in enumerate(queries):
+                if k == self.precompute_k and query in self._table:
+                    results[i] = list(self._table[query])
+                    self.table_hits += 1
+                elif (query, k) in self._lru:
+                    self._lru.move_to_end((query, k))
+                    results[i] = list(self._lru[(query, k)])
+                    self.lru_hits += 1
+                else:
+                    missing.setdefault(query, []).append(i)
+                    self.misses += 1
+        if missing:
+            found = self._search(list(missing), k)
+            with self._lock:
+                for query, passages in zip(missing, found):
+                    for i in missing[query]:
+                        results[i] = list(passages)
+                    self._lru[(query, k)] = passages
+                    self._lru.move_to_end((query, k))
+                while len(self._lru) > self.query_cache_size:
+                    self._lru.popitem(last=False)
+        return results
+
+    def retrieve(self, query, k=3):
+        return self.retrieve_many([query], k)[0]
@@ -0,0 +1,162 @@
+# Section headers in the model output and the section each one starts
+HEADERS = {
+    'Characters:': 'characters',
+    'Setting:': 'setting',
+    'Story:': 'story',
+    'Twist:': 'twist',
+}
+
+# Lines starting with one of these are dropped inside the given section
+EXCLUDED_PREFIXES = {
+    None: (),
+    'characters': ('Setting:', 'Story:', 'Twist:'),
+    'setting': ('Story:', 'Twist:'),
+    'story': ('Twist:',),
+    'twist': (),
+}
+
+TEXT_SECTIONS = ('setting', 'story', 'twist')
+
+# Function to parse story
+def parse_story(text):
+    lines = text.split('\n')
+    characters = []
+    setting = []
+    story = []
+    twist = []
+    current_section = None
+    for line in lines:
+        stripped = line.strip()
+        if stripped == 'Characters:':
+            current_section = 'characters'
+            continue
+        elif stripped == 'Setting:':
+            current_section = 'setting'
+            continue
+        elif stripped == 'Story:':
+            current_section = 'story'
+            continue
+        elif stripped == 'Twist:':
+            current_section = 'twist'
+            continue
+        if current_section == 'characters':
+            if stripped.startswith('-'):
+                characters.append(stripped[1:].strip())
+            elif stripped and not stripped.startswith(('Setting:', 'Story:', 'Twist:')):
+                characters.append(stripped)
+        elif current_section == 'setting':
+            if stripped and not stripped.startswith(('Story:', 'Twist:')):
+                setting.append(stripped)
+        elif current_section == 'story':
+            if stripped and not stripped.startswith('Twist:'):
+                story.append(stripped)
+        elif current_section == 'twist':
+            if stripped:
+                twist.append(stripped)
+    return characters, ' '.join(setting), ' '.join(story), ' '.join(twist)
+
+def _may_be_header(text):
+    # True while text (already left-stripped) could still turn out to be a
+    # header line or start with one, given more characters on the same line
+    for header in HEADERS:
+        if header.startswith(text):
+            return True
+        if text.startswith(header) and not text[len(header):].strip():
+            return True
+    return False
+
+class StoryStreamParser:
+    # Incremental equivalent of parse_story. feed() accepts arbitrary chunks of
+    # model output and returns the events that became certain, as tuples:
+    #   ('section', name)       a header switched to a new section
+    #   ('character', bio)      a complete character line
+    #   ('setting', text)       setting text; fragments concatenate to the
+    #   ('story', text)         same string parse_story returns for that
+    #   ('twist', text)         section
+    # Only the undecided part of the current line is buffered: at most a
+    # header's length for text sections, one line for the character list.
+    def __init__(self):
+        self.section = None
+        self.characters = []
+        self._parts = {name: [] for name in TEXT_SECTIONS}
+        self._reset_line()
+
+    def _reset_line(self):
+        self._pending = ''
+        self._streaming = False
+        self._dropping = False
+        self._held_ws = ''
+
+    def feed(self, chunk):
+        events = []
+        for i, part in enumerate(chunk.split('\n')):
+            if i:
+                self._end_line(events)
+            if part:
+                self._extend_line(part, events)
+        return events
+
+    def close(self):
+        events = []
+        if self._pending or self._streaming or self._dropping:
+            self._end_line(events)
+        return events
+
+    def result(self):
+        return (list(self.characters),) + tuple(''.join(self._parts[name]) for name in TEXT_SECTIONS)
+
+    def _emit_text(self, text, events, new_line=False):
+        # Trailing whitespace is held back until more text arrives on the same
+        # line, because parse_story strips it at the end of the line
+        text = self._held_ws + text
+        body = text.rstrip()
+        self._held_ws = text[len(body):]
+        if not body:
+            return
+        parts = self._parts[self.section]
+        if new_line and parts:
+            body = ' ' + body
+        parts.append(body)
+        events.append((self.section, body))
+
+    def _extend_line(self, part, events):
+        if self._dropping:
+            return
+        if self._streaming:
+            self._emit_text(part, events)
+            return
+        self._pending += part
+        if self.section == 'characters':
+            return
+        text = self._pending.lstrip()
+        if not text or _may_be_header(text):
+            return
+        self._pending = ''
+        if self.section is None or text.startswith(EXCLUDED_PREFIXES[self.section]):
+            self._dropping = True
+            return
+        self._streaming = True
+        self._emit_text(text, events, new_line=True)
+
+    def _end_line(self, events):
+        if self._streaming or self._dropping:
+            self._reset_line()
+            return
+        stripped = self._pending.strip()
+        self._reset_line()
+        if stripped in HEADERS:
+            self.section = HEADERS[stripped]
+            events.append(('section', self.section))
+            return
+        if self.section == 'characters':
+            if stripped.startswith('-'):
+                bio = stripped[1:].strip()
+            elif stripped and not stripped.startswith(EXCLUDED_PREFIXES['characters']):
+                bio = stripped
+            else:
+                return
+            self.characters.append(bio)
+            events.append(('character', bio))
+        elif self.section in TEXT_SECTIONS:
+            if stripped and not stripped.startswith(EXCLUDED_PREFIXES[self.section]):
+                self._emit_text(stripped, events, new_line=True)
@@ -0,0 +1,212 @@
+# Long stories written as an outline plus sections generated in parallel:
+#
+#   fragments, from_cache = stream_story_pipeline("Fantasy", 3, "Betrayal", 2000, "Dark", session=session_id)
+#   fragments.position()       # place in the generation queue, as stream_story
+#   for fragment in fragments:
+#       ...
+#
+# 1. A short planning call writes the characters, the setting and an outline
+#    with one beat per section of about SECTION_WORDS words.
+# 2. Every section is then submitted to the generation scheduler at once,
+#    each prompted with the shared outline and its own beat, so they run on
+#    as many backend slots as are free. They are read back in order: the
+#    first as it is written, later ones from what they buffered meanwhile.
+# 3. The twist explanation is written from the outline and the final section.
+#    Its Ollama context (outline, ending and twist) goes into stats, so Continue
+#    Story can resume from it like from a single-shot story.
+#
+# The fragments are in the Characters/Setting/Story/Twist format parse_story
+# expects, so they render and store like a single-shot story.
+import os
+import re
+from generation_cache import GenerationCache
+from metrics import metrics
+from story_parser import HEADERS, parse_story
+from storyteller import MODEL, build_prompt, get_generation_cache, sampling_options, schedule_prompt, serve_from_cache
+
+# Words per parallel section; a story gets story_length / SECTION_WORDS of
+# them, rounded, and at least one
+SECTION_WORDS = int(os.environ.get("STORYTELLER_SECTION_WORDS", "500"))
+TWIST_WORDS = 80
+
+OUTLINE_TEMPLATE = """
+You are an imaginative author planning a story. Do not write the story yet.
+- Genre: {genre}
+- Characters: {num_characters} unique characters
+- Twist Style: {twist_style}
+- Tone: {tone}
+{retrieved_context}
+Instructions:
+- Characters: Create {num_characters} characters with distinct names, traits, backstories, and personal conflicts. Each character should have a secret or hidden agenda that can fuel the twist.
+- Setting: Describe the setting with vivid sensory details appropriate to {genre}.
+- Outline: Plan the plot in exactly {sections} numbered beats of one or two sentences each. Build tension as the characters' goals clash, and reveal a {twist_style} twist in the last beat.
+Output Format (follow exactly):
+Characters:
+- Character 1 bio
+- Character 2 bio
+Setting:
+Setting description paragraph
+Outline:
+1. First beat
+2. Second beat
+"""
+
+SECTION_TEMPLATE = """
+You are an imaginative author writing one part of a {genre} story in a {tone} tone.
+Characters:
+{characters}
+Setting:
+{setting}
+Outline:
+{outline}
+Write part {part} of {parts}, covering beat {part}: {beat}
+{placement}
+Write only the prose of this part, about {words} words. Use rich, cinematic prose with dialogue that reveals personality. Do not add headings, other parts or an explanation of the twist.
+"""
+
+TWIST_TEMPLATE = """
+The outline of a {genre} story with a {twist_style} twist:
+{outline}
+The end of the story:
+{ending}
+Write only the twist explanation, about {words} words: what the twist reveals and how earlier events foreshadowed it.
+"""
+
+# Header lines a model may add on its own; dropped from sections and the
+# twist so they cannot break the story format
+PROSE_HEADERS = tuple(HEADERS) + ("Outline:",)
+
+def parse_outline(text):
+    # (characters, setting, beats) from the planning call's output
+    head, _, outline = text.partition("\nOutline:")
+    characters, setting, _, _ = parse_story(head)
+    beats = [match.group(1).strip() for match in re.finditer(r"^\s*\d+[.)]\s*(.+)$", outline, re.MULTILINE)]
+    return characters, setting, beats
+
+def section_count(story_length):
+    return max(1, round(story_length / SECTION_WORDS))
+
+def _placement(part, parts):
+    if parts == 1:
+        return "This part is the whole story: open it, build the tension and reveal the twist."
+    if part == 1:
+        return f"Open the story and stop where beat {part + 1} begins."
+    if part == parts:
+        return f"Pick up where beat {part - 1} ends and end the story with the twist."
+    return f"Pick up where beat {part - 1} ends and stop where beat {part + 1} begins."
+
+def _prose(fragments, collected=None):
+    # Pass fragments through, dropping lines that are only a section header.
+    # The start of each line is held back only while it could still be one.
+    held, line_start = "", True
+    for fragment in fragments:
+        out = []
+        for char in fragment:
+            if not line_start:
+                out.append(char)
+                line_start = char == "\n"
+                continue
+            held += char
+            if char == "\n":
+                if held.strip() not in PROSE_HEADERS:
+                    out.append(held)
+                held = ""
+            elif not any(header.startswith(held.lstrip()) for header in PROSE_HEADERS):
+                out.append(held)
+                held, line_start = "", False
+        if out:
+            text = "".join(out)
+            if collected is not None:
+                collected.append(text)
+            yield text
+    if held and held.strip() not in PROSE_HEADERS:
+        if collected is not None:
+            collected.append(held)
+        yield held
+
+class PipelineStream:
+    # Fragments of a pipelined story; position() is the planning call's place
+    # in the generation queue
+    def __init__(self, settings, retrieved_context, options, model, session, cache_key, stats):
+        self.settings = settings
+        self.options = options
+        self.model = model
+        self.session = session
+        self.cache_key = cache_key
+        self.stats = stats
+        self._streams = []
+        parts = section_count(settings['story_length'])
+        prompt = OUTLINE_TEMPLATE.format(sections=parts, retrieved_context=retrieved_context,
+                                         **{name: settings[name] for name in ("genre", "num_characters", "twist_style", "tone")})
+        self._outline = self._submit(prompt)
+
+    def _submit(self, prompt, stats=None):
+        stream = schedule_prompt(prompt, self.options, stats=stats, model=self.model, session=self.session)
+        self._streams.append(stream)
+        return stream
+
+    def position(self):
+        return self._outline.position()
+
+    def close(self):
+        for stream in self._streams:
+            stream.close()
+
+    def __iter__(self):
+        parts = []
+        try:
+            for fragment in self._generate():
+                parts.append(fragment)
+                yield fragment
+        finally:
+            self.close()
+        get_generation_cache().put(self.cache_key, "".join(parts))
+
+    def _generate(self):
+        settings = self.settings
+        with metrics.span("pipeline_outline"):
+            characters, setting, beats = parse_outline("".join(self._outline))
+        # Without usable beats the story is written as one section
+        beats = beats[:section_count(settings['story_length'])] or [f"The whole story, ending in a {settings['twist_style']} twist."]
+        outline = "\n".join(f"{i}. {beat}" for i, beat in enumerate(beats, 1))
+        words = settings['story_length'] // len(beats)
+        sections = [self._submit(SECTION_TEMPLATE.format(
+            genre=settings['genre'], tone=settings['tone'], characters="\n".join(f"- {c}" for c in characters),
+            setting=setting, outline=outline, part=part, parts=len(beats), beat=beat,
+            placement=_placement(part, len(beats)), words=words)) for part, beat in enumerate(beats, 1)]
+        if self.stats is not None:
+            self.stats['sections'] = len(beats)
+
+        yield "Characters:\n" + "".join(f"- {character}\n" for character in characters)
+        yield f"Setting:\n{setting}\nStory:\n"
+        ending = []
+        for i, section in enumerate(sections):
+            if i:
+                yield "\n\n"
+            yield from _prose(section, ending if i == len(sections) - 1 else None)
+        twist_stats = {}
+        twist = self._submit(TWIST_TEMPLATE.format(genre=settings['genre'], twist_style=settings['twist_style'],
+                                                   outline=outline, ending="".join(ending).strip(), words=TWIST_WORDS),
+                             twist_stats)
+        yield "\nTwist:\n"
+        yield from _prose(twist)
+        if self.stats is not None and twist_stats.get('context'):
+            self.stats['context'] = twist_stats['context']
+        yield "\n"
+
+# Like storyteller.stream_story, but written by the outline-then-sections
+# pipeline. Returns the fragments and whether they came from the generation
+# cache; raises SchedulerBusy when the queue is full.
+def stream_story_pipeline(genre, num_characters, twist_style, story_length, tone, retrieved_context="", seed=None,
+                          use_cache=None, stats=None, model=None, session=None):
+    options = sampling_options(seed)
+    # Cached apart from single-shot stories for the same settings
+    prompt = build_prompt(genre, num_characters, twist_style, story_length, tone, retrieved_context)
+    key = GenerationCache.make_key(f"pipeline:{SECTION_WORDS}\n{prompt}", model or MODEL, options)
+    if serve_from_cache(use_cache, seed):
+        cached = get_generation_cache().get(key)
+        if cached is not None:
+            return iter([cached]), True
+    settings = {"genre": genre, "num_characters": num_characters, "twist_style": twist_style,
+                "story_length": story_length, "tone": tone}
+    return PipelineStream(settings, retrieved_context, options, model, session, key, stats), False
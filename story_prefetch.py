@@ -0,0 +1,130 @@
+# Stories generated ahead of time, so "🎲 Surprise Me!" needs no waiting:
+#
+#   prefetcher = StoryPrefetcher(scheduler, produce, random_settings, target_size=4)
+#   prefetcher.start()
+#   story = prefetcher.take()     # any pooled story, or None
+#   story = prefetcher.take(genre="Horror", twist_style="Time Loop", tone="Dark",
+#                           num_characters=3, story_length=1000)
+#
+# A daemon thread keeps up to target_size stories for random settings, at most
+# per_combination for any genre / twist style / tone combination. It only
+# starts a generation while the scheduler is idle, and submits it as
+# background work, so interactive requests go first and stop it if they need
+# its slot. Stories older than max_age seconds are dropped, and each pooled
+# story is handed out once. Once nobody has taken a story for max_age
+# seconds the pool stops refilling until take() is called again.
+import threading
+import time
+from metrics import metrics
+from ollama_client import OllamaError
+
+COMBINATION = ("genre", "twist_style", "tone")
+
+class StoryPrefetcher:
+    def __init__(self, scheduler, produce, random_settings, target_size=4, per_combination=1, max_age=3600.0,
+                 interval=2.0, model=None):
+        # produce(settings, stats) returns the fragment iterator for a story;
+        # random_settings() returns a settings dict like the ones take()
+        # matches on
+        self.scheduler = scheduler
+        self.produce = produce
+        self.random_settings = random_settings
+        self.target_size = target_size
+        self.per_combination = per_combination
+        self.max_age = max_age
+        self.interval = interval
+        self.model = model
+        self.generated = 0
+        self.failed = 0
+        self.hits = 0
+        self._stories = []
+        self._last_used = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="story-prefetch")
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+
+    def __len__(self):
+        with self._lock:
+            self._expire()
+            return len(self._stories)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.max_age
+        self._stories = [story for story in self._stories if story['created'] >= cutoff]
+
+    def take(self, **settings):
+        # The oldest pooled story whose settings match, removed from the pool;
+        # None if there is none
+        with self._lock:
+            self._expire()
+            self._last_used = time.monotonic()
+            for i, story in enumerate(self._stories):
+                if all(story['settings'].get(name) == value for name, value in settings.items()):
+                    del self._stories[i]
+                    self.hits += 1
+                    metrics.record("prefetch_hits", 1)
+                    return story
+        metrics.record("prefetch_misses", 1)
+        return None
+
+    def _pick(self):
+        # Random settings whose combination is below its cap; None if the
+        # first few draws are all taken
+        with self._lock:
+            counts = {}
+            for story in self._stories:
+                combination = tuple(story['settings'][name] for name in COMBINATION)
+                counts[combination] = counts.get(combination, 0) + 1
+        for _ in range(10):
+            settings = self.random_settings()
+            if counts.get(tuple(settings[name] for name in COMBINATION), 0) < self.per_combination:
+                return settings
+        return None
+
+    def fill_one(self):
+        # Generate one story if the pool is short and the scheduler is idle;
+        # returns whether one was added
+        if len(self) >= self.target_size or not self.scheduler.idle():
+            return False
+        with self._lock:
+            if time.monotonic() - self._last_used > self.max_age:
+                return False
+        settings = self._pick()
+        if settings is None:
+            return False
+        stats = {}
+        start = time.perf_counter()
+        try:
+            stream = self.scheduler.submit(None, lambda generation_stats: self.produce(settings, generation_stats),
+                                           session="prefetch", stats=stats, background=True)
+            raw = "".join(stream)
+        except OllamaError:
+            # Preempted, or Ollama is down; try again on a later round
+            self.failed += 1
+            metrics.record("prefetch_failed", 1)
+            return False
+        metrics.observe("prefetch_generate", time.perf_counter() - start)
+        with self._lock:
+            self._stories.append({"settings": settings, "model": self.model, "raw": raw, "stats": stats,
+                                  "created": time.monotonic()})
+            self.generated += 1
+        return True
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            while not self._stop.is_set() and self.fill_one():
+                pass
+
+    def stats(self):
+        with self._lock:
+            self._expire()
+            return {"pooled": len(self._stories), "target": self.target_size, "generated": self.generated,
+                    "failed": self.failed, "hits": self.hits}
@@ -0,0 +1,104 @@
+# "Find similar stories": stories embedded with the RAG retriever's embedding
+# model, searched in an in-memory faiss index. Vectors are kept in the story
+# store, so opening the index reads them back and only stories that are new
+# (or continued) since they were last embedded cost an embedding.
+import threading
+import faiss
+import numpy as np
+
+def story_text(story):
+    return "\n".join([", ".join(story['characters']), story['setting'], story['story'], story['twist']])
+
+class SimilarStories:
+    def __init__(self, store, embeddings, model_name, batch_size=64):
+        self.store = store
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._index = None
+        # Job id of the latest background update(), set by whoever submits it
+        self.index_job = None
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        rows = store.vectors(model_name)
+        if rows:
+            ids = np.array([story_id for story_id, _ in rows], dtype="int64")
+            vectors = np.vstack([np.frombuffer(blob, dtype="float32") for _, blob in rows])
+            self._add(ids, vectors)
+
+    def __len__(self):
+        with self._lock:
+            return self._index.ntotal if self._index is not None else 0
+
+    def __contains__(self, story_id):
+        with self._lock:
+            return self._vector(story_id) is not None
+
+    def _vector(self, story_id):
+        if self._index is None:
+            return None
+        try:
+            return self._index.reconstruct(story_id)
+        except RuntimeError:
+            return None
+
+    def _add(self, ids, vectors):
+        with self._lock:
+            if self._index is None:
+                # Inner product over normalized vectors is cosine similarity
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+            self._index.remove_ids(ids)
+            self._index.add_with_ids(vectors, ids)
+
+    def _embed(self, stories):
+        vectors = np.asarray(self.embeddings.embed_documents([story_text(story) for story in stories]), dtype="float32")
+        faiss.normalize_L2(vectors)
+        ids = np.array([story['id'] for story in stories], dtype="int64")
+        self._add(ids, vectors)
+        for story_id, vector in zip(ids, vectors):
+            self.store.put_vector(int(story_id), self.model_name, vector)
+
+    def add_story(self, story):
+        # Embed one story now, e.g. the one just generated or continued
+        self._embed([story])
+
+    def update(self, job=None):
+        # Embed every story the index is missing; returns how many there were
+        with self._update_lock:
+            ids = self.store.unembedded(self.model_name)
+            for start in range(0, len(ids), self.batch_size):
+                stories = [self.store.load(story_id) for story_id in ids[start:start + self.batch_size]]
+                self._embed([story for story in stories if story is not None])
+                if job is not None:
+                    job.check_cancelled()
+                    done = min(start + self.batch_size, len(ids))
+                    job.set_progress(done / len(ids), f"{done}/{len(ids)} stories")
+            return len(ids)
+
+    def _search(self, vector, k, exclude=None):
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                return []
+            scores, ids = self._index.search(vector.reshape(1, -1), k + 1)
+        hits = [(int(story_id), float(score)) for story_id, score in zip(ids[0], scores[0])
+                if story_id != -1 and story_id != exclude][:k]
+        rows = self.store.get_many([story_id for story_id, _ in hits])
+        scores = dict(hits)
+        for row in rows:
+            row['score'] = scores[row['id']]
+        return rows
+
+    def similar_to(self, story_id, k=5):
+        # Stories closest to a stored story, most similar first, with a
+        # cosine similarity 'score'; empty while story_id is not embedded
+        with self._lock:
+            vector = self._vector(story_id)
+        if vector is None:
+            return []
+        return self._search(vector, k, exclude=story_id)
+
+    def search(self, text, k=5):
+        # Stories closest to a free-text description
+        vector = np.asarray(self.embeddings.embed_query(text), dtype="float32").reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return self._search(vector[0], k)
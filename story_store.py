@@ -0,0 +1,295 @@
+from array import array
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from story_parser import parse_story
+
+# Characters of story text kept with the metadata for gallery listings
+PREVIEW_CHARS = 160
+# Columns of the full-text index, from the open chapter of each story
+SEARCH_COLUMNS = ("characters", "setting", "story", "twist")
+FACETS = ("genre", "tone", "twist_style")
+# Text searches rank at most this many of the newest matching stories, so a
+# word found in every story costs the same as a rare one
+SEARCH_CANDIDATES = 2000
+LIST_COLUMNS = ("id", "created_at", "updated_at", "genre", "twist_style", "tone", "model", "chapters", "preview")
+
+def _pack_text(text):
+    return zlib.compress(text.encode("utf-8"))
+
+def _unpack_text(blob):
+    return zlib.decompress(blob).decode("utf-8")
+
+def _pack_context(context):
+    return zlib.compress(array("q", context).tobytes()) if context else None
+
+def _unpack_context(blob):
+    if blob is None:
+        return None
+    context = array("q")
+    context.frombytes(zlib.decompress(blob))
+    return context.tolist()
+
+def _search_values(raw):
+    characters, setting, story, twist = parse_story(raw)
+    return "\n".join(characters), setting, story, twist
+
+def match_query(text):
+    # Free text as an FTS5 query: every word must appear, and the last one,
+    # once it has 3 characters, is a prefix so results show up while typing.
+    # Shorter prefixes expand to too many words to stay fast.
+    words = text.split()
+    if not words:
+        return None
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    if len(words[-1]) >= 3:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+class StoryStore:
+    # Stories persisted in SQLite and shared by every session. Listing reads
+    # only the small `stories` rows; chapter text (zlib-compressed) and the
+    # continuation state are read when a story is opened. Each chapter is
+    # stored once as the raw text the model wrote, and the displayed sections
+    # are parsed from the latest chapter on load rather than stored again.
+    def __init__(self, path=os.path.join(".cache", "stories.sqlite")):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Stores created before the search tables existed are indexed once
+        backfill = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'story_text'").fetchone() is None
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS stories ("
+            "id INTEGER PRIMARY KEY, created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+            "genre TEXT, twist_style TEXT, tone TEXT, model TEXT, "
+            "chapters INTEGER NOT NULL, preview TEXT);"
+            "CREATE TABLE IF NOT EXISTS chapters ("
+            "story_id INTEGER NOT NULL, seq INTEGER NOT NULL, raw BLOB NOT NULL, "
+            "PRIMARY KEY (story_id, seq));"
+            # summarized_through: chapters already folded into the summary
+            "CREATE TABLE IF NOT EXISTS story_state ("
+            "story_id INTEGER PRIMARY KEY, summary TEXT, context BLOB, "
+            "summarized_through INTEGER NOT NULL DEFAULT 0);"
+            "CREATE INDEX IF NOT EXISTS stories_created ON stories (created_at);"
+            # Full-text index over the open chapter's sections, rowid = story
+            # id. It is contentless (the text is already in `chapters`) and
+            # keeps no word positions, only which column a word is in; a
+            # 3-character prefix index serves queries typed so far.
+            "CREATE VIRTUAL TABLE IF NOT EXISTS story_text USING fts5("
+            "characters, setting, story, twist, content='', detail=column, prefix='3', "
+            "tokenize='porter unicode61');"
+            # Stories per facet value, kept up to date on insert
+            "CREATE TABLE IF NOT EXISTS facets ("
+            "facet TEXT NOT NULL, value TEXT NOT NULL, stories INTEGER NOT NULL, PRIMARY KEY (facet, value));"
+            "CREATE TABLE IF NOT EXISTS story_vectors ("
+            "story_id INTEGER PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL);"
+        )
+        if backfill:
+            rows = self._conn.execute(
+                "SELECT story_id, raw FROM chapters c WHERE seq = "
+                "(SELECT MAX(seq) FROM chapters WHERE story_id = c.story_id)").fetchall()
+            for story_id, blob in rows:
+                self._index_text(story_id, _unpack_text(blob))
+            for name in FACETS:
+                self._conn.execute(
+                    f"INSERT INTO facets (facet, value, stories) SELECT ?, {name}, COUNT(*) FROM stories "
+                    f"WHERE {name} IS NOT NULL GROUP BY {name}", (name,))
+        self._conn.commit()
+
+    def create(self, story):
+        # Store a newly generated story dict (see storyteller.add_chapter) and
+        # return its id
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO stories (created_at, updated_at, genre, twist_style, tone, model, chapters) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (now, now, story.get('genre'), story.get('twist_style'), story.get('tone'), story.get('model')),
+            )
+            story_id = cursor.lastrowid
+            for name in FACETS:
+                if story.get(name) is not None:
+                    self._conn.execute(
+                        "INSERT INTO facets (facet, value, stories) VALUES (?, ?, 1) "
+                        "ON CONFLICT (facet, value) DO UPDATE SET stories = stories + 1", (name, story[name]))
+            self._insert_chapter(story_id, 0, story, now)
+            self._conn.commit()
+        return story_id
+
+    def append_chapter(self, story):
+        # Store the chapter add_chapter just recorded on an opened story; only
+        # the new chapter's text is written
+        now = time.time()
+        with self._lock:
+            seq = self._conn.execute("SELECT chapters FROM stories WHERE id = ?", (story['id'],)).fetchone()[0]
+            self._insert_chapter(story['id'], seq, story, now)
+            self._conn.commit()
+
+    def _index_text(self, story_id, raw, previous=None):
+        # A contentless index is updated by deleting the exact values the
+        # story was indexed with, re-parsed from its previous chapter
+        if previous is not None:
+            self._conn.execute(
+                "INSERT INTO story_text (story_text, rowid, characters, setting, story, twist) "
+                "VALUES ('delete', ?, ?, ?, ?, ?)", (story_id,) + _search_values(previous))
+        self._conn.execute("INSERT INTO story_text (rowid, characters, setting, story, twist) VALUES (?, ?, ?, ?, ?)",
+                           (story_id,) + _search_values(raw))
+
+    def _insert_chapter(self, story_id, seq, story, now):
+        chapters = seq + 1
+        previous = None
+        if seq:
+            previous = _unpack_text(self._conn.execute(
+                "SELECT raw FROM chapters WHERE story_id = ? AND seq = ?", (story_id, seq - 1)).fetchone()[0])
+            self._conn.execute("DELETE FROM story_vectors WHERE story_id = ?", (story_id,))
+        self._index_text(story_id, story['raw'], previous)
+        self._conn.execute("INSERT INTO chapters (story_id, seq, raw) VALUES (?, ?, ?)",
+                           (story_id, seq, _pack_text(story['raw'])))
+        self._conn.execute("UPDATE stories SET chapters = ?, updated_at = ?, preview = ? WHERE id = ?",
+                           (chapters, now, (story.get('story') or "")[:PREVIEW_CHARS], story_id))
+        self._conn.execute(
+            "INSERT OR REPLACE INTO story_state (story_id, summary, context, summarized_through) VALUES (?, ?, ?, ?)",
+            (story_id, story.get('summary'), _pack_context(story.get('context')),
+             chapters - len(story.get('history', [story['raw']]))),
+        )
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM stories").fetchone()[0]
+
+    def list(self, offset=0, limit=20):
+        # Metadata only, newest first
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(LIST_COLUMNS)} FROM stories ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+        return [dict(zip(LIST_COLUMNS, row)) for row in rows]
+
+    def _facet_clauses(self, facets, prefix=""):
+        clauses, params = [], []
+        for name in FACETS:
+            if facets.get(name):
+                clauses.append(f"{prefix}{name} = ?")
+                params.append(facets[name])
+        return clauses, params
+
+    def search(self, query="", limit=20, **facets):
+        # Stories matching every word of query and the given genre, tone and
+        # twist_style, best match first (newest first without a query)
+        match = match_query(query or "")
+        clauses, params = self._facet_clauses(facets, "s.")
+        columns = ", ".join(f"s.{name}" for name in LIST_COLUMNS)
+        with self._lock:
+            if match:
+                rows = self._conn.execute(
+                    f"SELECT {columns} FROM ("
+                    "SELECT story_text.rowid AS id, story_text.rank AS rank FROM story_text "
+                    "JOIN stories s ON s.id = story_text.rowid "
+                    f"WHERE {' AND '.join(['story_text MATCH ?'] + clauses)} "
+                    "ORDER BY story_text.rowid DESC LIMIT ?"
+                    ") m JOIN stories s ON s.id = m.id ORDER BY m.rank LIMIT ?",
+                    [match] + params + [SEARCH_CANDIDATES, limit]).fetchall()
+            else:
+                where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+                rows = self._conn.execute(
+                    f"SELECT {columns} FROM stories s{where} ORDER BY s.created_at DESC, s.id DESC LIMIT ?",
+                    params + [limit]).fetchall()
+        return [dict(zip(LIST_COLUMNS, row)) for row in rows]
+
+    def facet_counts(self):
+        # {facet: {value: stories}} over the whole library, most common first
+        counts = {name: {} for name in FACETS}
+        with self._lock:
+            for facet, value, stories in self._conn.execute(
+                    "SELECT facet, value, stories FROM facets ORDER BY stories DESC, value"):
+                counts[facet][value] = stories
+        return counts
+
+    def get_many(self, story_ids):
+        # Metadata rows for the given ids, in the same order
+        if not story_ids:
+            return []
+        placeholders = ",".join("?" * len(story_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(LIST_COLUMNS)} FROM stories WHERE id IN ({placeholders})", list(story_ids)).fetchall()
+        by_id = {row[0]: dict(zip(LIST_COLUMNS, row)) for row in rows}
+        return [by_id[story_id] for story_id in story_ids if story_id in by_id]
+
+    def load(self, story_id):
+        # The story dict the app works with, or None if there is no such story
+        with self._lock:
+            meta = self._conn.execute(
+                "SELECT genre, twist_style, tone, model FROM stories WHERE id = ?", (story_id,)
+            ).fetchone()
+            if meta is None:
+                return None
+            state = self._conn.execute(
+                "SELECT summary, context, summarized_through FROM story_state WHERE story_id = ?", (story_id,)
+            ).fetchone() or (None, None, 0)
+            # Only chapters not yet folded into the summary are read
+            raws = [_unpack_text(blob) for blob, in self._conn.execute(
+                "SELECT raw FROM chapters WHERE story_id = ? AND seq >= ? ORDER BY seq",
+                (story_id, state[2]),
+            )]
+        characters, setting, story, twist = parse_story(raws[-1])
+        result = {
+            'id': story_id,
+            'genre': meta[0],
+            'twist_style': meta[1],
+            'tone': meta[2],
+            'model': meta[3],
+            'characters': characters,
+            'setting': setting,
+            'story': story,
+            'twist': twist,
+            'raw': raws[-1],
+            'history': raws,
+            'context': _unpack_context(state[1]),
+        }
+        if state[0]:
+            result['summary'] = state[0]
+        return result
+
+    def put_vector(self, story_id, model, vector):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO story_vectors (story_id, model, vector) VALUES (?, ?, ?)",
+                               (story_id, model, array("f", vector).tobytes()))
+            self._conn.commit()
+
+    def vectors(self, model):
+        # (story_id, float32 bytes) for every story embedded with model
+        with self._lock:
+            return self._conn.execute("SELECT story_id, vector FROM story_vectors WHERE model = ?", (model,)).fetchall()
+
+    def unembedded(self, model):
+        # Ids of stories with no vector from model: new ones, and ones
+        # continued since they were embedded
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT id FROM stories s LEFT JOIN story_vectors v ON v.story_id = s.id AND v.model = ? "
+                "WHERE v.story_id IS NULL", (model,))]
+
+    def iter_stories(self, batch=50):
+        # Every story, oldest first, loaded one at a time
+        last_id = 0
+        while True:
+            with self._lock:
+                ids = [row[0] for row in self._conn.execute(
+                    "SELECT id FROM stories WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch))]
+            if not ids:
+                return
+            for story_id in ids:
+                story = self.load(story_id)
+                if story is not None:
+                    yield story
+            last_id = ids[-1]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
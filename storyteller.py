@@ -0,0 +1,351 @@
+# Story generation shared by the Streamlit app and the headless tools.
+# Nothing here imports Streamlit.
+import os
+import random
+import threading
+import time
+from ollama_client import get_client
+from ollama_pool import OllamaPool, parse_backends
+from context_compaction import compact_context
+from generation_cache import GenerationCache
+from generation_scheduler import GenerationScheduler
+from metrics import metrics, record_ollama_stats
+from story_prefetch import StoryPrefetcher
+
+# Constants
+MODEL = os.environ.get("OLLAMA_MODEL", "llama2")
+# Sent with every request so the model stays loaded between generations
+KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "localhost")
+OLLAMA_PORT = int(os.environ.get("OLLAMA_PORT", "11434"))
+# Several Ollama servers as "host:port=capacity,..." (see ollama_pool.py);
+# when set, requests are spread over them instead of OLLAMA_HOST/OLLAMA_PORT
+OLLAMA_BACKENDS = os.environ.get("OLLAMA_BACKENDS", "")
+# Streamed generations run through one scheduler per process (see
+# generation_scheduler.py): at most OLLAMA_CONCURRENCY at once on a single
+# server, or each backend's capacity with OLLAMA_BACKENDS. Requests beyond
+# STORYTELLER_MAX_QUEUE waiting, or expected to wait longer than
+# STORYTELLER_MAX_WAIT seconds, are turned away.
+OLLAMA_CONCURRENCY = int(os.environ.get("OLLAMA_CONCURRENCY", "2"))
+MAX_QUEUE = int(os.environ.get("STORYTELLER_MAX_QUEUE", "32"))
+MAX_WAIT = float(os.environ.get("STORYTELLER_MAX_WAIT", "120"))
+# Stories kept ready for "Surprise Me" (see story_prefetch.py): how many, how
+# many per genre/twist/tone combination, and for how long. Off (0) unless set.
+PREFETCH_SIZE = int(os.environ.get("STORYTELLER_PREFETCH", "0"))
+PREFETCH_PER_COMBINATION = int(os.environ.get("STORYTELLER_PREFETCH_PER_COMBINATION", "1"))
+PREFETCH_MAX_AGE = float(os.environ.get("STORYTELLER_PREFETCH_MAX_AGE", "3600"))
+# The model's context window in tokens. Ollama defaults to 2048; when
+# OLLAMA_NUM_CTX is set it is also sent as the num_ctx option.
+NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "2048"))
+# Tokens left in the window for the chapter a continuation writes
+CHAPTER_TOKENS = int(os.environ.get("STORYTELLER_CHAPTER_TOKENS", "1536"))
+# Largest token context sent back to Ollama when continuing a story, so the
+# context plus a new chapter fits the window. Beyond this, earlier chapters
+# are replaced by a rolling summary.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("STORYTELLER_CONTEXT_TOKENS", str(max(NUM_CTX - CHAPTER_TOKENS, 0))))
+# Retrieved passages are compacted to about this many tokens before going into
+# the prompt (see context_compaction.py); 0 pastes them in unchanged
+RAG_CONTEXT_TOKENS = int(os.environ.get("RAG_CONTEXT_TOKENS", "300"))
+# A request whose model load took at least this many seconds was a cold start
+COLD_LOAD_THRESHOLD = 0.5
+GENRES = ["Fantasy", "Sci-Fi", "Mystery", "Romance", "Horror", "Adventure", "Comedy", "Drama"]
+TWIST_STYLES = ["Betrayal", "Identity Reveal", "Time Loop", "Supernatural Element", "Redemption", "Tragedy", "Victory"]
+TONES = ["Dark", "Whimsical", "Poetic", "Satirical"]
+
+# Prompt template
+PROMPT_TEMPLATE = """
+You are an imaginative author who crafts unforgettable stories.
+Your task is to generate a story experience based on the following inputs:
+- Genre: {genre}
+- Characters: {num_characters} unique characters
+- Twist Style: {twist_style}
+- Story Length: about {story_length} words
+- Tone: {tone}
+{retrieved_context}
+Instructions:
+- Characters: Create {num_characters} characters with distinct names, traits, backstories, and personal conflicts. Each character should have a secret or hidden agenda that can fuel the twist.
+- World-building: Describe the setting with vivid sensory details. Add cultural, historical, or fantastical elements appropriate to {genre}.
+- Plot Development: Build tension as the characters' goals clash. Include dialogue that reveals personality and foreshadows the twist.
+- Plot Twist: Introduce a {twist_style} twist near the end that dramatically changes how the reader understands the story. Ensure the twist feels surprising but logical in hindsight.
+- Style: Use rich, cinematic prose. Balance action, description, and dialogue. Keep it engaging and immersive.
+Output Format (follow exactly):
+Characters:
+- Character 1 bio
+- Character 2 bio
+Setting:
+Setting description paragraph
+Story:
+Story narrative with twist
+Twist:
+Twist explanation
+"""
+
+CONTINUE_INSTRUCTION = "Continue the story with a new chapter of similar length, keeping the same characters, but updating the setting and twist if necessary. Output in the exact same format as the original story."
+
+SUMMARY_TEMPLATE = """Summarize the story below in under 200 words. Keep every character's name, goal and secret, and the major plot events in order.
+
+{story}
+
+Summary:"""
+
+# Random story settings, as "Surprise Me" picks them
+def random_settings():
+    return {
+        "genre": random.choice(GENRES),
+        "twist_style": random.choice(TWIST_STYLES),
+        "tone": random.choice(TONES),
+        "num_characters": random.randint(2, 5),
+        "story_length": random.randrange(500, 2001, 100),
+    }
+
+# Query used to look up RAG context for a story
+def rag_query(genre, twist_style, tone):
+    return f"Genre: {genre}, Twist Style: {twist_style}, Tone: {tone}"
+
+# Every query the UI can produce, for RAGRetriever(precompute_queries=...)
+RAG_QUERIES = [rag_query(genre, twist_style, tone) for genre in GENRES for twist_style in TWIST_STYLES for tone in TONES]
+
+# Retrieved passages formatted for the {retrieved_context} slot of the prompt.
+# report, if given, receives the compaction report (see compact_retrieved).
+def retrieve_context(retriever, genre, twist_style, tone, report=None):
+    query = rag_query(genre, twist_style, tone)
+    with metrics.span("retrieve"):
+        retrieved_docs = retriever.retrieve(query)
+    if retrieved_docs:
+        return "\nContext from documents:\n" + compact_retrieved(query, retrieved_docs, report)
+    return "\nNo relevant context found in documents."
+
+def compact_retrieved(query, passages, report=None, token_budget=None):
+    token_budget = RAG_CONTEXT_TOKENS if token_budget is None else token_budget
+    if token_budget <= 0:
+        return "\n".join(passages)
+    with metrics.span("compact_context"):
+        text, compaction = compact_context(query, passages, token_budget)
+    saved = compaction["context_tokens_before"] - compaction["context_tokens_after"]
+    compaction["prompt_eval_saved_s"] = saved * prompt_eval_seconds_per_token()
+    metrics.record("context_tokens_before", compaction["context_tokens_before"])
+    metrics.record("context_tokens_after", compaction["context_tokens_after"])
+    metrics.observe("context_prompt_eval_saved", compaction["prompt_eval_saved_s"])
+    if report is not None:
+        report.update(compaction)
+    return text
+
+def prompt_eval_seconds_per_token():
+    # Ollama's recent prompt evaluation speed; 0 until a request reports it
+    summary = metrics.summary()
+    seconds = summary.get("ollama_prompt_eval_duration", {}).get("sum")
+    tokens = summary.get("prompt_eval_count", {}).get("sum")
+    return seconds / tokens if seconds and tokens else 0.0
+
+# Function to build the story prompt
+def build_prompt(genre, num_characters, twist_style, story_length, tone, retrieved_context=""):
+    with metrics.span("render_prompt"):
+        return PROMPT_TEMPLATE.format(
+            genre=genre,
+            num_characters=num_characters,
+            twist_style=twist_style,
+            story_length=story_length,
+            tone=tone,
+            retrieved_context=retrieved_context
+        )
+
+_generation_cache = None
+_generation_cache_lock = threading.Lock()
+
+# Shared across sessions: an in-memory LRU in front of .cache/generations.sqlite
+def get_generation_cache():
+    global _generation_cache
+    with _generation_cache_lock:
+        if _generation_cache is None:
+            _generation_cache = GenerationCache()
+        return _generation_cache
+
+def set_generation_cache(cache):
+    global _generation_cache
+    with _generation_cache_lock:
+        _generation_cache = cache
+
+# Sampling options sent to Ollama; a fixed seed makes output reproducible
+def sampling_options(seed=None):
+    options = {"seed": seed} if seed is not None else {}
+    if "OLLAMA_NUM_CTX" in os.environ:
+        options["num_ctx"] = NUM_CTX
+    return options
+
+_ollama_pool = None
+_ollama_pool_lock = threading.Lock()
+
+# The backend pool, or None without OLLAMA_BACKENDS
+def get_ollama_pool():
+    global _ollama_pool
+    with _ollama_pool_lock:
+        if _ollama_pool is None and OLLAMA_BACKENDS:
+            _ollama_pool = OllamaPool(parse_backends(OLLAMA_BACKENDS))
+        return _ollama_pool
+
+def set_ollama_pool(pool):
+    global _ollama_pool
+    with _ollama_pool_lock:
+        _ollama_pool = pool
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            pool = get_ollama_pool()
+            concurrency = sum(b.capacity for b in pool.backends) if pool is not None else OLLAMA_CONCURRENCY
+            _scheduler = GenerationScheduler(concurrency, MAX_QUEUE, MAX_WAIT)
+        return _scheduler
+
+def set_scheduler(scheduler):
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
+
+_story_prefetcher = None
+_story_prefetcher_lock = threading.Lock()
+
+# Pool of stories generated in the background for random settings with the
+# default model and no RAG context; None with STORYTELLER_PREFETCH=0, or until
+# it is first asked for with create=True (the first Surprise Me)
+def get_story_prefetcher(create=False):
+    global _story_prefetcher
+    with _story_prefetcher_lock:
+        if _story_prefetcher is None and create and PREFETCH_SIZE > 0:
+            produce = lambda settings, stats: stream_prompt(build_prompt(**settings), stats=stats)
+            _story_prefetcher = StoryPrefetcher(get_scheduler(), produce, random_settings, PREFETCH_SIZE,
+                                                PREFETCH_PER_COMBINATION, PREFETCH_MAX_AGE, model=MODEL)
+            _story_prefetcher.start()
+        return _story_prefetcher
+
+def set_story_prefetcher(prefetcher):
+    global _story_prefetcher
+    with _story_prefetcher_lock:
+        _story_prefetcher = prefetcher
+
+# Shared client for a model (default MODEL)
+def ollama_client(model=None):
+    pool = get_ollama_pool()
+    if pool is not None:
+        return pool.client(model or MODEL, KEEP_ALIVE)
+    return get_client(OLLAMA_HOST, OLLAMA_PORT, model or MODEL, KEEP_ALIVE)
+
+# Whether a story request is answered from the generation cache. By default
+# only seeded requests are, since their cached story is exactly what a new
+# generation would return; without a seed every request writes a new story
+# unless the caller opts in with use_cache=True.
+def serve_from_cache(use_cache, seed):
+    return seed is not None if use_cache is None else use_cache
+
+# Function to generate story; raises OllamaError on failure
+def generate_story(genre, num_characters, twist_style, story_length, tone, retrieved_context="", seed=None, use_cache=None, model=None):
+    prompt = build_prompt(genre, num_characters, twist_style, story_length, tone, retrieved_context)
+    options = sampling_options(seed)
+    cache = get_generation_cache()
+    key = GenerationCache.make_key(prompt, model or MODEL, options)
+    if serve_from_cache(use_cache, seed):
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    stats = {}
+    with metrics.span("ollama_total"):
+        story = ollama_client(model).generate(prompt, options=options, stats=stats)
+    _record_generation(prompt, story, stats)
+    cache.put(key, story)
+    return story
+
+# Function to stream a story fragment by fragment. Returns the fragments and
+# whether they were served from the generation cache. A generation goes
+# through the scheduler, so the fragments may have a queue position() first;
+# session identifies the caller for fair queueing. Raises SchedulerBusy when
+# the queue is full.
+def stream_story(genre, num_characters, twist_style, story_length, tone, retrieved_context="", seed=None, use_cache=None, stats=None, model=None, session=None):
+    prompt = build_prompt(genre, num_characters, twist_style, story_length, tone, retrieved_context)
+    options = sampling_options(seed)
+    key = GenerationCache.make_key(prompt, model or MODEL, options)
+    use_cache = serve_from_cache(use_cache, seed)
+    if use_cache:
+        cached = get_generation_cache().get(key)
+        if cached is not None:
+            return iter([cached]), True
+    # Identical requests in flight share one generation, except fresh stories
+    # without a seed, which are asked to differ
+    merge_key = key if use_cache or seed is not None else None
+    produce = lambda generation_stats: _cache_when_complete(
+        key, stream_prompt(prompt, options, stats=generation_stats, model=model))
+    return get_scheduler().submit(merge_key, produce, session, stats), False
+
+# stream_prompt through the scheduler, never merged with other requests
+def schedule_prompt(prompt, options=None, context=None, stats=None, model=None, session=None):
+    produce = lambda generation_stats: stream_prompt(prompt, options, context, generation_stats, model)
+    return get_scheduler().submit(None, produce, session, stats)
+
+# Stream any prompt, recording time to first token, total time and sizes.
+# stats, if given, receives Ollama's final metadata including "context".
+def stream_prompt(prompt, options=None, context=None, stats=None, model=None):
+    stats = {} if stats is None else stats
+    parts = []
+    ttft = None
+    start = time.perf_counter()
+    for fragment in ollama_client(model).generate_stream(prompt, options=options, stats=stats, context=context):
+        if ttft is None:
+            ttft = time.perf_counter() - start
+            metrics.observe("ollama_ttft", ttft)
+        parts.append(fragment)
+        yield fragment
+    metrics.observe("ollama_total", time.perf_counter() - start)
+    # Ollama reports how long it spent loading the model for this request,
+    # which separates cold starts from warm ones
+    if ttft is not None and "load_duration" in stats:
+        cold = stats["load_duration"] / 1e9 >= COLD_LOAD_THRESHOLD
+        metrics.observe("ollama_ttft_cold" if cold else "ollama_ttft_warm", ttft)
+    _record_generation(prompt, "".join(parts), stats)
+
+def _record_generation(prompt, response, stats):
+    metrics.record("prompt_chars", len(prompt))
+    metrics.record("response_chars", len(response))
+    record_ollama_stats(stats)
+
+# Pass fragments through and cache the full text once the stream finishes
+def _cache_when_complete(key, fragments):
+    parts = []
+    for fragment in fragments:
+        parts.append(fragment)
+        yield fragment
+    get_generation_cache().put(key, "".join(parts))
+
+# Prompt and token context for the next chapter of a story dict. While the
+# context Ollama returned for the previous chapter fits the budget, only the
+# short instruction is sent and Ollama resumes from that context, so the cost
+# of a continuation does not grow with the story. Otherwise the chapters
+# covered by the old context are folded into a rolling summary and the prompt
+# is rebuilt from that summary plus the latest chapter. The summary is
+# generated through the scheduler on behalf of session.
+def continuation_request(story, session=None):
+    context = story.get('context')
+    if context and len(context) <= CONTEXT_TOKEN_BUDGET:
+        return f"\n\n{CONTINUE_INSTRUCTION}\n\nContinued story:", context
+    earlier = story.get('history', [])[:-1]
+    if earlier:
+        story['summary'] = summarize_story(story.get('summary'), earlier, story.get('model'), session)
+        story['history'] = story['history'][-1:]
+    prompt = CONTINUE_INSTRUCTION + "\n\n"
+    if story.get('summary'):
+        prompt += f"Summary of the story so far:\n{story['summary']}\n\nMost recent chapter:\n\n"
+    else:
+        prompt += "Original story:\n\n"
+    return prompt + f"{story['raw']}\n\nContinued story:", None
+
+def summarize_story(summary, chapters, model=None, session=None):
+    text = "\n\n".join(([f"Earlier events: {summary}"] if summary else []) + list(chapters))
+    with metrics.span("summarize"):
+        return "".join(schedule_prompt(SUMMARY_TEMPLATE.format(story=text), sampling_options(), model=model, session=session)).strip()
+
+# Record a newly generated chapter on a story dict
+def add_chapter(story, raw, stats):
+    story['raw'] = raw
+    story['context'] = stats.get('context')
+    story['history'] = story.get('history', []) + [raw]
@@ -0,0 +1,6 @@
+# Tests run from the repository root without installing anything: the
+# project's flat modules are imported straight from it.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
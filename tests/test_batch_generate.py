@@ -0,0 +1,50 @@
+import json
+import pytest
+import storyteller
+from batch_generate import build_jobs, run_batch
+from benchmarks.fake_ollama import FakeOllamaServer
+from generation_cache import GenerationCache
+
+class BrokenRetriever:
+    def retrieve(self, query):
+        if "Horror" in query:
+            raise RuntimeError("index file is corrupt")
+        return []
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    server = FakeOllamaServer(token_rate=10000, ttft=0).start()
+    monkeypatch.setattr(storyteller, "OLLAMA_HOST", server.host)
+    monkeypatch.setattr(storyteller, "OLLAMA_PORT", server.port)
+    storyteller.set_generation_cache(GenerationCache(str(tmp_path / "generations.sqlite")))
+    yield server
+    storyteller.set_generation_cache(None)
+    server.stop()
+
+def read_records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+def test_failed_retrieval_fails_only_its_job(server, tmp_path):
+    output = str(tmp_path / "catalog.jsonl")
+    jobs = build_jobs(["Fantasy", "Horror"], ["Betrayal"], ["Dark"], [100], 2, True, None)
+    summary = run_batch(jobs, output, concurrency=2, retriever=BrokenRetriever())
+    assert (summary["completed"], summary["failed"]) == (1, 1)
+    records = {record["params"]["genre"]: record for record in read_records(output)}
+    assert records["Horror"]["status"] == "error"
+    assert "index file is corrupt" in records["Horror"]["error"]
+    assert records["Fantasy"]["status"] == "ok" and records["Fantasy"]["characters"]
+
+def test_rerun_skips_completed_jobs(server, tmp_path):
+    output = str(tmp_path / "catalog.jsonl")
+    jobs = build_jobs(["Fantasy"], ["Betrayal", "Time Loop"], ["Dark"], [100], 2, False, None)
+    run_batch(jobs, output)
+    summary = run_batch(jobs, output)
+    assert (summary["completed"], summary["skipped"]) == (0, 2)
+    assert len(read_records(output)) == 2
+
+def test_summary_percentiles():
+    from batch_generate import summarize
+    summary = summarize([3.0, 1.0, 2.0, 4.0], failures=1, skipped=0, elapsed=10.0)
+    assert (summary["latency_p50_s"], summary["latency_p99_s"], summary["latency_max_s"]) == (2.0, 4.0, 4.0)
+    assert summarize([], 0, 0, 0)["latency_p50_s"] is None
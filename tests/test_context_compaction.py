@@ -0,0 +1,52 @@
+from context_compaction import compact_context, estimate_tokens, merge_passages, split_sentences
+
+DOCUMENT = ("The lighthouse keeper kept a journal of every ship that passed the northern rocks. "
+            "Each winter the harbor froze and the village traded only by sledge. "
+            "A betrayal by the harbor master left three ships wrecked on the rocks. "
+            "The keeper's daughter later found the journal hidden under the floorboards.")
+
+def chunks(text, size=120, overlap=40):
+    # Like the splitter: fixed-size chunks repeating overlap characters
+    return [text[start:start + size] for start in range(0, len(text) - overlap, size - overlap)]
+
+def test_overlapping_chunks_merge_back():
+    merged, merges = merge_passages(chunks(DOCUMENT))
+    assert merged == [(DOCUMENT, 0)]
+    assert merges == len(chunks(DOCUMENT)) - 1
+
+def test_contained_chunk_merges_and_keeps_best_rank():
+    merged, merges = merge_passages(["the harbor froze", DOCUMENT])
+    assert merged == [(DOCUMENT, 0)]
+    assert merges == 1
+
+def test_short_shared_text_is_not_an_overlap():
+    merged, merges = merge_passages(["The keeper slept.", "slept. Then dawn."])
+    assert merges == 0
+    assert len(merged) == 2
+
+def test_duplicates_are_dropped():
+    copy = DOCUMENT.replace("northern", "Northern")
+    # Not contained in DOCUMENT, so only the sentence check catches it
+    echo = "Each winter, the harbor froze and the village traded only by sledge!"
+    text, report = compact_context("harbor betrayal", [DOCUMENT, copy, echo], token_budget=1000)
+    assert report["duplicate_passages"] == 1
+    assert report["duplicate_sentences"] == 1
+    assert text.count("Each winter") == 1
+    assert report["sentences_kept"] == len(split_sentences(DOCUMENT))
+
+def test_budget_is_respected_and_query_sentences_kept():
+    passages = [DOCUMENT, "Page 12 of 340. Copyright the lighthouse society."]
+    text, report = compact_context("betrayal by the harbor master", passages, token_budget=30)
+    assert "A betrayal by the harbor master" in text
+    assert report["context_tokens_after"] <= 30
+    assert report["context_tokens_before"] == estimate_tokens("\n".join(passages))
+    assert report["sentences_dropped"] > 0
+
+def test_kept_sentences_stay_in_reading_order():
+    text, _ = compact_context("journal", [DOCUMENT], token_budget=50)
+    assert text.index("lighthouse keeper kept a journal") < text.index("found the journal")
+
+def test_no_passages():
+    text, report = compact_context("anything", [], token_budget=100)
+    assert text == ""
+    assert report["sentences_kept"] == 0
@@ -0,0 +1,105 @@
+import io
+import os
+import zipfile
+import pytest
+import exports
+from exports import PDFCache, _apply_voice, export_gallery_pdf, export_gallery_zip, render_pdf, story_version
+
+STORY = (["Ada: a lighthouse keeper"], "A rocky northern coast.", "The lamp went dark.", "Ada had put it out.")
+
+def gallery_story(number):
+    return {"genre": "Horror", "twist_style": "Betrayal", "characters": [f"Character {number}: a sailor"],
+            "setting": "A harbor.", "story": f"Chapter {number}.", "twist": "It was a dream."}
+
+class Engine:
+    # Stands in for a pyttsx3 engine: the properties last set
+    def __init__(self):
+        self.properties = {"voices": [type("Voice", (), {"id": voice}) for voice in ("adult", "child")],
+                           "rate": 175}
+
+    def getProperty(self, name):
+        return self.properties[name]
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+@pytest.fixture(autouse=True)
+def pdf_cache(monkeypatch):
+    cache = PDFCache()
+    monkeypatch.setattr(exports, "pdf_cache", cache)
+    return cache
+
+def test_cache_evicts_least_recently_used():
+    cache = PDFCache(max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"
+    cache.put("c", b"1234")
+    assert cache.get("b") is None
+    assert cache.get("a") == cache.get("c") == b"1234"
+
+def test_cache_keeps_an_entry_larger_than_its_limit():
+    cache = PDFCache(max_bytes=2)
+    cache.put("a", b"1234")
+    assert cache.get("a") == b"1234"
+
+def test_story_version_changes_with_any_field():
+    versions = {story_version(*STORY)}
+    for i in range(4):
+        changed = list(STORY)
+        changed[i] = changed[i] + ["x"] if isinstance(changed[i], list) else changed[i] + "x"
+        versions.add(story_version(*changed))
+    assert len(versions) == 5
+
+def test_render_pdf_is_cached_per_version(pdf_cache):
+    data = render_pdf(*STORY)
+    assert data.startswith(b"%PDF")
+    assert pdf_cache.get(story_version(*STORY)) is data
+    assert render_pdf(*STORY) is data
+    assert render_pdf(*STORY[:3], "A different twist.") is not data
+
+def test_gallery_zip_reads_stories_one_at_a_time(tmp_path):
+    read = []
+    def stories():
+        for number in range(1, 4):
+            read.append(number)
+            yield gallery_story(number)
+    chunks = exports.stream_gallery_zip(stories(), total=3)
+    next(chunks)
+    assert read == [1]
+    data = b"".join(chunks)
+    names = zipfile.ZipFile(io.BytesIO(data)).namelist()
+    assert names == [f"story-00{number}-horror-betrayal.pdf" for number in range(1, 4)]
+
+def test_gallery_exports_write_files(tmp_path):
+    stories = [gallery_story(number) for number in range(1, 3)]
+    zip_path = export_gallery_zip(stories, str(tmp_path / "gallery.zip"))
+    with zipfile.ZipFile(zip_path) as archive:
+        assert archive.testzip() is None
+        assert all(archive.read(name).startswith(b"%PDF") for name in archive.namelist())
+    pdf_path = export_gallery_pdf(iter(stories), str(tmp_path / "gallery.pdf"), total=2)
+    with open(pdf_path, "rb") as f:
+        assert f.read(4) == b"%PDF"
+
+def test_voice_styles_do_not_leak_into_each_other():
+    engine = Engine()
+    _apply_voice(engine, "Child", 175)
+    assert (engine.properties["voice"], engine.properties["rate"]) == ("child", 200)
+    _apply_voice(engine, "Narrator", 175)
+    assert (engine.properties["voice"], engine.properties["rate"]) == ("adult", 175)
+
+def test_prune_skips_files_a_running_narration_holds(tmp_path, monkeypatch):
+    monkeypatch.setattr(exports, "TTS_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(exports, "TTS_CACHE_MAX_BYTES", 0)
+    paths = [str(tmp_path / f"{i}.wav") for i in range(3)]
+    for path in paths:
+        with open(path, "wb") as f:
+            f.write(b"RIFF")
+    exports._hold_tts_files(paths[:2])
+    exports._hold_tts_files(paths[1:2])
+    exports._release_tts_files(paths[:2])
+    exports._prune_tts_cache()
+    assert [os.path.exists(path) for path in paths] == [False, True, False]
+    exports._release_tts_files(paths[1:2])
+    exports._prune_tts_cache()
+    assert not os.path.exists(paths[1])
@@ -0,0 +1,78 @@
+import pytest
+import generation_cache
+from generation_cache import GenerationCache
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(generation_cache.time, "time", clock)
+    return clock
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "generations.sqlite")
+
+def test_entries_expire_after_ttl(path, clock):
+    cache = GenerationCache(path, ttl=60)
+    cache.put("a", "story")
+    clock.now += 59
+    assert cache.get("a") == "story"
+    clock.now += 2
+    assert cache.get("a") is None
+    # The expired row is gone from disk too, not only from memory
+    assert cache.stats()["disk_entries"] == 0
+    assert GenerationCache(path, ttl=60).get("a") is None
+
+def test_expiry_counts_from_creation_not_last_access(path, clock):
+    cache = GenerationCache(path, ttl=60)
+    cache.put("a", "story")
+    for _ in range(3):
+        clock.now += 30
+        cache.get("a")
+    assert cache.get("a") is None
+
+def test_memory_tier_evicts_least_recently_used(path, clock):
+    cache = GenerationCache(path, max_memory_entries=2)
+    for key in "abc":
+        cache.put(key, key.upper())
+        clock.now += 1
+    assert cache.stats()["memory_entries"] == 2
+    # "a" fell out of memory but is still on disk
+    assert cache.get("a") == "A"
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.get("c") == "C"
+    assert cache.stats()["memory_hits"] == 1
+
+def test_disk_tier_keeps_most_recently_accessed(path, clock):
+    cache = GenerationCache(path, max_memory_entries=1, max_disk_entries=2)
+    cache.put("a", "A")
+    clock.now += 1
+    cache.put("b", "B")
+    clock.now += 1
+    cache.get("a")
+    clock.now += 1
+    cache.put("c", "C")
+    reopened = GenerationCache(path, max_disk_entries=2)
+    assert reopened.get("b") is None
+    assert reopened.get("a") == "A"
+    assert reopened.get("c") == "C"
+
+def test_entries_survive_reopening(path, clock):
+    GenerationCache(path).put("a", "story")
+    cache = GenerationCache(path)
+    assert cache.get("a") == "story"
+    assert cache.stats()["disk_hits"] == 1
+
+def test_keys_cover_prompt_model_and_options():
+    key = GenerationCache.make_key("prompt", "llama2", {"seed": 1})
+    assert key == GenerationCache.make_key("prompt", "llama2", {"seed": 1})
+    assert key != GenerationCache.make_key("prompt", "llama2", {"seed": 2})
+    assert key != GenerationCache.make_key("prompt", "mistral", {"seed": 1})
+    assert GenerationCache.make_key("prompt", "llama2") == GenerationCache.make_key("prompt", "llama2", {})
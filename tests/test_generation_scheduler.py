@@ -0,0 +1,171 @@
+import threading
+import pytest
+from generation_scheduler import GenerationScheduler, Preempted, SchedulerBusy
+from ollama_client import OllamaError
+
+TIMEOUT = 5
+
+class Producer:
+    # produce() for the scheduler; each generation yields its fragments once
+    # release() is called, so tests decide when generations finish
+    def __init__(self, fragments=("Once", " upon", " a time")):
+        self.fragments = fragments
+        self.calls = 0
+        self.started = threading.Event()
+        self._release = threading.Event()
+
+    def __call__(self, stats):
+        self.calls += 1
+        return self._generate(stats)
+
+    def _generate(self, stats):
+        self.started.set()
+        for fragment in self.fragments:
+            assert self._release.wait(TIMEOUT)
+            yield fragment
+        stats['eval_count'] = len(self.fragments)
+
+    def release(self):
+        self._release.set()
+
+@pytest.fixture
+def scheduler():
+    scheduler = GenerationScheduler(max_concurrency=1, max_queue=3, max_wait=120)
+    yield scheduler
+    scheduler._pool.shutdown(wait=False)
+
+def test_same_key_merges_into_one_generation(scheduler):
+    produce = Producer()
+    first_stats, second_stats = {}, {}
+    first = scheduler.submit("story", produce, session="a", stats=first_stats)
+    second = scheduler.submit("story", produce, session="b", stats=second_stats)
+    produce.release()
+    assert "".join(first) == "".join(second) == "Once upon a time"
+    assert produce.calls == 1
+    assert first_stats == second_stats == {"eval_count": 3}
+    assert scheduler.stats()["merged"] == 1
+
+def test_different_keys_do_not_merge(scheduler):
+    produce = Producer()
+    streams = [scheduler.submit(key, produce, session="a") for key in ("one", "two")]
+    produce.release()
+    assert ["".join(stream) for stream in streams] == ["Once upon a time"] * 2
+    assert produce.calls == 2
+
+def test_full_queue_rejects_straight_away(scheduler):
+    running = Producer()
+    streams = [scheduler.submit("running", running, session="a")]
+    assert running.started.wait(TIMEOUT)
+    queued = Producer()
+    streams += [scheduler.submit(f"queued{i}", queued, session="a") for i in range(scheduler.max_queue)]
+    with pytest.raises(SchedulerBusy) as busy:
+        scheduler.submit("one too many", queued, session="b")
+    assert busy.value.retryable
+    assert scheduler.stats()["rejected"] == 1
+    running.release()
+    queued.release()
+    for stream in streams:
+        "".join(stream)
+
+def test_long_estimated_wait_rejects(scheduler):
+    scheduler.max_wait = 10
+    scheduler._durations.append(30.0)
+    running = Producer()
+    stream = scheduler.submit("running", running, session="a")
+    with pytest.raises(SchedulerBusy):
+        scheduler.submit("queued", Producer(), session="b")
+    running.release()
+    "".join(stream)
+
+def test_sessions_are_served_round_robin(scheduler):
+    running = Producer()
+    blocker = scheduler.submit("running", running, session="a")
+    assert running.started.wait(TIMEOUT)
+    a1, a2 = (scheduler.submit(key, Producer(), session="a") for key in ("a1", "a2"))
+    b1 = scheduler.submit("b1", Producer(), session="b")
+    assert blocker.position() == 0
+    assert [a1.position(), b1.position(), a2.position()] == [1, 2, 3]
+    for stream in (blocker, a1, a2, b1):
+        stream.close()
+    running.release()
+
+def test_abandoned_request_frees_its_queue_slot(scheduler):
+    running = Producer()
+    blocker = scheduler.submit("running", running, session="a")
+    assert running.started.wait(TIMEOUT)
+    queued = Producer()
+    abandoned = scheduler.submit("abandoned", queued, session="b")
+    assert scheduler.stats()["queued"] == 1
+    abandoned.close()
+    assert scheduler.stats()["queued"] == 0
+    running.release()
+    assert "".join(blocker) == "Once upon a time"
+    assert queued.calls == 0
+
+def test_errors_reach_every_subscriber(scheduler):
+    def produce(stats):
+        yield "Once"
+        raise ConnectionError("server went away")
+    streams = [scheduler.submit("story", produce, session=session) for session in ("a", "b")]
+    for stream in streams:
+        with pytest.raises(OllamaError, match="server went away"):
+            "".join(stream)
+
+def test_interactive_request_preempts_background_work(scheduler):
+    background = Producer(fragments=("Once",) * 10)
+    background_stream = scheduler.submit(None, background, session="prefetch", background=True)
+    assert background.started.wait(TIMEOUT)
+    assert not scheduler.idle()
+    # The background generation's slot counts as free, so this is not rejected
+    scheduler._durations.append(1000.0)
+    interactive = Producer()
+    stream = scheduler.submit("story", interactive, session="a")
+    assert scheduler.stats()["preempted"] == 1
+    background.release()
+    with pytest.raises(Preempted):
+        "".join(background_stream)
+    interactive.release()
+    assert "".join(stream) == "Once upon a time"
+    assert scheduler.stats()["background"] == 0
+
+def test_background_work_waits_for_interactive_requests(scheduler):
+    interactive = Producer()
+    stream = scheduler.submit("story", interactive, session="a")
+    background = Producer()
+    background_stream = scheduler.submit(None, background, session="prefetch", background=True)
+    assert scheduler.stats()["background"] == 1
+    assert not background.started.is_set()
+    interactive.release()
+    background.release()
+    assert "".join(stream) == "".join(background_stream) == "Once upon a time"
+    assert scheduler.stats()["preempted"] == 0
+
+def test_produce_failing_before_its_first_fragment(scheduler):
+    def produce(stats):
+        raise ValueError("bad prompt")
+    streams = [scheduler.submit("story", produce, session=session) for session in ("a", "b")]
+    for stream in streams:
+        with pytest.raises(OllamaError, match="bad prompt"):
+            "".join(stream)
+    assert scheduler.idle()
+    assert scheduler.stats()["running"] == 0
+    ok = Producer()
+    ok.release()
+    assert "".join(scheduler.submit("story", ok, session="a")) == "Once upon a time"
+
+def test_estimated_wait_counts_queued_work():
+    scheduler = GenerationScheduler(max_concurrency=2, max_queue=10, max_wait=15)
+    scheduler._durations.append(10.0)
+    running = Producer()
+    streams = [scheduler.submit("first", running, session="a")]
+    assert running.started.wait(TIMEOUT)
+    # One slot is free, so the next request starts at once; the two after it
+    # wait for one generation to finish, the fourth for two
+    assert [scheduler._estimated_wait(position) for position in (1, 2, 3, 4)] == [0.0, 10.0, 10.0, 20.0]
+    streams += [scheduler.submit(key, Producer(), session=key) for key in ("b", "c", "d")]
+    with pytest.raises(SchedulerBusy):
+        scheduler.submit("e", Producer(), session="e")
+    for stream in streams:
+        stream.close()
+    running.release()
+    scheduler._pool.shutdown(wait=False)
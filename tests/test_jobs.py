@@ -0,0 +1,108 @@
+import threading
+import time
+import pytest
+from jobs import CANCELLED, DONE, FAILED, QUEUED, RUNNING, JobCancelled, JobExecutor
+
+TIMEOUT = 5
+
+@pytest.fixture
+def executor():
+    executor = JobExecutor(max_workers=1)
+    yield executor
+    executor.shutdown(wait=False)
+
+def blocking_job(started, release):
+    def run(job):
+        started.set()
+        assert release.wait(TIMEOUT)
+        return "done"
+    return run
+
+def test_result_and_status_after_success(executor):
+    job_id = executor.submit("echo", lambda text, job: text.upper(), "story")
+    assert executor.result(job_id, TIMEOUT) == "STORY"
+    status = executor.status(job_id)
+    assert (status["status"], status["progress"], status["error"]) == (DONE, 1.0, None)
+    assert status["started_at"] <= status["finished_at"]
+
+def test_cancel_queued_job_never_starts(executor):
+    started, release = threading.Event(), threading.Event()
+    first = executor.submit("block", blocking_job(started, release))
+    assert started.wait(TIMEOUT)
+    calls = []
+    queued = executor.submit("queued", lambda job: calls.append(job))
+    assert executor.status(queued)["status"] == QUEUED
+    assert executor.cancel(queued)
+    assert executor.status(queued)["status"] == CANCELLED
+    release.set()
+    assert executor.result(first, TIMEOUT) == "done"
+    with pytest.raises(JobCancelled):
+        executor.result(queued, TIMEOUT)
+    assert calls == []
+
+def test_cancel_running_job_stops_at_its_next_check(executor):
+    started, hooks = threading.Event(), []
+    def run(job):
+        job.on_cancel(lambda: hooks.append("cancelled"))
+        started.set()
+        while True:
+            job.check_cancelled()
+            time.sleep(0.01)
+    job_id = executor.submit("loop", run)
+    assert started.wait(TIMEOUT)
+    assert executor.status(job_id)["status"] == RUNNING
+    assert executor.cancel(job_id)
+    with pytest.raises(JobCancelled):
+        executor.result(job_id, TIMEOUT)
+    assert executor.status(job_id)["status"] == CANCELLED
+    assert hooks == ["cancelled"]
+    assert not executor.cancel(job_id)
+
+def test_failure_is_reported(executor):
+    def fail(job):
+        raise ValueError("no text to narrate")
+    job_id = executor.submit("fail", fail)
+    with pytest.raises(RuntimeError, match="no text to narrate"):
+        executor.result(job_id, TIMEOUT)
+    status = executor.status(job_id)
+    assert (status["status"], status["error"]) == (FAILED, "no text to narrate")
+    assert not executor.cancel(job_id)
+
+def test_failure_without_message_uses_exception_name(executor):
+    def fail(job):
+        raise KeyError()
+    job_id = executor.submit("fail", fail)
+    with pytest.raises(RuntimeError, match="KeyError"):
+        executor.result(job_id, TIMEOUT)
+
+def test_progress_and_partial_results(executor):
+    reported, release = threading.Event(), threading.Event()
+    def run(job):
+        job.set_progress(1.5, "almost")
+        job.set_progress(0.5, "1/2 chunks")
+        job.partial = ["chunk-0.wav"]
+        reported.set()
+        assert release.wait(TIMEOUT)
+        return "story.wav"
+    job_id = executor.submit("narrate", run)
+    assert reported.wait(TIMEOUT)
+    status = executor.status(job_id)
+    assert (status["progress"], status["message"], status["partial"]) == (0.5, "1/2 chunks", ["chunk-0.wav"])
+    release.set()
+    assert executor.result(job_id, TIMEOUT) == "story.wav"
+    assert executor.status(job_id)["progress"] == 1.0
+
+def test_oldest_finished_jobs_are_pruned():
+    executor = JobExecutor(max_workers=1, max_finished=2)
+    finished = [executor.submit("echo", lambda job, i=i: i) for i in range(3)]
+    for job_id in finished:
+        executor.result(job_id, TIMEOUT)
+    started, release = threading.Event(), threading.Event()
+    running = executor.submit("block", blocking_job(started, release))
+    assert executor.status(finished[0]) is None
+    assert [executor.status(job_id)["status"] for job_id in finished[1:]] == [DONE, DONE]
+    assert executor.status(running) is not None
+    with pytest.raises(KeyError):
+        executor.result(finished[0])
+    release.set()
+    executor.shutdown()
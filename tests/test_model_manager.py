@@ -0,0 +1,64 @@
+import time
+import pytest
+from benchmarks.fake_ollama import FakeOllamaServer
+from model_manager import ModelManager
+
+TIMEOUT = 5
+
+@pytest.fixture
+def servers():
+    servers = [FakeOllamaServer(models=("llama2:latest", "mistral:latest")).start(),
+               FakeOllamaServer(models=("llama2:latest",)).start()]
+    yield servers
+    for server in servers:
+        server.stop()
+
+def make_manager(servers, **kwargs):
+    return ModelManager(servers=[(server.host, server.port) for server in servers], refresh_interval=0.05, **kwargs)
+
+def wait_for(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_available_models_are_installed_on_every_server(servers):
+    manager = make_manager(servers)
+    wait_for(manager.available_models)
+    assert manager.available_models() == ["llama2:latest"]
+    manager.stop()
+
+def test_unreachable_server_is_left_out(servers):
+    servers[1].down = True
+    manager = make_manager(servers)
+    wait_for(manager.available_models)
+    assert manager.available_models() == ["llama2:latest", "mistral:latest"]
+    manager.stop()
+
+def test_preload_warms_every_server(servers):
+    manager = make_manager(servers)
+    assert manager.status("llama2") in ("cold", "loading")
+    manager.preload("llama2")
+    wait_for(lambda: manager.status("llama2") == "warm")
+    assert manager.warm_servers("llama2") == 2
+    assert all("llama2:latest" in server.loaded for server in servers)
+    manager.stop()
+
+def test_status_reads_cached_values_only(servers):
+    manager = make_manager(servers)
+    wait_for(manager.available_models)
+    manager.stop()
+    time.sleep(0.1)
+    # Asking the servers now would find nothing
+    for server in servers:
+        server.down = True
+    assert manager.available_models() == ["llama2:latest"]
+    assert manager.status("llama2") == "cold"
+
+def test_failed_load_is_reported(servers):
+    servers[1].error_rate = 1.0
+    manager = make_manager(servers)
+    manager.preload("llama2")
+    wait_for(lambda: manager.status("llama2") == "error")
+    assert f"{servers[1].host}:{servers[1].port}" in manager.last_error("llama2")
+    manager.stop()
@@ -0,0 +1,42 @@
+import pytest
+from ollama_client import OllamaClient, OllamaError
+
+class FakeResponse:
+    def __init__(self, lines):
+        self.lines = lines
+        self.closed = False
+
+    def iter_lines(self, chunk_size=None):
+        return iter(self.lines)
+
+    def close(self):
+        self.closed = True
+
+def client_returning(monkeypatch, lines):
+    client = OllamaClient(max_retries=0)
+    response = FakeResponse(lines)
+    monkeypatch.setattr(client, "_post", lambda *args, **kwargs: response)
+    return client, response
+
+def test_stream_yields_fragments_and_final_stats(monkeypatch):
+    client, response = client_returning(monkeypatch, [
+        b'{"response": "Once ", "done": false}', b"", b'{"response": "upon", "done": false}',
+        b'{"response": "", "done": true, "eval_count": 2, "context": [1, 2]}'])
+    stats = {}
+    assert list(client.generate_stream("prompt", stats=stats)) == ["Once ", "upon"]
+    assert stats["eval_count"] == 2 and stats["context"] == [1, 2]
+    assert response.closed
+
+def test_malformed_stream_line_raises_ollama_error(monkeypatch):
+    client, response = client_returning(monkeypatch, [b'{"response": "Once ", "done": false}', b'{"respon'])
+    fragments = client.generate_stream("prompt")
+    assert next(fragments) == "Once "
+    with pytest.raises(OllamaError) as raised:
+        next(fragments)
+    assert isinstance(raised.value.__cause__, ValueError)
+    assert response.closed
+
+def test_error_line_raises_ollama_error(monkeypatch):
+    client, _ = client_returning(monkeypatch, [b'{"error": "model not found"}'])
+    with pytest.raises(OllamaError, match="model not found"):
+        list(client.generate_stream("prompt"))
@@ -0,0 +1,90 @@
+import pytest
+import ollama_pool
+from benchmarks.fake_ollama import FakeOllamaServer
+from ollama_client import OllamaError
+from ollama_pool import OllamaPool, parse_backends
+
+@pytest.fixture
+def servers():
+    servers = [FakeOllamaServer(token_rate=10000, ttft=0).start() for _ in range(2)]
+    yield servers
+    for server in servers:
+        server.stop()
+
+@pytest.fixture
+def first_backend(monkeypatch):
+    # Among equally loaded backends, always pick the first, so tests know
+    # which one a request tries first
+    monkeypatch.setattr(ollama_pool.random, "choice", lambda backends: backends[0])
+
+def make_pool(servers):
+    return OllamaPool([(server.host, server.port, 1) for server in servers], health_interval=3600)
+
+class BrokenStream:
+    # Stands in for a backend client whose stream breaks after one fragment
+    def generate_stream(self, *args):
+        yield "Once"
+        raise OllamaError("Error connecting to Ollama: connection reset", retryable=True)
+
+def test_parse_backends():
+    assert parse_backends("gpu1:11435=4, gpu2,") == [("gpu1", 11435, 4), ("gpu2", 11434, 1)]
+
+def test_stream_fails_over_before_first_fragment(servers, first_backend):
+    servers[0].down = True
+    pool = make_pool(servers)
+    text = "".join(pool.client("llama2").generate_stream("Tell me a story about 20 words"))
+    assert text.startswith("Characters:")
+    assert servers[1].requests == 1
+    status = pool.status()
+    assert [backend["healthy"] for backend in status] == [False, True]
+    assert status[0]["failures"] == 1
+    assert all(backend["in_flight"] == 0 for backend in status)
+    pool.close()
+
+def test_stream_does_not_fail_over_after_first_fragment(servers, first_backend, monkeypatch):
+    pool = make_pool(servers)
+    monkeypatch.setattr(pool.backends[0], "client", lambda *args, **kwargs: BrokenStream())
+    fragments = []
+    with pytest.raises(OllamaError, match="connection reset"):
+        for fragment in pool.client("llama2").generate_stream("Tell me a story"):
+            fragments.append(fragment)
+    assert fragments == ["Once"]
+    assert servers[1].requests == 0
+    pool.close()
+
+def test_generate_fails_over(servers, first_backend):
+    servers[0].down = True
+    pool = make_pool(servers)
+    assert pool.client("llama2").generate("Tell me a story about 20 words").startswith("Characters:")
+    assert servers[1].requests == 1
+    pool.close()
+
+def test_overloaded_backend_stays_in_rotation(servers, first_backend):
+    servers[0].error_rate, servers[0].error_status = 1.0, 429
+    pool = make_pool(servers)
+    "".join(pool.client("llama2").generate_stream("Tell me a story"))
+    assert [backend.healthy for backend in pool.backends] == [True, True]
+    assert servers[1].requests == 1
+    pool.close()
+
+def test_all_backends_down(servers):
+    for server in servers:
+        server.down = True
+    pool = make_pool(servers)
+    with pytest.raises(OllamaError, match="All Ollama backends failed"):
+        "".join(pool.client("llama2").generate_stream("Tell me a story"))
+    with pytest.raises(OllamaError, match="No healthy Ollama backend"):
+        "".join(pool.client("llama2").generate_stream("Tell me a story"))
+    pool.close()
+
+def test_health_check_brings_backend_back(servers, first_backend):
+    servers[0].down = True
+    pool = make_pool(servers)
+    "".join(pool.client("llama2").generate_stream("Tell me a story"))
+    assert not pool.backends[0].healthy
+    servers[0].down = False
+    pool.check_health()
+    assert pool.backends[0].healthy
+    "".join(pool.client("llama2").generate_stream("Tell me a story"))
+    assert servers[0].requests == 1
+    pool.close()
@@ -0,0 +1,63 @@
+import random
+import pytest
+from benchmarks.fake_ollama import fake_story
+from story_parser import StoryStreamParser, parse_story
+
+def stream_parse(text, sizes):
+    parser = StoryStreamParser()
+    start = 0
+    for size in sizes:
+        parser.feed(text[start:start + size])
+        start += size
+    parser.feed(text[start:])
+    parser.close()
+    return parser.result()
+
+def random_sizes(text, rng):
+    sizes, total = [], 0
+    while total < len(text):
+        size = rng.randint(1, 12)
+        sizes.append(size)
+        total += size
+    return sizes
+
+MESSY = (
+    "Here is your story!\n"
+    "Characters:  \n"
+    "- Ada: a clockmaker\n"
+    "Bram, her rival\n"
+    "  - Cleo: a thief Setting: not a header\n"
+    "Setting:\n"
+    "A city of towers.   \n"
+    "\n"
+    "Story: is not a header here\n"
+    "Story:\n"
+    "It began at dawn.\n"
+    "Twist: inline text stays\n"
+    "   \n"
+    "Twist:\n"
+    "Ada was Bram all along.  "
+)
+
+@pytest.mark.parametrize("text", [fake_story(400), fake_story(50, num_characters=5), MESSY, "", "Story:", "no headers"])
+def test_one_chunk_matches_parse_story(text):
+    assert stream_parse(text, []) == parse_story(text)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_chunks_match_parse_story(seed):
+    rng = random.Random(seed)
+    text = MESSY if seed % 2 else fake_story(200, rng=rng)
+    assert stream_parse(text, random_sizes(text, rng)) == parse_story(text)
+
+def test_single_characters_match_parse_story():
+    assert stream_parse(MESSY, [1] * len(MESSY)) == parse_story(MESSY)
+
+def test_header_split_across_chunks_switches_section():
+    parser = StoryStreamParser()
+    events = []
+    for chunk in ("Sett", "ing:\nA dark ", "forest.\nStory:\nOnce"):
+        events += parser.feed(chunk)
+    events += parser.close()
+    assert parser.result() == ([], "A dark forest.", "Once", "")
+    assert [event for event in events if event[0] == "section"] == [("section", "setting"), ("section", "story")]
+    assert "".join(text for name, text in events if name == "story") == "Once"
@@ -0,0 +1,66 @@
+import random
+import pytest
+import storyteller
+from benchmarks.fake_ollama import FakeOllamaServer, fake_outline
+from generation_cache import GenerationCache
+from generation_scheduler import GenerationScheduler
+from story_parser import parse_story
+from story_pipeline import _prose, parse_outline, section_count, stream_story_pipeline
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    server = FakeOllamaServer(token_rate=10000, ttft=0).start()
+    monkeypatch.setattr(storyteller, "OLLAMA_HOST", server.host)
+    monkeypatch.setattr(storyteller, "OLLAMA_PORT", server.port)
+    storyteller.set_generation_cache(GenerationCache(str(tmp_path / "generations.sqlite")))
+    storyteller.set_scheduler(GenerationScheduler(4, 16, 120))
+    yield server
+    storyteller.set_scheduler(None)
+    storyteller.set_generation_cache(None)
+    server.stop()
+
+def test_parse_outline():
+    characters, setting, beats = parse_outline(fake_outline(3, num_characters=2, rng=random.Random(1)))
+    assert len(characters) == 2 and all(c.startswith("Character") for c in characters)
+    assert setting
+    assert len(beats) == 3
+
+def test_parse_outline_accepts_other_numbering():
+    text = "Characters:\n- Ada: a keeper\nSetting:\nA coast.\nOutline:\n1) The lamp fails.\n 2. Ships wreck.\nNotes: none\n"
+    assert parse_outline(text) == (["Ada: a keeper"], "A coast.", ["The lamp fails.", "Ships wreck."])
+
+def test_section_count():
+    assert [section_count(length) for length in (100, 500, 1000, 2000)] == [1, 1, 2, 4]
+
+@pytest.mark.parametrize("fragments", [
+    ["Story:\nThe lamp went dark.\nTwist:\nShe lied.\n"],
+    ["Sto", "ry:", "\nThe lamp went dark.\nTwi", "st:\nShe lied.\n"],
+    list("Story:\nThe lamp went dark.\nTwist:\nShe lied.\n"),
+])
+def test_prose_drops_header_lines(fragments):
+    assert "".join(_prose(fragments)) == "The lamp went dark.\nShe lied.\n"
+
+def test_prose_keeps_lines_that_only_start_like_a_header():
+    text = "Story: it began at dawn.\nStorytellers gathered.\n  Outline:\nSetting sun."
+    assert "".join(_prose([text])) == "Story: it began at dawn.\nStorytellers gathered.\nSetting sun."
+
+def test_pipeline_output_parses_like_a_single_shot_story(server):
+    stats = {}
+    fragments, from_cache = stream_story_pipeline("Fantasy", 3, "Betrayal", 1500, "Dark", stats=stats, session="a")
+    assert not from_cache
+    raw = "".join(fragments)
+    characters, setting, story, twist = parse_story(raw)
+    assert len(characters) == 3
+    assert setting and twist
+    assert len(story.split()) >= 1000
+    assert "Outline:" not in raw
+    assert stats["sections"] == 3
+    assert stats["context"]
+    # Outline, three sections and the twist
+    assert server.requests == 5
+
+def test_seeded_pipeline_story_is_cached(server):
+    fragments, _ = stream_story_pipeline("Horror", 2, "Time Loop", 1000, "Dark", seed=3)
+    raw = "".join(fragments)
+    again, from_cache = stream_story_pipeline("Horror", 2, "Time Loop", 1000, "Dark", seed=3)
+    assert from_cache and "".join(again) == raw
@@ -0,0 +1,75 @@
+import threading
+import pytest
+from generation_scheduler import GenerationScheduler
+from ollama_client import OllamaError
+from story_prefetch import StoryPrefetcher
+
+SETTINGS = [{"genre": genre, "twist_style": "Betrayal", "tone": "Dark"} for genre in ("Fantasy", "Horror", "Sci-Fi")]
+
+@pytest.fixture
+def scheduler():
+    scheduler = GenerationScheduler(max_concurrency=1, max_queue=4, max_wait=120)
+    yield scheduler
+    scheduler._pool.shutdown(wait=False)
+
+def make_prefetcher(scheduler, produce=None, **kwargs):
+    draws = iter(SETTINGS * 10)
+    def default_produce(settings, stats):
+        yield f"A {settings['genre']} story."
+    return StoryPrefetcher(scheduler, produce or default_produce, lambda: dict(next(draws)), **kwargs)
+
+def test_fills_up_to_target_size(scheduler):
+    prefetcher = make_prefetcher(scheduler, target_size=2)
+    assert prefetcher.fill_one() and prefetcher.fill_one()
+    assert not prefetcher.fill_one()
+    assert prefetcher.stats()["pooled"] == 2
+
+def test_take_matches_settings_and_hands_out_once(scheduler):
+    prefetcher = make_prefetcher(scheduler, target_size=3)
+    while prefetcher.fill_one():
+        pass
+    assert prefetcher.take(genre="Romance") is None
+    assert prefetcher.take(genre="Horror")["raw"] == "A Horror story."
+    assert prefetcher.take(genre="Horror") is None
+    assert prefetcher.stats()["hits"] == 1
+    assert len(prefetcher) == 2
+
+def test_one_story_per_combination(scheduler):
+    prefetcher = make_prefetcher(scheduler, target_size=3)
+    prefetcher.random_settings = lambda: dict(SETTINGS[0])
+    assert prefetcher.fill_one()
+    assert not prefetcher.fill_one()
+
+def test_waits_while_scheduler_is_busy(scheduler):
+    prefetcher = make_prefetcher(scheduler)
+    release = threading.Event()
+    def produce(stats):
+        release.wait(5)
+        yield "Once"
+    stream = scheduler.submit("story", produce, session="a")
+    assert not prefetcher.fill_one()
+    release.set()
+    assert "".join(stream) == "Once"
+    assert prefetcher.fill_one()
+
+def test_failed_generation_is_counted_not_pooled(scheduler):
+    def produce(settings, stats):
+        raise OllamaError("Ollama is down")
+        yield
+    prefetcher = make_prefetcher(scheduler, produce)
+    assert not prefetcher.fill_one()
+    assert prefetcher.stats()["failed"] == 1
+    assert len(prefetcher) == 0
+
+def test_stops_refilling_when_unused(scheduler):
+    prefetcher = make_prefetcher(scheduler, max_age=60)
+    prefetcher._last_used -= 61
+    assert not prefetcher.fill_one()
+    prefetcher.take()
+    assert prefetcher.fill_one()
+
+def test_old_stories_expire(scheduler):
+    prefetcher = make_prefetcher(scheduler, max_age=60)
+    assert prefetcher.fill_one()
+    prefetcher._stories[0]['created'] -= 61
+    assert prefetcher.take() is None
@@ -0,0 +1,110 @@
+import pytest
+from story_parser import parse_story
+from story_store import StoryStore
+from storyteller import add_chapter
+
+def raw_story(name, words):
+    return f"Characters:\n- {name}: a traveller\nSetting:\nA quiet harbor.\nStory:\n{words}\nTwist:\nIt was a dream.\n"
+
+def make_story(name="Ada", words="The lantern flickered.", genre="Fantasy", tone="Dark", twist_style="Betrayal"):
+    raw = raw_story(name, words)
+    characters, setting, story, twist = parse_story(raw)
+    story_dict = {"genre": genre, "tone": tone, "twist_style": twist_style, "model": "llama2",
+                  "characters": characters, "setting": setting, "story": story, "twist": twist}
+    add_chapter(story_dict, raw, {"context": [1, 2, 3]})
+    return story_dict
+
+@pytest.fixture
+def store(tmp_path):
+    store = StoryStore(str(tmp_path / "stories.sqlite"))
+    yield store
+    store.close()
+
+def continue_story(store, story, words):
+    raw = raw_story(story['characters'][0].split(":")[0], words)
+    story['characters'], story['setting'], story['story'], story['twist'] = parse_story(raw)
+    add_chapter(story, raw, {"context": [4, 5]})
+    store.append_chapter(story)
+
+def test_create_and_load_round_trip(store):
+    story = make_story()
+    story_id = store.create(story)
+    loaded = store.load(story_id)
+    for name in ("genre", "tone", "twist_style", "model", "characters", "setting", "story", "twist", "raw"):
+        assert loaded[name] == story[name]
+    assert loaded["context"] == [1, 2, 3]
+    assert loaded["history"] == [story["raw"]]
+    assert store.load(story_id + 1) is None
+
+def test_append_chapter_replaces_open_chapter(store):
+    story = make_story()
+    story["id"] = store.create(story)
+    continue_story(store, story, "The harbor froze over.")
+    loaded = store.load(story["id"])
+    assert loaded["story"] == "The harbor froze over."
+    assert loaded["context"] == [4, 5]
+    assert len(loaded["history"]) == 2
+    assert store.list()[0]["chapters"] == 2
+
+def test_summarized_chapters_are_not_read_back(store):
+    story = make_story()
+    story["id"] = store.create(story)
+    # As continuation_request does once the context outgrows its budget
+    story["summary"] = "Ada sailed away."
+    story["history"] = story["history"][-1:]
+    continue_story(store, story, "A new chapter.")
+    loaded = store.load(story["id"])
+    assert loaded["summary"] == "Ada sailed away."
+    assert len(loaded["history"]) == 2
+
+def test_list_pages_newest_first(store):
+    ids = [store.create(make_story(name=f"Character{i}")) for i in range(5)]
+    assert store.count() == 5
+    pages = [store.list(offset, 2) for offset in (0, 2, 4)]
+    assert [[row["id"] for row in page] for page in pages] == [ids[4:2:-1], ids[2:0:-1], ids[:1]]
+    assert "raw" not in pages[0][0]
+
+def test_iter_stories_yields_every_story_oldest_first(store):
+    ids = [store.create(make_story(name=f"Character{i}")) for i in range(7)]
+    assert [story["id"] for story in store.iter_stories(batch=3)] == ids
+
+def test_stories_survive_reopening(tmp_path):
+    path = str(tmp_path / "stories.sqlite")
+    first = StoryStore(path)
+    story_id = first.create(make_story())
+    first.close()
+    second = StoryStore(path)
+    assert second.load(story_id)["characters"] == ["Ada: a traveller"]
+    second.close()
+
+def test_search_matches_every_word_and_prefixes(store):
+    lantern = store.create(make_story(words="The lantern flickered over the frozen harbor."))
+    store.create(make_story(words="A storm rolled over the desert."))
+    assert [row["id"] for row in store.search("lantern harbor")] == [lantern]
+    assert [row["id"] for row in store.search("lant")] == [lantern]
+    assert store.search("lantern desert") == []
+
+def test_search_filters_on_facets(store):
+    dark = store.create(make_story(words="The lantern went out.", tone="Dark"))
+    store.create(make_story(words="The lantern glowed.", tone="Humorous", genre="Comedy"))
+    assert [row["id"] for row in store.search("lantern", tone="Dark")] == [dark]
+    assert [row["id"] for row in store.search(genre="Fantasy")] == [dark]
+    assert len(store.search()) == 2
+
+def test_search_sees_appended_chapters(store):
+    story = make_story()
+    story["id"] = store.create(story)
+    assert store.search("iceberg") == []
+    continue_story(store, story, "An iceberg drifted into the bay.")
+    assert [row["id"] for row in store.search("iceberg")] == [story["id"]]
+
+def test_facet_counts_most_common_first(store):
+    for genre in ("Fantasy", "Horror", "Fantasy"):
+        store.create(make_story(genre=genre))
+    counts = store.facet_counts()
+    assert list(counts["genre"].items()) == [("Fantasy", 2), ("Horror", 1)]
+    assert counts["tone"] == {"Dark": 3}
+
+def test_get_many_keeps_order_and_skips_missing(store):
+    ids = [store.create(make_story(name=f"Character{i}")) for i in range(3)]
+    assert [row["id"] for row in store.get_many([ids[2], 999, ids[0]])] == [ids[2], ids[0]]
@@ -0,0 +1,72 @@
+import pytest
+import storyteller
+from benchmarks.fake_ollama import FakeOllamaServer
+from generation_cache import GenerationCache
+from generation_scheduler import GenerationScheduler
+from storyteller import CONTINUE_INSTRUCTION, continuation_request, stream_story
+
+SETTINGS = ("Fantasy", 2, "Betrayal", 100, "Dark")
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    server = FakeOllamaServer(token_rate=10000, ttft=0).start()
+    monkeypatch.setattr(storyteller, "OLLAMA_HOST", server.host)
+    monkeypatch.setattr(storyteller, "OLLAMA_PORT", server.port)
+    storyteller.set_generation_cache(GenerationCache(str(tmp_path / "generations.sqlite")))
+    storyteller.set_scheduler(GenerationScheduler(2, 8, 120))
+    yield server
+    storyteller.set_scheduler(None)
+    storyteller.set_generation_cache(None)
+    server.stop()
+
+def story(context, chapters=2):
+    history = [f"Chapter {i}" for i in range(1, chapters + 1)]
+    return {"raw": history[-1], "history": history, "context": context, "model": None}
+
+def test_default_budget_leaves_room_for_a_chapter():
+    assert storyteller.CONTEXT_TOKEN_BUDGET + storyteller.CHAPTER_TOKENS <= storyteller.NUM_CTX
+
+def test_context_within_budget_is_resent(monkeypatch):
+    monkeypatch.setattr(storyteller, "CONTEXT_TOKEN_BUDGET", 10)
+    prompt, context = continuation_request(story(list(range(10))))
+    assert context == list(range(10))
+    assert CONTINUE_INSTRUCTION in prompt
+    assert "Chapter" not in prompt
+
+def test_context_over_budget_becomes_a_summary(monkeypatch):
+    monkeypatch.setattr(storyteller, "CONTEXT_TOKEN_BUDGET", 10)
+    summarized = []
+    def summarize_story(summary, chapters, model=None, session=None):
+        summarized.append(chapters)
+        return "Ada sailed away."
+    monkeypatch.setattr(storyteller, "summarize_story", summarize_story)
+    continued = story(list(range(11)))
+    prompt, context = continuation_request(continued)
+    assert context is None
+    assert summarized == [["Chapter 1"]]
+    assert "Ada sailed away." in prompt and "Chapter 2" in prompt
+    assert continued["history"] == ["Chapter 2"]
+
+def test_num_ctx_is_sent_only_when_configured(monkeypatch):
+    monkeypatch.delenv("OLLAMA_NUM_CTX", raising=False)
+    assert storyteller.sampling_options(7) == {"seed": 7}
+    monkeypatch.setenv("OLLAMA_NUM_CTX", "8192")
+    monkeypatch.setattr(storyteller, "NUM_CTX", 8192)
+    assert storyteller.sampling_options() == {"num_ctx": 8192}
+
+def test_unseeded_stories_are_new_unless_reuse_is_asked_for(server):
+    first, from_cache = stream_story(*SETTINGS)
+    "".join(first)
+    assert not from_cache
+    _, from_cache = stream_story(*SETTINGS)
+    assert not from_cache
+    reused, from_cache = stream_story(*SETTINGS, use_cache=True)
+    assert from_cache
+
+def test_seeded_stories_are_served_from_cache(server):
+    first, _ = stream_story(*SETTINGS, seed=7)
+    text = "".join(first)
+    again, from_cache = stream_story(*SETTINGS, seed=7)
+    assert from_cache and "".join(again) == text
+    _, from_cache = stream_story(*SETTINGS, seed=7, use_cache=False)
+    assert not from_cache